@@ -0,0 +1,129 @@
+#鎖票端點吞吐量測試
+#比較舊版同步 Redis 客戶端(直接在事件迴圈上阻塞)與 asyncio 版 RedisTools
+#
+#使用方式:
+#   python -m Backend.Benchmark.LockBenchmark --requests 5000 --concurrency 200
+#需要 .env 中的 REDISPUBLICURL，測試用的鍵在結束後會刪除
+#第 i 個使用者點選預設座位配置中的第 i 個座位(超過座位數後重複點選已鎖定的座位)，
+#鎖定成功數應等於 min(請求數, 座位數)，不相符時以非 0 結束
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+import redis as syncredis
+from dotenv import load_dotenv
+from urllib.parse import urlparse
+
+from ..Modules import TicketModule
+from ..ProjectTools.RedisTools import RedisTools
+from ..ProjectTools.RequestTools import RequestTools
+from ..ProjectTools.SeatTools import SeatTools
+
+#模擬 FastAPI 的 Request
+class FakeRequest:
+    def __init__(self,loginID,data):
+        self.session = {"UserID":loginID}
+        self.data = data
+
+    async def json(self):
+        return self.data
+
+#舊版鎖票流程(同步客戶端，每次點擊四次往返)
+class SyncRedisTools:
+    def __init__(self,URL):
+        url = urlparse(URL)
+        self.r = syncredis.Redis(host=url.hostname,port=url.port,password=url.password,decode_responses=True)
+
+    #不限制購票人數
+    async def QueueCap(self,event_id):
+        return 0
+
+    async def TicketLock(self,seatLockKey,userSeatIndexKey,loginID,event_id=None,ordinal=None):
+        lock = self.r.get(seatLockKey)
+        if not lock:
+            if not self.r.set(userSeatIndexKey, seatLockKey, nx=True, ex=60):
+                return {"status":False,"notify":"不可多選 !"}
+            self.r.set(seatLockKey, loginID , nx=True, ex=60)
+            return {"status":True,"time":self.r.pttl(seatLockKey)/1000}
+        if lock==loginID:
+            return {"status":True,"time":self.r.pttl(seatLockKey)/1000}
+        return {"status":False,"notify":"此位置已經被選取，請稍後再試 !"}
+
+#預設座位配置中的所有座位(區域, 排, 位)
+def Seats(seatT,event_id):
+    return [(area,row,column)
+            for area,rows,cols in seatT.GetLayout(event_id).sections
+            for row in range(1,rows+1)
+            for column in range(1,cols+1)]
+
+async def Run(redisT,total,concurrency,tag):
+    reqT = RequestTools()
+    seatT = SeatTools()
+    seats = Seats(seatT,tag)
+    semaphore = asyncio.Semaphore(concurrency)
+    acquired = 0
+
+    #測試活動沒有購票紀錄，售出點陣圖先以空白初始化，鎖票時不需查詢資料庫(sqlT)
+    if isinstance(redisT,RedisTools):
+        InitSeatMap_result = await redisT.InitSeatMap(event_id=tag,ordinals=[])
+        if not InitSeatMap_result["status"]:
+            raise RuntimeError(InitSeatMap_result["notify"])
+
+    async def Click(i):
+        nonlocal acquired
+        area,row,column = seats[i % len(seats)]
+        request = FakeRequest(f"{tag}-user-{i}",{"event_id":tag,"area":area,"row":row,"column":column})
+        async with semaphore:
+            result = await TicketModule.Lock(request=request,reqT=reqT,sqlT=None,redisT=redisT,seatT=seatT)
+        if result["status"]:
+            acquired += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(Click(i) for i in range(total)))
+    elapsed = time.perf_counter()-start
+    return {"elapsed":elapsed,"throughput":total/elapsed,"acquired":acquired,"expected":min(total,len(seats))}
+
+#刪除測試用的鍵(鎖票、使用者索引、座位點陣圖及鎖定紀錄)
+def Cleanup(URL,tag):
+    r = syncredis.Redis.from_url(URL)
+    for pattern in (f"<seatLock>:\\[{tag}:*",f"<userSeatIndex>:\\[{tag}-*"):
+        keys = list(r.scan_iter(match=pattern,count=1000))
+        if keys:
+            r.delete(*keys)
+    r.delete(*(f"<{name}>:[{tag}]" for name in ("seatSold","seatHeld","seatHold","seatMapReady","seatVersion","seatChange","seatHoldOwner")))
+    r.srem("<seatHoldEvents>",tag)
+
+async def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests",type=int,default=5000)
+    parser.add_argument("--concurrency",type=int,default=200)
+    parser.add_argument("--pool",type=int,default=50)
+    args = parser.parse_args()
+
+    load_dotenv()
+    URL = os.getenv("REDISPUBLICURL")
+    results = {}
+
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    results["sync (before)"] = await Run(SyncRedisTools(URL),args.requests,args.concurrency,tag)
+    Cleanup(URL,tag)
+
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    redisT = RedisTools(URL,maxConnections=args.pool)
+    results["asyncio (after)"] = await Run(redisT,args.requests,args.concurrency,tag)
+    await redisT.Close()
+    Cleanup(URL,tag)
+
+    print(f"requests={args.requests} concurrency={args.concurrency} pool={args.pool}")
+    print(f"{'client':<18}{'elapsed(s)':>12}{'req/s':>12}{'acquired':>10}{'expected':>10}")
+    for name,result in results.items():
+        print(f"{name:<18}{result['elapsed']:>12.3f}{result['throughput']:>12.1f}{result['acquired']:>10}{result['expected']:>10}")
+    if any(result["acquired"] != result["expected"] for result in results.values()):
+        print("acquired != expected")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    asyncio.run(Main())
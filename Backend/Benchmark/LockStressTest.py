@@ -0,0 +1,71 @@
+#鎖票併發壓力測試
+#大量使用者同時搶少數熱門座位，檢查每個座位只有一位得主、每位使用者最多鎖一個座位
+#
+#使用方式:
+#   python -m Backend.Benchmark.LockStressTest --users 2000 --seats 5
+#需要 .env 中的 REDISPUBLICURL，測試用的鍵在結束後會刪除，違規時以非 0 結束
+import argparse
+import asyncio
+import os
+import random
+import sys
+import uuid
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+from ..ProjectTools.RedisTools import RedisTools
+
+async def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users",type=int,default=2000)
+    parser.add_argument("--seats",type=int,default=5)
+    parser.add_argument("--clicks",type=int,default=3,help="每位使用者點擊次數")
+    parser.add_argument("--pool",type=int,default=100)
+    args = parser.parse_args()
+
+    load_dotenv()
+    redisT = RedisTools(os.getenv("REDISPUBLICURL"),maxConnections=args.pool)
+    tag = f"stress-{uuid.uuid4().hex[:8]}"
+    seats = [f"<seatLock>:[{tag}:A區:1:{column}]" for column in range(1,args.seats+1)]
+
+    winners = defaultdict(set)  #座位 -> 鎖票成功的使用者
+    held = defaultdict(set)     #使用者 -> 鎖票成功的座位
+
+    async def Click(loginID):
+        seatLockKey = random.choice(seats)
+        result = await redisT.TicketLock(seatLockKey=seatLockKey,
+                                         userSeatIndexKey=f"<userSeatIndex>:[{loginID}]",
+                                         loginID=loginID)
+        if result["status"]:
+            winners[seatLockKey].add(loginID)
+            held[loginID].add(seatLockKey)
+        elif "Error" in result["notify"]:
+            raise RuntimeError(result["notify"])
+
+    users = [f"{tag}-user-{i}" for i in range(args.users)]
+    await asyncio.gather(*(Click(loginID) for loginID in users for _ in range(args.clicks)))
+
+    failures = []
+    for seatLockKey in seats:
+        owner = await redisT.r.get(seatLockKey)
+        if len(winners[seatLockKey]) > 1:
+            failures.append(f"{seatLockKey} 有 {len(winners[seatLockKey])} 位得主")
+        if winners[seatLockKey] and {owner} != winners[seatLockKey]:
+            failures.append(f"{seatLockKey} 的持有者 {owner} 與得主 {winners[seatLockKey]} 不一致")
+    doubleLocks = [loginID for loginID,seatSet in held.items() if len(seatSet) > 1]
+    if doubleLocks:
+        failures.append(f"{len(doubleLocks)} 位使用者同時鎖了多個座位")
+
+    await redisT.r.delete(*seats,*(f"<userSeatIndex>:[{loginID}]" for loginID in users))
+    await redisT.Close()
+
+    print(f"users={args.users} seats={args.seats} clicks={args.users*args.clicks} "
+          f"winners={sum(len(_) for _ in winners.values())} doubleLocks={len(doubleLocks)}")
+    if failures:
+        print("\n".join(failures))
+        sys.exit(1)
+    print("OK : 每個座位只有一位得主")
+
+if __name__ == "__main__":
+    asyncio.run(Main())
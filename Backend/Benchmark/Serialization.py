@@ -0,0 +1,74 @@
+#回應序列化測試
+#比較 jsonable_encoder + JSONResponse(舊)與 FastJSONResponse(orjson)輸出座位狀態、會員資料的時間
+#
+#使用方式:
+#   python -m Backend.Benchmark.Serialization --loops 2000 --tickets 50
+import argparse
+import base64
+import datetime
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from ..ProjectTools.ResponseTools import FastJSONResponse
+from ..ProjectTools.SeatTools import SeatTools
+
+#售出約一半座位的座位狀態(fmt=full)
+def AvailabilityPayload(seatT):
+    layout = seatT.GetLayout(1)
+    size = (layout.total+7)//8
+    sold = bytes(0xAA for _ in range(size))
+    held = bytes(size)
+    available = layout.Available(sold,held)
+    return {
+        "status": True,
+        "event_id": 1,
+        "version": 12345,
+        "etag": seatT.ETag(1,"full",12345),
+        "seats": layout.total,
+        "capacity": layout.capacity,
+        "layout": layout.Sections(),
+        "sold": base64.b64encode(sold).decode(),
+        "held": base64.b64encode(held).decode(),
+        "available": base64.b64encode(available).decode(),
+        "availableCount": int.from_bytes(available,"big").bit_count(),
+        "purchased": layout.Decode(sold)
+    }
+
+#pymysql 回傳的會員資料(日期為 date / datetime)
+def ProfilePayload(tickets):
+    profileData = {"login_id":"benchmark","name":"測試使用者","gender":"男","birthday":datetime.date(1990,1,1),
+                   "email":"benchmark@example.com","phone_number":"0212345678","mobile_number":"0912345678",
+                   "address":"台北市信義區"}
+    profileData["ticket"] = [["演唱會 "+str(i),datetime.datetime(2025,12,31,19,30),"台北小巨蛋",f"特A區 | 第{i%20+1}排 第{i%30+1}位"]
+                             for i in range(tickets)]
+    return {"status":True,
+            "notify":"會員資料提取完成 !",
+            "profileData":profileData}
+
+def Measure(render,payload,loops):
+    start = time.perf_counter()
+    for _ in range(loops):
+        body = render(payload)
+    return (time.perf_counter()-start)/loops,len(body)
+
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loops",type=int,default=2000)
+    parser.add_argument("--tickets",type=int,default=50,help="會員資料中的購票紀錄數")
+    args = parser.parse_args()
+
+    renders = [("jsonable_encoder+JSONResponse",lambda payload:JSONResponse(jsonable_encoder(payload)).body),
+               ("FastJSONResponse",lambda payload:FastJSONResponse(payload).body)]
+    payloads = [("availability",AvailabilityPayload(SeatTools())),
+                ("profile",ProfilePayload(args.tickets))]
+    for name,payload in payloads:
+        results = [(tag,)+Measure(render,payload,args.loops) for tag,render in renders]
+        base = results[0][1]
+        print(f"[{name}]")
+        for tag,seconds,size in results:
+            print(f"  {tag:<30} {seconds*1e6:9.1f} us  {size:>7} bytes  x{base/seconds:.1f}")
+
+if __name__ == "__main__":
+    Main()
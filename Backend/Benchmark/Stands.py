@@ -0,0 +1,102 @@
+#壓力測試用的本機替身
+#  SqliteAsyncSqlTools : 以 SQLite 檔案取代 MySQL，沿用 SqlTools 的所有方法與連線池
+#  FakeRedisTools      : 以 fakeredis(需安裝 lupa 以執行 Lua 腳本)取代 Redis
+import sqlite3
+
+import fakeredis
+import pymysql
+
+from ..ProjectTools.RedisTools import MeteredConnectionPool,RedisTools
+from ..ProjectTools.SqlTools import AsyncSqlTools,SqlTools
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS register(id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    login_id TEXT UNIQUE,password TEXT,name TEXT,gender TEXT,birthday TEXT,
+                                    email TEXT,phone_number TEXT,mobile_number TEXT,address TEXT,secret TEXT);
+CREATE TABLE IF NOT EXISTS event(id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 title TEXT,date TEXT,location TEXT);
+CREATE TABLE IF NOT EXISTS seat_layout(event_id INTEGER,position INTEGER,area TEXT,
+                                       `rows` INTEGER,`cols` INTEGER,blocked TEXT,
+                                       PRIMARY KEY(event_id,position));
+CREATE TABLE IF NOT EXISTS ticket(id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                  register_id INTEGER,event_id INTEGER,area TEXT,`row` INTEGER,`column` INTEGER,
+                                  UNIQUE(event_id,area,`row`,`column`));
+"""
+
+#pymysql 風格的游標 : 支援 with、%s 參數，唯一鍵衝突轉為 pymysql 的 IntegrityError
+class SqliteCursor:
+    def __init__(self,cur):
+        self.cur = cur
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.cur.close()
+
+    def execute(self,INSTRUCTION,SET=None):
+        try:
+            return self.cur.execute(INSTRUCTION.replace("%s","?"),SET or ())
+        except sqlite3.IntegrityError as e:
+            raise pymysql.err.IntegrityError(*e.args) from e
+
+    def executemany(self,INSTRUCTION,SETS):
+        try:
+            return self.cur.executemany(INSTRUCTION.replace("%s","?"),SETS)
+        except sqlite3.IntegrityError as e:
+            raise pymysql.err.IntegrityError(*e.args) from e
+
+    def fetchall(self):
+        return tuple(self.cur.fetchall())
+
+#pymysql 風格的連線
+class SqliteConnection:
+    def __init__(self,path):
+        self.con = sqlite3.connect(path,check_same_thread=False,isolation_level=None,timeout=30)
+        self.con.execute("PRAGMA journal_mode=WAL")
+
+    def cursor(self):
+        return SqliteCursor(self.con.cursor())
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def ping(self,reconnect=False):
+        self.con.execute("SELECT 1")
+
+    def close(self):
+        self.con.close()
+
+#URL 格式 : sqlite:///檔案路徑(副本可指向同一個檔案)
+class SqliteSqlTools(SqlTools):
+    def Connect(self):
+        return SqliteConnection(self.url.path)
+
+    def ConnectTo(self,url):
+        return SqliteConnection(url.path)
+
+    #建立資料表
+    def CreateSchema(self):
+        con = self.Connect()
+        con.con.executescript(SCHEMA)
+        con.close()
+
+class SqliteAsyncSqlTools(AsyncSqlTools):
+    SqlClass = SqliteSqlTools
+
+class FakeRedisTools(RedisTools):
+    def __init__(self,URL="redis://fakeredis",**poolOptions):
+        self.server = fakeredis.FakeServer()
+        super().__init__(URL,**poolOptions)
+
+    def CreatePool(self,decode):
+        return MeteredConnectionPool(metricsT=self.metricsT,
+                                     poolName="decoded" if decode else "raw",
+                                     connection_class=fakeredis.FakeAsyncConnection,
+                                     server=self.server,
+                                     decode_responses=decode,
+                                     max_connections=self.poolOptions["max_connections"],
+                                     timeout=self.poolOptions["timeout"])
@@ -8,23 +8,15 @@ async def Check(request,reqT,sqlT):
             loginIDInput = data["login_id"]
             passwordInput = data["password"]
 
-            GetUserData_result = sqlT.GetUserData(loginIDInput=loginIDInput,passwordInput=passwordInput)
+            GetLoginData_result = await sqlT.GetLoginData(loginIDInput=loginIDInput,passwordInput=passwordInput)
             
-            if not GetUserData_result["status"]:
-                return GetUserData_result
+            if not GetLoginData_result["status"]:
+                return GetLoginData_result
             
-            userData = GetUserData_result["userData"]
-            if userData:
-                
-                GetUserName_result = sqlT.GetUserName(loginIDInput=loginIDInput,passwordInput=passwordInput)
-                if not GetUserName_result["status"]:
-                    return GetUserName_result
-                userName = GetUserName_result["userName"]
-
-                GetUserID_result = sqlT.GetRegisterID(loginIDInput=loginIDInput,passwordInput=passwordInput)
-                if not GetUserID_result:
-                    return GetUserID_result
-                registerID = GetUserID_result["registerID"]
+            loginData = GetLoginData_result["loginData"]
+            if loginData:
+                userName = loginData["userName"]
+                registerID = loginData["registerID"]
 
                 request.session["UserID"] = loginIDInput
                 request.session["UserName"] = userName
@@ -1,35 +1,32 @@
-from fastapi.encoders import jsonable_encoder
-
 #取得使用者資料
-def GetProfileData(request,sqlT):
+#會員資料與購票紀錄一次查詢，並依註冊編號快取
+#session 中的 ProfileVersion 於購票後更新，讓其他 worker 的舊快取失效
+#有 writeT 時(write-behind)，合併尚未寫入資料庫的購票紀錄，購票後立即可見
+#寫入時座位已由其他使用者購買的紀錄列在 failedTicket
+async def GetProfileData(request,sqlT,writeT=None):
     try:
-        loginID = request.session["UserID"]
-        
-        profileColumn = ["login_id","name","gender","birthday",
-                         "email","phone_number","mobile_number","address"]
-        
-        ticketColumn = ["title","date","location",
-                        "area","`row`","`column`"]
-        
         registerID = request.session["RegisterID"]
         
-        GetProfileData_result = sqlT.GetProfileData(profileColumn=profileColumn,loginID=loginID)
+        GetProfileData_result = await sqlT.GetProfileData(registerID=registerID,version=request.session.get("ProfileVersion"))
         if not GetProfileData_result["status"]:
             return GetProfileData_result
         profileData = GetProfileData_result["profileData"]
 
-        GetTicketData_result = sqlT.GetTicketData(registerID=registerID,ticketColumn=ticketColumn)
-        if not GetTicketData_result["status"]:
-            return GetTicketData_result
-        ticketData = GetTicketData_result["ticketData"]
+        if writeT is not None:
+            GetPendingTickets_result = await writeT.GetPendingTickets(registerID=registerID)
+            if not GetPendingTickets_result["status"]:
+                return GetPendingTickets_result
+            if GetPendingTickets_result["tickets"] or GetPendingTickets_result["failed"]:
+                MergeTickets_result = await sqlT.MergeTickets(profileData=profileData,tickets=GetPendingTickets_result["tickets"],
+                                                              failed=GetPendingTickets_result["failed"])
+                if not MergeTickets_result["status"]:
+                    return MergeTickets_result
+                profileData = MergeTickets_result["profileData"]
 
-        profileData = dict(zip(profileColumn+["ticket"],profileData+[ticketData]))
-        userID = request.session["UserID"]
-        userName = request.session["UserName"]
         return {"status":True,
                 "notify":"會員資料提取完成 !",
-                "profileData":jsonable_encoder(profileData)}
+                "profileData":profileData}
     
     except Exception as e:
-        return {"status":True,
+        return {"status":False,
                 "notify":f"GetProfileDataError ! message : [{type(e)} | {e}]"}
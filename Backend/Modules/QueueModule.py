@@ -0,0 +1,53 @@
+#排隊(等候室)
+#入場後把資格到期時間寫入 session(有簽章，前端無法竄改)，鎖票時只需比對時間
+async def Join(request,reqT,redisT):
+
+    response = await reqT.GetJson(request = request)
+    if response["status"]:
+        try:
+            loginID = request.session["UserID"]
+            event_id = response["data"]["event_id"]
+
+            QueueJoin_result = await redisT.QueueJoin(event_id=event_id,loginID=loginID)
+            if QueueJoin_result["status"] and QueueJoin_result["admitted"] and QueueJoin_result["expiresAt"]:
+                admission = dict(request.session.get("Admission",{}))
+                admission[str(event_id)] = QueueJoin_result["expiresAt"]
+                request.session["Admission"] = admission
+            return QueueJoin_result
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"QueueModule_JoinError ! message : [{type(e)} {e}]"}
+    return response
+
+#離開排隊
+async def Leave(request,reqT,redisT):
+
+    response = await reqT.GetJson(request = request)
+    if response["status"]:
+        try:
+            loginID = request.session["UserID"]
+            event_id = response["data"]["event_id"]
+            return await Release(request=request,redisT=redisT,event_id=event_id,loginID=loginID)
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"QueueModule_LeaveError ! message : [{type(e)} {e}]"}
+    return response
+
+#讓出購票名額並移除 session 中的入場資格
+async def Release(request,redisT,event_id,loginID):
+    admission = dict(request.session.get("Admission",{}))
+    admission.pop(str(event_id),None)
+    request.session["Admission"] = admission
+    return await redisT.QueueLeave(event_id=event_id,loginID=loginID)
+
+#入場檢查
+#有設定上限的活動，需持有未過期的入場資格；上限設定在行程內快取，通常不需 I/O
+async def CheckAdmission(request,redisT,event_id):
+    if await redisT.QueueCap(event_id) <= 0:
+        return {"status":True}
+    expiresAt = request.session.get("Admission",{}).get(str(event_id),0)
+    if expiresAt > redisT.Now():
+        return {"status":True}
+    return {"status":False,
+            "queue":True,
+            "notify":"目前購票人數眾多，請先排隊，輪到您後才可選位 !"}
@@ -1,5 +1,6 @@
 #顯示QRcode
-async def ShowQRcode(request,reqT,totpT):
+#format : png / svg，未指定時使用 fmt
+async def ShowQRcode(request,reqT,totpT,fmt="png"):
     response = await reqT.GetJson(request=request)
     if response["status"]:
         try:
@@ -8,7 +9,8 @@ async def ShowQRcode(request,reqT,totpT):
             secret = totpT.GetSecret(request=request)
             totpobject = totpT.GetTotpObject(secret=secret)
             uri = totpT.GetUri(totpobject=totpobject,email=email)
-            src = totpT.GetQRcodeSrc(uri=uri)
+            fmt = "svg" if data.get("format",fmt) == "svg" else "png"
+            src = await totpT.RenderQRcode(uri=uri,fmt=fmt)
             return {"status":True,"totpsrc":src}
         except Exception as e:
             return {"status":False,
@@ -35,8 +37,8 @@ async def CheckANDRegister(request,reqT,sqlT,totpT):
             secret = request.session["secret"]
             totpobject = totpT.GetTotpObject(secret=secret)
             
-            if user_input==totpobject.now():
-                InsertRegisterData_result = sqlT.InsertRegisterData(loginID,password,name,gender,birthday,
+            if totpT.Verify(totpobject,user_input) is not None:
+                InsertRegisterData_result = await sqlT.InsertRegisterData(loginID,password,name,gender,birthday,
                                                  email,phone_number,mobile_number,address,secret)
                 if not InsertRegisterData_result["status"]:
                     return InsertRegisterData_result
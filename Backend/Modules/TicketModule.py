@@ -1,7 +1,23 @@
-from fastapi.encoders import jsonable_encoder
+import asyncio
+import base64
+import json
+import time
+
+from . import QueueModule
+
+#以資料庫的購票紀錄初始化售出點陣圖
+#Redis 清空、重啟或鍵被淘汰後，鎖票及購票腳本回傳 ready 為 False，初始化後才可判斷座位是否已售出
+async def LoadSeatMap(sqlT,redisT,seatT,event_id):
+    GetPurchasedData_result = await sqlT.GetPurchasedData(event_id=event_id)
+    if not GetPurchasedData_result["status"]:
+        return GetPurchasedData_result
+    layout = seatT.GetLayout(event_id)
+    ordinals = [layout.Locate(*seat) for seat in GetPurchasedData_result["purchasedData"]]
+    return await redisT.InitSeatMap(event_id=event_id,ordinals=[_ for _ in ordinals if _ is not None])
 
 #鎖票
-async def Lock(request,reqT,redisT):
+#售出點陣圖尚未初始化時，先以資料庫的購票紀錄初始化再鎖票
+async def Lock(request,reqT,sqlT,redisT,seatT):
     
     response = await reqT.GetJson(request = request)
     if response["status"]:
@@ -17,7 +33,24 @@ async def Lock(request,reqT,redisT):
             seatLockKey = f"<seatLock>:[{event_id}:{area}:{row}:{column}]"
             userSeatIndexKey = f"<userSeatIndex>:[{loginID}]"
             
-            TicketLock_result = redisT.TicketLock(seatLockKey=seatLockKey,userSeatIndexKey=userSeatIndexKey,loginID=loginID)
+            #座位不在活動的座位配置中(或不開放)時直接拒絕，不需查詢 Redis
+            ordinal = seatT.GetLayout(event_id).Ordinal(area,row,column)
+            if ordinal is None:
+                return {"status":False,
+                        "notify":"座位不存在 !"}
+            
+            CheckAdmission_result = await QueueModule.CheckAdmission(request=request,redisT=redisT,event_id=event_id)
+            if not CheckAdmission_result["status"]:
+                return CheckAdmission_result
+            
+            TicketLock_result = await redisT.TicketLock(seatLockKey=seatLockKey,userSeatIndexKey=userSeatIndexKey,loginID=loginID,
+                                                        event_id=event_id,ordinal=ordinal)
+            if TicketLock_result.get("ready") is False:
+                LoadSeatMap_result = await LoadSeatMap(sqlT=sqlT,redisT=redisT,seatT=seatT,event_id=event_id)
+                if not LoadSeatMap_result["status"]:
+                    return LoadSeatMap_result
+                TicketLock_result = await redisT.TicketLock(seatLockKey=seatLockKey,userSeatIndexKey=userSeatIndexKey,loginID=loginID,
+                                                            event_id=event_id,ordinal=ordinal)
             return TicketLock_result
         except Exception as e:
             return {"status":False,
@@ -25,7 +58,14 @@ async def Lock(request,reqT,redisT):
     return response
 
 #購票
-async def GetTicketData(request,reqT,sqlT,totpT,redisT):
+#驗證碼容許前後時間區間的誤差，使用過的驗證碼記錄在 Redis，不可重複使用
+#密鑰由快取取得，通常不需查詢資料庫
+#座位先由 Redis 購票腳本一次完成(確認仍持有鎖定、標記售出、加入購票者集合)，再寫入資料庫
+#售出點陣圖尚未初始化時，先以資料庫的購票紀錄初始化再購票
+#資料庫寫入失敗時還原 Redis 的座位狀態；同一座位已有紀錄時(唯一鍵)保留售出狀態
+#還原也失敗時交給背景工作重試(RedisTools.QueuePurchaseUndo)
+#有 writeT 時(write-behind)，購票紀錄隨座位狀態寫入 Redis，由背景工作批次寫入資料庫
+async def GetTicketData(request,reqT,sqlT,totpT,redisT,seatT,writeT=None):
     
     response = await reqT.GetJson(request = request)
     if response["status"]:
@@ -44,25 +84,62 @@ async def GetTicketData(request,reqT,sqlT,totpT,redisT):
             seatLockKey = f"<seatLock>:[{event_id}:{area}:{row}:{column}]"
             userSeatIndexKey = f"<userSeatIndex>:[{loginID}]"
 
-            GetSecret_result = sqlT.GetSecret(loginID=loginID)
+            ordinal = seatT.GetLayout(event_id).Ordinal(area,row,column)
+            if ordinal is None:
+                return {"status":False,
+                        "notify":"座位不存在 !"}
+
+            GetSecret_result = await sqlT.GetSecret(loginID=loginID)
             if not GetSecret_result["status"]:
                 return GetSecret_result
             
             secret = GetSecret_result["secret"]
             totpobject = totpT.GetTotpObject(secret)
             
-            if totpcode == str(totpobject.now()):
+            timecode = totpT.Verify(totpobject,totpcode)
+            if timecode is not None:
+                
+                TotpClaim_result = await redisT.TotpClaim(loginID=loginID,timecode=timecode,ttl=totpT.ReplayTTL(totpobject))
+                if not TotpClaim_result["status"]:
+                    return TotpClaim_result
+                if not TotpClaim_result["claimed"]:
+                    return {"status":False,
+                            "notify":"此驗證碼已使用過，請等待下一組驗證碼 !"}
+                
+                record = {"registerID":registerID,"loginID":loginID,"event_id":event_id,"area":area,"row":row,"column":column} if writeT is not None else None
+                TicketPurchase_result = await redisT.TicketPurchase(event_id=event_id,loginID=loginID,seatLockKey=seatLockKey,userSeatIndexKey=userSeatIndexKey,
+                                                                    ordinal=ordinal,record=record)
+                if TicketPurchase_result.get("ready") is False:
+                    LoadSeatMap_result = await LoadSeatMap(sqlT=sqlT,redisT=redisT,seatT=seatT,event_id=event_id)
+                    if LoadSeatMap_result["status"]:
+                        TicketPurchase_result = await redisT.TicketPurchase(event_id=event_id,loginID=loginID,seatLockKey=seatLockKey,userSeatIndexKey=userSeatIndexKey,
+                                                                            ordinal=ordinal,record=record)
+                    else:
+                        TicketPurchase_result = LoadSeatMap_result
+                if not TicketPurchase_result["status"]:
+                    await redisT.TotpRelease(loginID=loginID,timecode=timecode)
+                    return TicketPurchase_result
+                
+                if writeT is None:
+                    InsertTicketData_result = await sqlT.InsertTicketData(registerID=registerID,event_id=event_id,area=area,row=row,column=column)
+                    if not InsertTicketData_result["status"]:
+                        TicketPurchaseUndo_result = await redisT.TicketPurchaseUndo(event_id=event_id,loginID=loginID,seatLockKey=seatLockKey,userSeatIndexKey=userSeatIndexKey,
+                                                                                    pttl=TicketPurchase_result["pttl"],ordinal=ordinal,
+                                                                                    sold=InsertTicketData_result.get("duplicate",False))
+                        if not TicketPurchaseUndo_result["status"]:
+                            redisT.QueuePurchaseUndo(event_id=event_id,loginID=loginID,seatLockKey=seatLockKey,userSeatIndexKey=userSeatIndexKey,
+                                                     pttl=TicketPurchase_result["pttl"],ordinal=ordinal,
+                                                     sold=InsertTicketData_result.get("duplicate",False),
+                                                     notify=TicketPurchaseUndo_result["notify"])
+                        await redisT.TotpRelease(loginID=loginID,timecode=timecode)
+                        return InsertTicketData_result
                 
-                InsertTicketData_result = sqlT.InsertTicketData(registerID=registerID,event_id=event_id,area=area,row=row,column=column)
-                if InsertTicketData_result["status"]:
-                    
-                    TicketSuccess_result = redisT.TicketSuccess(event_id=event_id,loginID=loginID,seatLockKey=seatLockKey,userSeatIndexKey=userSeatIndexKey)
-                    if not TicketSuccess_result["status"]:
-                        return TicketSuccess_result
-                    
-                    return {"status":True,
-                            "notify":"票券資料寫入成功 !"}
-                return InsertTicketData_result
+                request.session["ProfileVersion"] = time.time()
+                if str(event_id) in request.session.get("Admission",{}):
+                    await QueueModule.Release(request=request,redisT=redisT,event_id=event_id,loginID=loginID)
+                
+                return {"status":True,
+                        "notify":"票券資料寫入成功 !"}
             else:
                 return {"status":False,
                         "notify":"驗證碼輸入錯誤 !"}
@@ -84,7 +161,7 @@ async def CheckTicket(request,reqT,redisT):
             userName = request.session["UserName"]
             event_id = data["event_id"]
             
-            TicketCheck_result = redisT.TicketCheck(event_id=event_id,loginID=loginID,userName=userName)
+            TicketCheck_result = await redisT.TicketCheck(event_id=event_id,loginID=loginID,userName=userName)
             return TicketCheck_result
         
         except Exception as e:
@@ -93,7 +170,7 @@ async def CheckTicket(request,reqT,redisT):
     return response
 
 #釋放票券
-async def CancelTicket(request,reqT,redisT):
+async def CancelTicket(request,reqT,redisT,seatT):
     response = await reqT.GetJson(request = request)
     if response["status"]:
         try:
@@ -105,7 +182,9 @@ async def CancelTicket(request,reqT,redisT):
             column = data["column"]
             seatLockKey = f"<seatLock>:[{event_id}:{area}:{row}:{column}]"
             userSeatIndexKey = f"<userSeatIndex>:[{loginID}]"
-            TicketCancel_result = redisT.TicketCancel(seatLockKey=seatLockKey,userSeatIndexKey=userSeatIndexKey)
+            ordinal = seatT.GetLayout(event_id).Ordinal(area,row,column)
+            TicketCancel_result = await redisT.TicketCancel(seatLockKey=seatLockKey,userSeatIndexKey=userSeatIndexKey,loginID=loginID,
+                                                            event_id=event_id,ordinal=ordinal)
             if TicketCancel_result["status"]:
                 TicketCancel_result["notify"] = f"{seatLockKey} 已釋放 !"
             return TicketCancel_result
@@ -120,14 +199,19 @@ async def RestoreTicket(request,redisT):
     try:
         loginID = request.session["UserID"]
         userSeatIndexKey = f"<userSeatIndex>:[{loginID}]"
-        TicketRestore_result = redisT.TicketRestore(userSeatIndexKey=userSeatIndexKey,loginID=loginID)
+        TicketRestore_result = await redisT.TicketRestore(userSeatIndexKey=userSeatIndexKey,loginID=loginID)
         return TicketRestore_result
     except Exception as e:
         return {"status":False,
                 "notify":f"TicketModule_RestoreTicketError ! message : [{type(e)} {e}]"}
 
 #取得活動鎖有購票紀錄
-async def CheckTicketPurchased(request, reqT, sqlT):
+#售出及鎖定狀態由 Redis 座位點陣圖提供，只有點陣圖尚未初始化時才查詢資料庫
+#format 為 "bitmap" 時只回傳點陣圖(base64)，不展開 purchased 列表
+#每次回傳都帶有版本號 version 與 etag
+#  請求標頭 If-None-Match 與目前版本相同時 -> return {"status":True,"notModified":True,...}(由 main 回傳 304)
+#  有 since_version 時只回傳該版本之後變更過的座位 -> "changes":[[area,row,column,"sold"/"held"/"free"],...]
+async def CheckTicketPurchased(request, reqT, sqlT, redisT, seatT):
     response = await reqT.GetJson(request=request)
     if not response["status"]:
         return response
@@ -140,21 +224,101 @@ async def CheckTicketPurchased(request, reqT, sqlT):
         if not event_id:
             if not title:
                 return {"status": False, "notify": "請提供 event_id 或 title"}
-            get_id = sqlT.GetEventID(title=title)
+            get_id = await sqlT.GetEventID(title=title)
             if not get_id["status"]:
                 return get_id
             event_id = get_id["event_id"]
 
-        purchased = sqlT.GetPurchasedData(event_id=event_id)
-        if not purchased["status"]:
-            return purchased
+        layout = seatT.GetLayout(event_id)
+        fmt = "bitmap" if data.get("format") == "bitmap" else "full"
+        sinceVersion = data.get("since_version")
+
+        #只回傳變更的座位
+        if sinceVersion is not None:
+            sinceVersion = int(sinceVersion)
+            seatMap = await redisT.GetSeatMap(event_id=event_id,sinceVersion=sinceVersion)
+            if not seatMap["status"]:
+                return seatMap
+            if seatMap["ready"] and sinceVersion <= seatMap["version"]:
+                changes = []
+                for ordinal in seatMap["changed"]:
+                    if layout.Test(seatMap["sold"],ordinal):
+                        state = "sold"
+                    elif layout.Test(seatMap["held"],ordinal):
+                        state = "held"
+                    else:
+                        state = "free"
+                    changes.append([*layout.Seat(ordinal),state])
+                return {"status": True,
+                        "event_id": event_id,
+                        "version": seatMap["version"],
+                        "since_version": sinceVersion,
+                        "changes": changes}
+
+        #版本未變更時不重新組裝回應
+        matchVersion = seatT.ParseETag(request.headers.get("if-none-match"),event_id,fmt)
+        cached = seatT.GetAvailability(event_id,fmt)
+        knownVersion = matchVersion if matchVersion is not None else (cached[0] if cached else None)
+
+        seatMap = await redisT.GetSeatMap(event_id=event_id,knownVersion=knownVersion)
+        if not seatMap["status"]:
+            return seatMap
+
+        if seatMap["ready"] and not seatMap["modified"]:
+            if matchVersion is not None:
+                return {"status": True,
+                        "notModified": True,
+                        "event_id": event_id,
+                        "version": seatMap["version"],
+                        "etag": seatT.ETag(event_id,fmt,seatMap["version"])}
+            return cached[1]
 
-        return {
+        if not seatMap["ready"]:
+            LoadSeatMap_result = await LoadSeatMap(sqlT=sqlT,redisT=redisT,seatT=seatT,event_id=event_id)
+            if not LoadSeatMap_result["status"]:
+                return LoadSeatMap_result
+            seatMap = await redisT.GetSeatMap(event_id=event_id)
+            if not seatMap["status"]:
+                return seatMap
+
+        #可購買 = 座位配置 - 售出 - 鎖定
+        available = layout.Available(seatMap["sold"],seatMap["held"])
+        response = {
             "status": True,
-            "purchased": jsonable_encoder(purchased["purchasedData"]),
-            "event_id": event_id
+            "event_id": event_id,
+            "version": seatMap["version"],
+            "etag": seatT.ETag(event_id,fmt,seatMap["version"]),
+            "seats": layout.total,
+            "capacity": layout.capacity,
+            "layout": layout.Sections(),
+            "sold": base64.b64encode(seatMap["sold"]).decode(),
+            "held": base64.b64encode(seatMap["held"]).decode(),
+            "available": base64.b64encode(available).decode(),
+            "availableCount": int.from_bytes(available,"big").bit_count()
         }
+        if fmt == "full":
+            response["purchased"] = layout.Decode(seatMap["sold"])
+        seatT.SetAvailability(event_id,fmt,seatMap["version"],response)
+        return response
 
     except Exception as e:
         return {"status": False,
                 "notify": f"TicketModule_CheckTicketPurchasedError ! message : [{type(e)} {e}]"}
+
+#座位即時更新(Server-Sent Events)
+#event : lock / release / expire / sold / resync
+#data  : {"type":..., "version":..., "seats":[[area,row,column],...]}
+#收到 resync 時，前端應以 since_version 重新取得座位狀態
+async def SeatStream(request,event_id,pushT,heartbeat=15):
+    queue = pushT.Subscribe(event_id)
+    try:
+        yield "retry: 3000\n\n"
+        while not await request.is_disconnected():
+            try:
+                message = await asyncio.wait_for(queue.get(),timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield f"event: {message['type']}\ndata: {json.dumps(message,ensure_ascii=False)}\n\n"
+    finally:
+        pushT.Unsubscribe(event_id,queue)
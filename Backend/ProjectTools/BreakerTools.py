@@ -0,0 +1,164 @@
+import math
+import threading
+import time
+from collections import deque
+
+from .ResponseTools import FastJSONResponse
+
+#斷路器開啟中，呼叫直接失敗
+class CircuitOpen(Exception):
+    pass
+
+#斷路器狀態對應的指標數值
+STATE_VALUE = {"closed":0,"half_open":1,"open":2}
+
+#斷路器
+#統計最近 window 秒的呼叫(每秒一格)，呼叫數達 minCalls 後
+#  失敗比例 >= errorRate 或 超過 slowSeconds 的比例 >= slowRate 時開啟
+#開啟後 openSeconds 秒內的呼叫直接丟出 CircuitOpen，不再等待已經變慢或中斷的後端
+#時間到後進入半開，最多放行 probeCalls 個試探呼叫 : 都成功則關閉，任一失敗或過慢則重新開啟
+#SqlTools 在執行緒池中呼叫，RedisTools 在事件迴圈中呼叫，狀態以鎖保護
+class CircuitBreaker:
+    def __init__(self,name,window=10,minCalls=20,errorRate=0.5,slowSeconds=1.0,slowRate=0.5,
+                 openSeconds=5,probeCalls=1,metricsT=None):
+        self.name = name
+        self.window = window
+        self.minCalls = minCalls
+        self.errorRate = errorRate
+        self.slowSeconds = slowSeconds
+        self.slowRate = slowRate
+        self.openSeconds = openSeconds
+        self.probeCalls = probeCalls
+        self.state = "closed"
+        self.openUntil = 0.0
+        self.probes = 0                 #半開時進行中的試探呼叫數
+        self.probeSuccesses = 0
+        self.buckets = deque()          #[秒, 呼叫數, 失敗數, 過慢數]，右側為最新
+        self.lock = threading.Lock()
+        self.metricsT = metricsT
+        if metricsT is not None:
+            metricsT.Describe("circuit_breaker_transitions_total","counter","斷路器狀態轉換次數，依轉換後的狀態")
+            metricsT.Describe("circuit_breaker_rejected_total","counter","斷路器開啟時直接失敗的呼叫數")
+            metricsT.AddCollector(f"breaker:{name}",self.Collect)
+
+    #呼叫前檢查，開啟中時丟出 CircuitOpen
+    def Before(self):
+        with self.lock:
+            if self.state == "closed":
+                return
+            if self.state == "open":
+                if time.monotonic() < self.openUntil:
+                    self.Reject()
+                self.Transition("half_open")
+                self.probes = 0
+                self.probeSuccesses = 0
+            if self.probes >= self.probeCalls:
+                self.Reject()
+            self.probes += 1
+
+    #呼叫後記錄結果，failed 只在後端連線失敗或逾時時為 True(資料錯誤等不算)
+    def After(self,seconds,failed=False):
+        slow = seconds >= self.slowSeconds
+        with self.lock:
+            if self.state == "half_open":
+                self.probes = max(self.probes-1,0)
+                if failed or slow:
+                    self.Open()
+                    return
+                self.probeSuccesses += 1
+                if self.probeSuccesses >= self.probeCalls:
+                    self.buckets.clear()
+                    self.Transition("closed")
+                return
+            if self.state == "open":
+                return
+
+            now = time.monotonic()
+            second = int(now)
+            if not self.buckets or self.buckets[-1][0] != second:
+                self.buckets.append([second,0,0,0])
+            bucket = self.buckets[-1]
+            bucket[1] += 1
+            bucket[2] += failed
+            bucket[3] += slow
+            while self.buckets[0][0] <= second-self.window:
+                self.buckets.popleft()
+
+            calls,failures,slows = self.Totals()
+            if calls >= self.minCalls and (failures >= calls*self.errorRate or slows >= calls*self.slowRate):
+                self.Open()
+
+    #開啟中(半開時試探呼叫可以通過，不算開啟)
+    def IsOpen(self):
+        return self.state == "open" and time.monotonic() < self.openUntil
+
+    #距離半開的秒數(無條件進位，至少 1 秒)，作為 Retry-After
+    def RetryAfter(self):
+        return max(math.ceil(self.openUntil-time.monotonic()),1)
+
+    #斷路器狀態
+    def State(self):
+        with self.lock:
+            calls,failures,slows = self.Totals()
+            return {"name":self.name,
+                    "state":"open" if self.IsOpen() else ("half_open" if self.state == "open" else self.state),
+                    "calls":calls,
+                    "errorRate":failures/calls if calls else 0.0,
+                    "slowRate":slows/calls if calls else 0.0,
+                    "retryAfter":self.RetryAfter() if self.IsOpen() else 0}
+
+    def Totals(self):
+        calls = failures = slows = 0
+        for _,bucketCalls,bucketFailures,bucketSlows in self.buckets:
+            calls += bucketCalls
+            failures += bucketFailures
+            slows += bucketSlows
+        return calls,failures,slows
+
+    def Open(self):
+        self.openUntil = time.monotonic()+self.openSeconds
+        self.buckets.clear()
+        self.Transition("open")
+
+    def Transition(self,state):
+        if self.state == "open" and state == "open":
+            return
+        self.state = state
+        if self.metricsT is not None:
+            self.metricsT.Inc("circuit_breaker_transitions_total",(("breaker",self.name),("state",state)))
+
+    def Reject(self):
+        if self.metricsT is not None:
+            self.metricsT.Inc("circuit_breaker_rejected_total",(("breaker",self.name),))
+        raise CircuitOpen(f"{self.name} 暫停使用，{self.RetryAfter()} 秒後重試 !")
+
+    #斷路器狀態指標
+    def Collect(self):
+        state = self.State()["state"]
+        return [("circuit_breaker_state","gauge","斷路器狀態(0 關閉 / 1 半開 / 2 開啟)",
+                 (("breaker",self.name),),STATE_VALUE[state])]
+
+#後端的斷路器開啟時，prefix 下的路由直接回傳 503，不進入處理程序
+#斷路器在 lifespan 中建立，由 app.state.breakers 取得
+class BreakerMiddleware:
+    def __init__(self,app,metricsT=None,prefix="/ticket"):
+        self.app = app
+        self.metricsT = metricsT
+        self.prefix = prefix
+        if metricsT is not None:
+            metricsT.Describe("http_shed_total","counter","斷路器開啟時直接回傳 503 的請求數，依斷路器")
+
+    async def __call__(self,scope,receive,send):
+        if scope["type"] != "http" or not (scope["path"] == self.prefix or scope["path"].startswith(self.prefix+"/")):
+            return await self.app(scope,receive,send)
+        for breaker in getattr(scope["app"].state,"breakers",()):
+            if breaker.IsOpen():
+                if self.metricsT is not None:
+                    self.metricsT.Inc("http_shed_total",(("breaker",breaker.name),))
+                retryAfter = breaker.RetryAfter()
+                response = FastJSONResponse({"status":False,
+                                             "notify":"目前購票系統忙碌中，請稍後再試 !",
+                                             "retryAfter":retryAfter},
+                                            status_code=503,headers={"Retry-After":str(retryAfter)})
+                return await response(scope,receive,send)
+        await self.app(scope,receive,send)
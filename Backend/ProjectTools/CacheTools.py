@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+#有時效、有容量上限的快取(LRU)
+#SqlTools 的方法在執行緒池中執行，存取時需加鎖
+class TTLCache:
+    def __init__(self,maxSize=10000,ttl=300):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.data = OrderedDict()   #key -> (到期時間, value)
+        self.lock = threading.Lock()
+
+    #取得資料，不存在或已過期時回傳 default
+    def Get(self,key,default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return default
+            if item[0] < time.monotonic():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+            return item[1]
+
+    #存入資料，超過容量時淘汰最久未使用的資料
+    def Set(self,key,value,ttl=None):
+        with self.lock:
+            self.data[key] = (time.monotonic()+(self.ttl if ttl is None else ttl),value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxSize:
+                self.data.popitem(last=False)
+
+    #刪除資料
+    def Delete(self,key):
+        with self.lock:
+            self.data.pop(key,None)
+
+    #清空
+    def Clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
@@ -0,0 +1,44 @@
+import asyncio
+
+#鎖定到期清理
+#鎖票的鍵在 Redis 中自動過期，但鎖定點陣圖與鎖定紀錄不會跟著更新，座位狀態要等下一次查詢才會釋放
+#背景工作每 interval 秒清除所有活動已到期的鎖定(RedisTools.SweepHolds) :
+#  刪除仍成對存在的 seatLockKey / userSeatIndexKey、清除鎖定位元並遞增版本號(座位狀態快取隨之失效)
+#  同時發布 expire 事件，SSE 連線立即收到座位釋放
+#清除在腳本中完成，多個 worker 同時執行也不會重複釋放
+#同時重試此 worker 還原失敗的購票(RedisTools.RepairPurchases)
+class HoldTools:
+    def __init__(self,redisT,interval=1):
+        self.redisT = redisT
+        self.interval = interval
+        self.running = False
+        self.task = None
+
+    #開始背景清除
+    async def Start(self):
+        if self.task is None:
+            self.running = True
+            self.task = asyncio.create_task(self.Run())
+
+    #停止背景清除
+    #redis 客戶端在等待回應時可能吞掉取消，因此另以 running 結束迴圈
+    async def Stop(self):
+        if self.task is not None:
+            self.running = False
+            self.task.cancel()
+            try:
+                await asyncio.wait_for(self.task,timeout=self.interval+5)
+            except (asyncio.TimeoutError,asyncio.CancelledError):
+                pass
+            self.task = None
+        for repair in self.redisT.repairs:
+            print(f"TicketPurchaseUndo_Inconsistency ! 停止時仍未還原的購票 : {repair}")
+
+    async def Run(self):
+        while self.running:
+            SweepHolds_result = await self.redisT.SweepHolds()
+            if not SweepHolds_result["status"]:
+                print(SweepHolds_result["notify"])
+            if self.redisT.repairs:
+                await self.redisT.RepairPurchases()
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,118 @@
+import threading
+import time
+from bisect import bisect_left
+
+#延遲分布的預設區間(秒)
+DEFAULT_BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0)
+
+#Prometheus 指標
+#計數器與分布圖以 (名稱, 標籤) 為鍵，熱路徑上只有一次加鎖與幾次加法
+#收集器(collector)在輸出時才呼叫，用來回報連線池等即時狀態
+class MetricsTools:
+    def __init__(self,buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.meta = {}          #名稱 -> (類型, 說明)
+        self.counters = {}      #(名稱, 標籤) -> 數值
+        self.histograms = {}    #(名稱, 標籤) -> [各區間次數..., 總和, 次數]
+        self.collectors = {}    #來源名稱 -> 收集器，收集器() -> [(名稱, 類型, 說明, 標籤, 數值)]
+
+    #登記指標的類型與說明
+    def Describe(self,name,kind,help):
+        self.meta[name] = (kind,help)
+
+    #計數器 +value
+    def Inc(self,name,labels=(),value=1):
+        key = (name,labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key,0)+value
+
+    #記錄一次觀測值(秒)
+    def Observe(self,name,value,labels=()):
+        key = (name,labels)
+        i = bisect_left(self.buckets,value)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0]*(len(self.buckets)+1)+[0.0,0]
+            histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    #登記收集器，同一來源重複登記時以新的取代
+    def AddCollector(self,source,collector):
+        self.collectors[source] = collector
+
+    #標籤 -> {key="value",...}
+    def Labels(self,labels,extra=()):
+        labels = tuple(labels)+tuple(extra)
+        if not labels:
+            return ""
+        return "{"+",".join(f'{key}="{str(value).replace(chr(92),chr(92)*2).replace(chr(34),chr(92)+chr(34))}"' for key,value in labels)+"}"
+
+    #輸出 Prometheus 文字格式
+    def Render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key:list(value) for key,value in self.histograms.items()}
+
+        series = {}     #名稱 -> [行]
+        types = {}
+        for (name,labels),value in counters.items():
+            series.setdefault(name,[]).append(f"{name}{self.Labels(labels)} {value}")
+            types.setdefault(name,"counter")
+        for (name,labels),histogram in histograms.items():
+            lines = series.setdefault(name,[])
+            types.setdefault(name,"histogram")
+            total = 0
+            for bound,count in zip(self.buckets,histogram):
+                total += count
+                lines.append(f"{name}_bucket{self.Labels(labels,(('le',bound),))} {total}")
+            lines.append(f"{name}_bucket{self.Labels(labels,(('le','+Inf'),))} {histogram[-1]}")
+            lines.append(f"{name}_sum{self.Labels(labels)} {histogram[-2]}")
+            lines.append(f"{name}_count{self.Labels(labels)} {histogram[-1]}")
+        for collector in list(self.collectors.values()):
+            try:
+                for name,kind,help,labels,value in collector():
+                    self.meta.setdefault(name,(kind,help))
+                    types.setdefault(name,kind)
+                    series.setdefault(name,[]).append(f"{name}{self.Labels(labels)} {value}")
+            except Exception as e:
+                print(f"MetricsTools_CollectorError ! message : [{type(e)} | {e}]")
+
+        output = []
+        for name in sorted(series):
+            kind,help = self.meta.get(name,(types[name],name))
+            output.append(f"# HELP {name} {help}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(series[name])
+        return "\n".join(output)+"\n"
+
+#記錄每個路由延遲的 ASGI 中介層
+#路由以樣板路徑(例如 /ticket/lock)作為標籤，靜態檔案統一為 static
+class MetricsMiddleware:
+    def __init__(self,app,metricsT):
+        self.app = app
+        self.metricsT = metricsT
+        metricsT.Describe("http_request_seconds","histogram","HTTP 請求延遲(秒)，依路由、方法、狀態碼")
+
+    async def __call__(self,scope,receive,send):
+        if scope["type"] != "http":
+            return await self.app(scope,receive,send)
+
+        start = time.perf_counter()
+        status = 500
+
+        async def Send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope,receive,Send)
+        finally:
+            route = scope.get("route")
+            path = getattr(route,"path",None) or "static"
+            self.metricsT.Observe("http_request_seconds",time.perf_counter()-start,
+                                  (("route",path),("method",scope["method"]),("status",status)))
@@ -0,0 +1,91 @@
+import asyncio
+import json
+
+#座位即時推播
+#每個 worker 只用一條 Redis pub/sub 連線訂閱所有活動頻道，再分送給本機的 SSE 連線
+#跨 worker 的分送由 Redis 負責，任一 worker 發布的變更都會送到所有 worker
+class PushTools:
+    def __init__(self,redisT,seatT,queueSize=100):
+        self.redisT = redisT
+        self.seatT = seatT
+        self.queueSize = queueSize
+        self.subscribers = {}   #event_id -> {asyncio.Queue}
+        self.running = False
+        self.task = None
+
+    #開始訂閱
+    async def Start(self):
+        if self.task is None:
+            self.running = True
+            self.task = asyncio.create_task(self.Listen())
+
+    #停止訂閱
+    #redis 客戶端在 get_message 等待中可能吞掉取消，因此另以 running 結束迴圈(最多等一次 get_message 逾時)
+    async def Stop(self):
+        if self.task is not None:
+            self.running = False
+            self.task.cancel()
+            try:
+                await asyncio.wait_for(self.task,timeout=5)
+            except (asyncio.TimeoutError,asyncio.CancelledError):
+                pass
+            self.task = None
+
+    #訂閱活動，回傳接收訊息的佇列
+    def Subscribe(self,event_id):
+        queue = asyncio.Queue(maxsize=self.queueSize)
+        self.subscribers.setdefault(str(event_id),set()).add(queue)
+        return queue
+
+    #取消訂閱
+    def Unsubscribe(self,event_id,queue):
+        queues = self.subscribers.get(str(event_id))
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[str(event_id)]
+
+    #接收 Redis 訊息，斷線時自動重新訂閱
+    async def Listen(self):
+        while self.running:
+            pubsub = self.redisT.r.pubsub()
+            try:
+                await pubsub.psubscribe(self.redisT.SeatChannelPattern())
+                while self.running:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True,timeout=1.0)
+                    if message is not None:
+                        self.Dispatch(message["channel"],message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"PushTools_ListenError ! message : [{type(e)} | {e}]")
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+                #斷線期間可能漏掉訊息，通知前端重新同步
+                for event_id in list(self.subscribers):
+                    self.Send(event_id,{"type":"resync"})
+
+    #將頻道訊息轉為座位資料，分送給訂閱者
+    def Dispatch(self,channel,data):
+        event_id = self.redisT.ParseSeatChannel(channel)
+        if event_id not in self.subscribers:
+            return
+        message = json.loads(data)
+        layout = self.seatT.GetLayout(event_id)
+        self.Send(event_id,{"type":message["type"],
+                            "version":message["version"],
+                            "seats":[layout.Seat(ordinal) for ordinal in message.get("ordinals") or []]})
+
+    #佇列已滿的連線跟不上更新，清空後改送 resync
+    def Send(self,event_id,message):
+        for queue in list(self.subscribers.get(event_id,())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type":"resync"})
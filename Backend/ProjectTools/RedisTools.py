@@ -1,13 +1,636 @@
-import redis
+import json
+import math
+import redis.asyncio as redis
+import time
+from collections import deque
 from urllib.parse import urlparse
+
+from .CacheTools import TTLCache
+
+#鎖票的有效秒數
+HOLD_SECONDS = 60
+
+#鎖票腳本回傳值對應的結果名稱
+LOCK_OUTCOME = {1:"acquired",2:"already_held",0:"conflict",-1:"multi",-2:"sold",-3:"not_ready"}
+
+#購票腳本回傳值對應的結果名稱
+PURCHASE_OUTCOME = {1:"purchased",0:"not_held",-1:"sold",-2:"limit",-3:"not_ready"}
+
+#座位狀態變更時遞增版本號，並在變更紀錄中記下座位最後一次變更的版本
+#變更紀錄為 sorted set(member : 座位序號, score : 版本)，大小不超過座位數
+#同時發布到活動頻道 : {"type":lock/release/expire/sold, "version":版本, "ordinals":[座位序號]}
+SEAT_BUMP = """
+local function Bump(versionKey, changeKey, channel, ordinals, type)
+    local version = redis.call('INCR', versionKey)
+    for _, ordinal in ipairs(ordinals) do
+        redis.call('ZADD', changeKey, version, ordinal)
+    end
+    redis.call('PUBLISH', channel, cjson.encode({type = type, version = version, ordinals = ordinals}))
+    return version
+end
+"""
+
+#清除到期的鎖定
+#鎖定紀錄(hash，field : 座位序號, value : {loginID, seatLockKey, userSeatIndexKey})與到期時間一起維護
+#呼叫前先讀出到期座位的鎖定紀錄(RedisTools.DueHolds)，各座位的 seatLockKey / userSeatIndexKey 由 KEYS 傳入
+#args 從 first 開始每兩個為一組 : 座位序號, loginID(沒有鎖定紀錄時為空字串)；有 loginID 的座位依序對應 keys 中的兩個鍵
+#腳本中再次確認到期時間與鎖定紀錄，讀取後已重新鎖定或已清除的座位不處理
+#到期時一併刪除仍成對存在的 seatLockKey / userSeatIndexKey，座位立即可再選取
+#到期時間已過但 seatLockKey 仍由同一人持有時(各 worker 時鐘不一致)，依剩餘時間重新排定
+#回傳 : 到期的座位序號
+SEAT_EXPIRE = """
+local function Expire(heldKey, holdKey, ownerKey, now, keys, firstKey, args, firstArg)
+    local expired = {}
+    local k = firstKey
+    for i = firstArg, #args, 2 do
+        local ordinal, loginID = args[i], args[i + 1]
+        local seatLockKey, userSeatIndexKey = nil, nil
+        if loginID ~= '' then
+            seatLockKey, userSeatIndexKey = keys[k], keys[k + 1]
+            k = k + 2
+        end
+        local score = redis.call('ZSCORE', holdKey, ordinal)
+        local entry = redis.call('HGET', ownerKey, ordinal)
+        local hold = entry and cjson.decode(entry)
+        local due = score and tonumber(score) <= tonumber(now)
+        if hold then
+            due = due and hold.loginID == loginID and hold.seatLockKey == seatLockKey
+        else
+            due = due and loginID == ''
+        end
+        if due then
+            local pttl = hold and redis.call('PTTL', seatLockKey) or -2
+            if pttl > 0 and redis.call('GET', seatLockKey) == loginID then
+                redis.call('ZADD', holdKey, tonumber(now) + pttl, ordinal)
+            else
+                if hold then
+                    if redis.call('GET', seatLockKey) == loginID then
+                        redis.call('DEL', seatLockKey)
+                    end
+                    if redis.call('GET', userSeatIndexKey) == seatLockKey then
+                        redis.call('DEL', userSeatIndexKey)
+                    end
+                    redis.call('HDEL', ownerKey, ordinal)
+                end
+                redis.call('SETBIT', heldKey, ordinal, 0)
+                redis.call('ZREM', holdKey, ordinal)
+                expired[#expired + 1] = tonumber(ordinal)
+            end
+        end
+    end
+    return expired
+end
+"""
+
+#鎖票腳本，一次往返內完成判斷
+#售出點陣圖尚未以資料庫的購票紀錄初始化時(Redis 清空、重啟或鍵被淘汰)不鎖票，回傳 -3 由呼叫端初始化後重試
+#userSeatIndexKey 指向的座位已不是本人持有時(鎖定已過期)，視為殘留，直接覆蓋
+#userSeatIndexKey 指向的座位鍵須由 KEYS[11] 傳入才能讀取 : 先傳 seatLockKey，
+#指向其他座位時回傳 {-4, 0, 該座位的鍵}，由呼叫端改傳該鍵重試(只有已選取其他座位的使用者需要第二次往返)
+#KEYS : seatLockKey, userSeatIndexKey, 鎖定點陣圖, 鎖定到期時間(sorted set), 版本號, 變更紀錄, 活動頻道,
+#       鎖定紀錄, 有鎖定的活動集合, 售出點陣圖, userSeatIndexKey 指向的座位鍵, 初始化標記
+#ARGV : loginID, 有效秒數, 座位序號(-1 表示不記錄點陣圖), 目前時間(毫秒), event_id
+#回傳 : {狀態, 剩餘毫秒}
+#       狀態 1 : 鎖票成功 / 2 : 本人已持有 / 0 : 他人已選取 / -1 : 不可多選 / -2 : 已售出 / -3 : 點陣圖尚未初始化
+#            -4 : 需傳入指向的座位鍵
+LOCK_SCRIPT = SEAT_BUMP+"""
+if tonumber(ARGV[3]) >= 0 then
+    if redis.call('EXISTS', KEYS[12]) == 0 then
+        return {-3, 0}
+    end
+    if redis.call('GETBIT', KEYS[10], ARGV[3]) == 1 then
+        return {-2, 0}
+    end
+end
+local lock = redis.call('GET', KEYS[1])
+if not lock then
+    local current = redis.call('GET', KEYS[2])
+    if current and current ~= KEYS[1] then
+        if current ~= KEYS[11] then
+            return {-4, 0, current}
+        end
+        if redis.call('GET', KEYS[11]) == ARGV[1] then
+            return {-1, 0}
+        end
+    end
+    redis.call('SET', KEYS[2], KEYS[1], 'EX', ARGV[2])
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    local pttl = redis.call('PTTL', KEYS[1])
+    if tonumber(ARGV[3]) >= 0 then
+        redis.call('SETBIT', KEYS[3], ARGV[3], 1)
+        redis.call('ZADD', KEYS[4], tonumber(ARGV[4]) + pttl, ARGV[3])
+        redis.call('HSET', KEYS[8], ARGV[3], cjson.encode({loginID = ARGV[1], seatLockKey = KEYS[1], userSeatIndexKey = KEYS[2]}))
+        redis.call('SADD', KEYS[9], ARGV[5])
+        Bump(KEYS[5], KEYS[6], KEYS[7], {tonumber(ARGV[3])}, 'lock')
+    end
+    return {1, pttl}
+end
+if lock == ARGV[1] then
+    return {2, redis.call('PTTL', KEYS[1])}
+end
+return {0, 0}
+"""
+
+#購票 : 確認本人仍持有鎖定後，一次完成 : 加入購票者集合、刪除鎖票鍵、座位標記為售出
+#售出點陣圖尚未初始化時不購票，回傳 -3 由呼叫端初始化後重試
+#KEYS : 購票者集合, seatLockKey, userSeatIndexKey, 售出點陣圖, 鎖定點陣圖, 鎖定到期時間, 版本號, 變更紀錄, 活動頻道,
+#       鎖定紀錄, 初始化標記[, 待寫入佇列, 使用者的未寫入紀錄](write-behind)
+#ARGV : loginID, 座位序號(-1 表示不記錄點陣圖)[, 購票紀錄(JSON), 紀錄欄位]
+#回傳 : {狀態, 鎖定剩餘毫秒(資料庫寫入失敗時用來還原鎖定)}
+#       狀態 1 : 購票成功 / 0 : 未持有鎖定(已過期或他人持有) / -1 : 座位已售出 / -2 : 此活動已購票 / -3 : 點陣圖尚未初始化
+PURCHASE_SCRIPT = SEAT_BUMP+"""
+if tonumber(ARGV[2]) >= 0 and redis.call('EXISTS', KEYS[11]) == 0 then
+    return {-3, 0}
+end
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    return {0, 0}
+end
+if tonumber(ARGV[2]) >= 0 and redis.call('GETBIT', KEYS[4], ARGV[2]) == 1 then
+    return {-1, 0}
+end
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    return {-2, 0}
+end
+local pttl = redis.call('PTTL', KEYS[2])
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('DEL', KEYS[2])
+if redis.call('GET', KEYS[3]) == KEYS[2] then
+    redis.call('DEL', KEYS[3])
+end
+if tonumber(ARGV[2]) >= 0 then
+    redis.call('SETBIT', KEYS[4], ARGV[2], 1)
+    redis.call('SETBIT', KEYS[5], ARGV[2], 0)
+    redis.call('ZREM', KEYS[6], ARGV[2])
+    redis.call('HDEL', KEYS[10], ARGV[2])
+    Bump(KEYS[7], KEYS[8], KEYS[9], {tonumber(ARGV[2])}, 'sold')
+end
+if KEYS[13] then
+    redis.call('LPUSH', KEYS[12], ARGV[3])
+    redis.call('HSET', KEYS[13], ARGV[4], ARGV[3])
+end
+return {1, pttl}
+"""
+
+#購票還原 : 購票腳本之後寫入資料庫失敗時使用
+#移出購票者集合；座位未在資料庫售出時清除售出位元，鎖定尚未到期則還給原使用者，否則釋放座位
+#KEYS : 購票者集合, seatLockKey, userSeatIndexKey, 售出點陣圖, 鎖定點陣圖, 鎖定到期時間, 版本號, 變更紀錄, 活動頻道,
+#       鎖定紀錄, 有鎖定的活動集合
+#ARGV : loginID, 座位序號(-1 表示不記錄點陣圖), 鎖定剩餘毫秒, 目前時間(毫秒), event_id, 座位已在資料庫售出(1 / 0)
+#回傳 : 1 : 鎖定已還原 / 0 : 未還原鎖定
+PURCHASE_UNDO_SCRIPT = SEAT_BUMP+"""
+redis.call('SREM', KEYS[1], ARGV[1])
+if ARGV[6] == '1' then
+    return 0
+end
+local pttl = tonumber(ARGV[3])
+local restored = pttl > 0 and redis.call('SET', KEYS[3], KEYS[2], 'NX', 'PX', pttl)
+if restored then
+    redis.call('SET', KEYS[2], ARGV[1], 'PX', pttl)
+end
+if tonumber(ARGV[2]) >= 0 then
+    redis.call('SETBIT', KEYS[4], ARGV[2], 0)
+    if restored then
+        redis.call('SETBIT', KEYS[5], ARGV[2], 1)
+        redis.call('ZADD', KEYS[6], tonumber(ARGV[4]) + pttl, ARGV[2])
+        redis.call('HSET', KEYS[10], ARGV[2], cjson.encode({loginID = ARGV[1], seatLockKey = KEYS[2], userSeatIndexKey = KEYS[3]}))
+        redis.call('SADD', KEYS[11], ARGV[5])
+        Bump(KEYS[7], KEYS[8], KEYS[9], {tonumber(ARGV[2])}, 'lock')
+    else
+        Bump(KEYS[7], KEYS[8], KEYS[9], {tonumber(ARGV[2])}, 'release')
+    end
+end
+if restored then
+    return 1
+end
+return 0
+"""
+
+#釋放票券 : 只有持有者可以釋放；刪除仍存在的鎖票鍵、清除鎖定位元
+#seatLockKey 與 userSeatIndexKey 其中之一已過期時，仍釋放另一個
+#KEYS : seatLockKey, userSeatIndexKey, 鎖定點陣圖, 鎖定到期時間, 版本號, 變更紀錄, 活動頻道, 鎖定紀錄
+#ARGV : 座位序號(-1 表示不記錄點陣圖), loginID
+#回傳 : 1 : 已釋放 / 0 : 沒有可釋放的鎖定(已過期) / -1 : 他人持有
+CANCEL_SCRIPT = SEAT_BUMP+"""
+local lock = redis.call('GET', KEYS[1])
+if lock and lock ~= ARGV[2] then
+    return -1
+end
+local released = redis.call('DEL', KEYS[1])
+if redis.call('GET', KEYS[2]) == KEYS[1] then
+    released = released + redis.call('DEL', KEYS[2])
+end
+if tonumber(ARGV[1]) >= 0 then
+    local entry = redis.call('HGET', KEYS[8], ARGV[1])
+    if entry and cjson.decode(entry).loginID == ARGV[2] then
+        redis.call('HDEL', KEYS[8], ARGV[1])
+        redis.call('SETBIT', KEYS[3], ARGV[1], 0)
+        redis.call('ZREM', KEYS[4], ARGV[1])
+        Bump(KEYS[5], KEYS[6], KEYS[7], {tonumber(ARGV[1])}, 'release')
+        released = released + 1
+    end
+end
+if released > 0 then
+    return 1
+end
+return 0
+"""
+
+#舊版購票者序列(以 event_id 為鍵的 list)轉為集合
+#KEYS : 舊序列, 新集合
+#回傳 : 轉移的人數
+MIGRATE_PURCHASER_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'list' then
+    return 0
+end
+local members = redis.call('LRANGE', KEYS[1], 0, -1)
+for i = 1, #members, 1000 do
+    redis.call('SADD', KEYS[2], unpack(members, i, math.min(i + 999, #members)))
+end
+redis.call('DEL', KEYS[1])
+return #members
+"""
+
+#讀取座位點陣圖
+#有已到期的鎖定時回傳到期數量，由呼叫端清除(HOLD_SWEEP_SCRIPT)後重新讀取
+#KEYS : 售出點陣圖, 鎖定點陣圖, 鎖定到期時間, 初始化標記, 版本號, 變更紀錄
+#ARGV : 目前時間(毫秒), 已知版本(空字串表示無), 起始版本(空字串表示不取變更)
+#回傳 : 版本與已知版本相同時 {是否已初始化, 版本, 到期的鎖定數}
+#       否則 {是否已初始化, 版本, 到期的鎖定數, 售出點陣圖, 鎖定點陣圖, 起始版本之後變更的座位序號}
+SEAT_MAP_SCRIPT = """
+local due = redis.call('ZCOUNT', KEYS[3], '-inf', ARGV[1])
+local ready = redis.call('EXISTS', KEYS[4])
+local version = tonumber(redis.call('GET', KEYS[5]) or '0')
+if ARGV[2] ~= '' and tonumber(ARGV[2]) == version then
+    return {ready, version, due}
+end
+local changed = {}
+if ARGV[3] ~= '' then
+    changed = redis.call('ZRANGEBYSCORE', KEYS[6], '(' .. ARGV[3], '+inf')
+end
+return {ready, version, due,
+        redis.call('GET', KEYS[1]) or '',
+        redis.call('GET', KEYS[2]) or '',
+        changed}
+"""
+
+#清除活動已到期的鎖定(背景工作定期執行，或讀取座位點陣圖時發現有到期的鎖定)，活動沒有鎖定時從集合中移除
+#KEYS : 鎖定點陣圖, 鎖定到期時間, 鎖定紀錄, 版本號, 變更紀錄, 活動頻道, 有鎖定的活動集合,
+#       到期座位1的 seatLockKey, userSeatIndexKey, 到期座位2的..., ...
+#ARGV : 目前時間(毫秒), event_id, 到期座位1的座位序號, loginID, 到期座位2的..., ...
+#回傳 : 到期的座位序號
+HOLD_SWEEP_SCRIPT = SEAT_BUMP+SEAT_EXPIRE+"""
+local expired = Expire(KEYS[1], KEYS[2], KEYS[3], ARGV[1], KEYS, 8, ARGV, 3)
+if #expired > 0 then
+    Bump(KEYS[4], KEYS[5], KEYS[6], expired, 'expire')
+end
+if redis.call('ZCARD', KEYS[2]) == 0 then
+    redis.call('SREM', KEYS[7], ARGV[2])
+end
+return expired
+"""
+
+#以資料庫的購票紀錄初始化售出點陣圖
+#KEYS : 售出點陣圖, 初始化標記, 版本號
+#ARGV : 已售出的座位序號
+SEAT_INIT_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+for _, ordinal in ipairs(ARGV) do
+    redis.call('SETBIT', KEYS[1], ordinal, 1)
+end
+redis.call('SET', KEYS[2], 1)
+redis.call('INCR', KEYS[3])
+return 1
+"""
+
+#排隊(等候室)
+#KEYS : 等候佇列, 購票中名單, 最後輪詢時間, 人數上限設定
+#ARGV : loginID, 現在時間(毫秒), 購票資格有效毫秒數, 未輪詢視為離開的毫秒數, 預設上限, event_id
+#等候佇列 : sorted set(member : loginID, score : 加入時間)，先到先入場
+#購票中名單 : sorted set(member : loginID, score : 資格到期時間)，人數不超過上限
+#上限 <= 0 表示此活動不排隊
+#回傳 {1, 0, 資格到期時間, 上限} 已入場 / {0, 排隊順位, 0, 上限} 等候中
+QUEUE_SCRIPT = """
+local cap = tonumber(redis.call('HGET', KEYS[4], ARGV[6]) or ARGV[5])
+if cap <= 0 then
+    return {1, 0, 0, 0}
+end
+local now = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local expiry = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if expiry then
+    return {1, 0, tonumber(expiry), cap}
+end
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now, ARGV[1])
+end
+redis.call('ZADD', KEYS[3], now, ARGV[1])
+local stale = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now - tonumber(ARGV[4]), 'LIMIT', 0, 1000)
+for _, member in ipairs(stale) do
+    redis.call('ZREM', KEYS[1], member)
+    redis.call('ZREM', KEYS[3], member)
+end
+local free = cap - redis.call('ZCARD', KEYS[2])
+if free > 0 then
+    for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, free - 1)) do
+        redis.call('ZREM', KEYS[1], member)
+        redis.call('ZREM', KEYS[3], member)
+        redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), member)
+    end
+end
+for i = 1, 3 do
+    redis.call('PEXPIRE', KEYS[i], 86400000)
+end
+expiry = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if expiry then
+    return {1, 0, tonumber(expiry), cap}
+end
+return {0, redis.call('ZRANK', KEYS[1], ARGV[1]) + 1, 0, cap}
+"""
+
+#離開排隊或購票完成，讓出名額
+#KEYS : 等候佇列, 購票中名單, 最後輪詢時間
+#ARGV : loginID
+QUEUE_LEAVE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+return redis.call('ZREM', KEYS[2], ARGV[1])
+"""
+
+#取出一批待寫入的票券(write-behind)
+#KEYS : 待寫入佇列, 此 writer 的處理中佇列, 此 writer 的心跳鍵
+#ARGV : 批次上限, 心跳有效毫秒數
+#處理中佇列不為空(上一批寫入失敗)時不取新資料，直接重試同一批
+#待寫入佇列左進右出，先購買的先寫入
+TICKET_TAKE_SCRIPT = """
+redis.call('SET', KEYS[3], 1, 'PX', ARGV[2])
+if redis.call('LLEN', KEYS[2]) == 0 then
+    for i = 1, tonumber(ARGV[1]) do
+        if not redis.call('RPOPLPUSH', KEYS[1], KEYS[2]) then
+            break
+        end
+    end
+end
+return redis.call('LRANGE', KEYS[2], 0, -1)
+"""
+
+#一批票券已寫入資料庫
+#KEYS : 處理中佇列, 使用者1的未寫入紀錄, 使用者1的近期紀錄, 使用者2的..., ...,
+#       失敗紀錄1的未寫入紀錄, 近期紀錄, 購票失敗紀錄, 購票者集合, 失敗紀錄2的..., ...
+#ARGV : 近期紀錄保留秒數, 寫入成功的筆數 n, 紀錄1的欄位, ..., 紀錄n的欄位, 購票失敗紀錄保留秒數,
+#       失敗紀錄1的欄位, loginID, 購票紀錄(JSON), 失敗紀錄2的..., ...
+#寫入成功的紀錄從未寫入移到近期紀錄，保留到各 worker 的會員資料快取都已過期為止
+#座位已由其他使用者寫入資料庫時購票失敗 : 刪除未寫入及近期紀錄，移出購票者集合(同 PURCHASE_UNDO_SCRIPT，售出位元保留)，
+#紀錄移到購票失敗紀錄，讓使用者在會員資料中看到
+TICKET_DONE_SCRIPT = """
+local n = tonumber(ARGV[2])
+for i = 1, n do
+    local pendingKey, recentKey, field = KEYS[2 * i], KEYS[2 * i + 1], ARGV[2 + i]
+    local record = redis.call('HGET', pendingKey, field)
+    if record then
+        redis.call('HDEL', pendingKey, field)
+        redis.call('HSET', recentKey, field, record)
+        redis.call('EXPIRE', recentKey, ARGV[1])
+    end
+end
+local k = 2 * n + 2
+for j = n + 4, #ARGV, 3 do
+    redis.call('HDEL', KEYS[k], ARGV[j])
+    redis.call('HDEL', KEYS[k + 1], ARGV[j])
+    redis.call('HSET', KEYS[k + 2], ARGV[j], ARGV[j + 2])
+    redis.call('EXPIRE', KEYS[k + 2], ARGV[n + 3])
+    redis.call('SREM', KEYS[k + 3], ARGV[j + 1])
+    k = k + 4
+end
+return redis.call('DEL', KEYS[1])
+"""
+
+#收回已停止的 writer 的處理中佇列
+#KEYS : 處理中佇列, 該 writer 的心跳鍵, 待寫入佇列
+#心跳仍在時不處理；收回的紀錄放到待寫入佇列的右端(最先被取出)
+TICKET_RECOVER_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+local moved = 0
+local record = redis.call('LPOP', KEYS[1])
+while record do
+    redis.call('RPUSH', KEYS[3], record)
+    moved = moved + 1
+    record = redis.call('LPOP', KEYS[1])
+end
+return moved
+"""
+
+#記錄每個指令延遲的客戶端
+#EVALSHA 以腳本名稱(例如 EVALSHA:lock)區分
+#有斷路器時每個指令都經過斷路器，連線失敗及逾時(含等待連線池逾時)視為失敗
+class MeteredRedis(redis.Redis):
+    metricsT = None
+    breaker = None
+    scriptNames = {}    #SHA -> 腳本名稱
+
+    async def execute_command(self,*args,**options):
+        if self.metricsT is None and self.breaker is None:
+            return await super().execute_command(*args,**options)
+        if self.breaker is not None:
+            self.breaker.Before()
+        start = time.perf_counter()
+        status = "ok"
+        failed = False
+        try:
+            return await super().execute_command(*args,**options)
+        except (redis.ConnectionError,redis.TimeoutError):
+            status = "error"
+            failed = True
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            seconds = time.perf_counter()-start
+            if self.breaker is not None:
+                self.breaker.After(seconds,failed)
+            if self.metricsT is not None:
+                command = args[0]
+                if command == "EVALSHA":
+                    command = f"EVALSHA:{self.scriptNames.get(args[1],'unknown')}"
+                self.metricsT.Observe("redis_command_seconds",seconds,
+                                      (("command",command),("status",status)))
+
+#計算實際建立的連線數(含斷線重連)
+class MeteredConnectionPool(redis.BlockingConnectionPool):
+    def __init__(self,metricsT=None,poolName="decoded",**kwargs):
+        super().__init__(**kwargs)
+        self.metricsT = metricsT
+        self.poolName = poolName
+
+    def make_connection(self):
+        connection = super().make_connection()
+        if self.metricsT is not None:
+            connection.register_connect_callback(self.OnConnect)
+        return connection
+
+    def OnConnect(self,connection):
+        self.metricsT.Inc("redis_connections_opened_total",(("pool",self.poolName),))
+
 #建立連線
+#使用 asyncio 版本的客戶端，連線池有上限，連線數用完時最多等待 poolTimeout 秒
+#breaker : 斷路器(BreakerTools.CircuitBreaker)，開啟時指令直接失敗
 class RedisBase:
-    def __init__(self,url):
+    def __init__(self,url,maxConnections=50,socketTimeout=5,connectTimeout=5,poolTimeout=5,breaker=None,metricsT=None):
             self.url = urlparse(url)
-            self.r = redis.Redis(host=self.url.hostname,
-                                 port=self.url.port,
-                                 password=self.url.password,
-                                 decode_responses=True)
+            self.metricsT = metricsT
+            self.breaker = breaker
+            if metricsT is not None:
+                metricsT.Describe("redis_command_seconds","histogram","Redis 指令延遲(秒)，依指令與結果")
+                metricsT.Describe("redis_connections_opened_total","counter","累計建立的 Redis 連線數")
+                metricsT.Describe("ticket_lock_total","counter","鎖票結果次數")
+                metricsT.Describe("ticket_purchase_total","counter","購票結果次數")
+                metricsT.Describe("queue_join_total","counter","排隊輪詢結果次數(已入場 / 等候中)")
+                metricsT.Describe("seat_hold_expired_total","counter","背景清除的到期鎖定座位數")
+                metricsT.Describe("ticket_purchase_repair_total","counter","購票還原失敗後交給背景工作重試的次數，依結果(queued / repaired)")
+            self.poolOptions = {"max_connections":maxConnections,
+                                "timeout":poolTimeout,
+                                "socket_timeout":socketTimeout,
+                                "socket_connect_timeout":connectTimeout}
+            self.pool = self.CreatePool(decode=True)
+            self.r = self.CreateClient(self.pool)
+            #點陣圖為二進位資料，另開不解碼的連線池
+            self.rawPool = self.CreatePool(decode=False)
+            self.raw = self.CreateClient(self.rawPool)
+            #腳本只註冊一次，之後以 SHA 呼叫(EVALSHA)
+            self.scriptNames = {}
+            self.lockScript = self.RegisterScript(self.r,"lock",LOCK_SCRIPT)
+            self.migratePurchaserScript = self.RegisterScript(self.r,"migratePurchaser",MIGRATE_PURCHASER_SCRIPT)
+            self.seatMapScript = self.RegisterScript(self.raw,"seatMap",SEAT_MAP_SCRIPT)
+            self.seatInitScript = self.RegisterScript(self.r,"seatInit",SEAT_INIT_SCRIPT)
+            self.purchaseScript = self.RegisterScript(self.r,"purchase",PURCHASE_SCRIPT)
+            self.purchaseUndoScript = self.RegisterScript(self.r,"purchaseUndo",PURCHASE_UNDO_SCRIPT)
+            self.cancelScript = self.RegisterScript(self.r,"cancel",CANCEL_SCRIPT)
+            self.holdSweepScript = self.RegisterScript(self.r,"holdSweep",HOLD_SWEEP_SCRIPT)
+            self.queueScript = self.RegisterScript(self.r,"queue",QUEUE_SCRIPT)
+            self.queueLeaveScript = self.RegisterScript(self.r,"queueLeave",QUEUE_LEAVE_SCRIPT)
+            self.ticketTakeScript = self.RegisterScript(self.r,"ticketTake",TICKET_TAKE_SCRIPT)
+            self.ticketDoneScript = self.RegisterScript(self.r,"ticketDone",TICKET_DONE_SCRIPT)
+            self.ticketRecoverScript = self.RegisterScript(self.r,"ticketRecover",TICKET_RECOVER_SCRIPT)
+
+    #建立連線池
+    def CreatePool(self,decode):
+        return MeteredConnectionPool(metricsT=self.metricsT,
+                                     poolName="decoded" if decode else "raw",
+                                     host=self.url.hostname,
+                                     port=self.url.port,
+                                     password=self.url.password,
+                                     decode_responses=decode,
+                                     **self.poolOptions)
+
+    #建立客戶端
+    def CreateClient(self,pool):
+        client = MeteredRedis(connection_pool=pool)
+        client.metricsT = self.metricsT
+        client.breaker = self.breaker
+        return client
+
+    #註冊腳本並記下 SHA 對應的名稱
+    def RegisterScript(self,client,name,script):
+        script = client.register_script(script)
+        self.scriptNames[script.sha] = name
+        client.scriptNames = self.scriptNames
+        return script
+
+    #計數
+    def Count(self,name,labels=(),value=1):
+        if self.metricsT is not None:
+            self.metricsT.Inc(name,labels,value)
+
+    #關閉連線池
+    async def Close(self):
+        await self.r.aclose()
+        await self.raw.aclose()
+        await self.pool.disconnect()
+        await self.rawPool.disconnect()
+
+    #活動購票者集合的鍵
+    def PurchaserKey(self,event_id):
+        return f"<eventPurchaser>:[{event_id}]"
+
+    #座位點陣圖的鍵 : 售出、鎖定、鎖定到期時間、初始化標記、版本號、變更紀錄、活動頻道
+    def SeatMapKeys(self,event_id):
+        return [f"<seatSold>:[{event_id}]",
+                f"<seatHeld>:[{event_id}]",
+                f"<seatHold>:[{event_id}]",
+                f"<seatMapReady>:[{event_id}]",
+                f"<seatVersion>:[{event_id}]",
+                f"<seatChange>:[{event_id}]",
+                self.SeatChannel(event_id)]
+
+    #鎖定紀錄(hash，field : 座位序號)
+    def SeatHoldOwnerKey(self,event_id):
+        return f"<seatHoldOwner>:[{event_id}]"
+
+    #有鎖定中座位的活動集合，背景清除時只檢查這些活動
+    def HoldEventsKey(self):
+        return "<seatHoldEvents>"
+
+    #活動座位變更的發布頻道
+    def SeatChannel(self,event_id):
+        return f"<seatChannel>:[{event_id}]"
+
+    #訂閱所有活動頻道的 pattern([ ] 在 pattern 中需跳脫)
+    def SeatChannelPattern(self):
+        return "<seatChannel>:\\[*\\]"
+
+    #從頻道名稱取出 event_id
+    def ParseSeatChannel(self,channel):
+        return channel.split("[",1)[1].rsplit("]",1)[0]
+
+    #排隊用的鍵 : 等候佇列、購票中名單、最後輪詢時間
+    def QueueKeys(self,event_id):
+        return [f"<queueWaiting>:[{event_id}]",
+                f"<queueActive>:[{event_id}]",
+                f"<queueSeen>:[{event_id}]"]
+
+    #各活動購票人數上限(hash，field : event_id)
+    def QueueConfigKey(self):
+        return "<queueConfig>"
+
+    #已使用的驗證碼(使用者, 時間區間編號)
+    def TotpUsedKey(self,loginID,timecode):
+        return f"<totpUsed>:[{loginID}:{timecode}]"
+
+    #write-behind 用的鍵 : 待寫入佇列、處理中佇列、writer 心跳
+    def TicketQueueKey(self):
+        return "<ticketQueue>"
+
+    def TicketProcessingKey(self,writerID):
+        return f"<ticketProcessing>:[{writerID}]"
+
+    def TicketWriterKey(self,writerID):
+        return f"<ticketWriter>:[{writerID}]"
+
+    #使用者尚未寫入資料庫 / 近期已寫入的購票紀錄(hash，field : 座位)
+    def TicketPendingKeys(self,registerID):
+        return [f"<ticketPending>:[{registerID}]",
+                f"<ticketRecent>:[{registerID}]"]
+
+    #寫入資料庫時座位已由其他使用者購買的購票紀錄(hash，field : 座位)
+    def TicketFailedKey(self,registerID):
+        return f"<ticketFailed>:[{registerID}]"
+
+    #購票紀錄在 hash 中的欄位
+    def TicketField(self,record):
+        return f"{record['event_id']}:{record['area']}:{record['row']}:{record['column']}"
+
+    #座位序號，None 表示不記錄點陣圖
+    def OrdinalArg(self,ordinal):
+        return -1 if ordinal is None else ordinal
+
+    #目前時間(毫秒)
+    def Now(self):
+        return int(time.time()*1000)
+
     def ParseSeatLockKey(self,key):
         key = dict(zip(["event_id","area","row","column"],key.split("[")[1].split("]")[0].split(":")))
         return key
@@ -16,87 +639,228 @@ class RedisBase:
 #功能
 #繼承父類別
 class RedisTools(RedisBase):
-    def __init__(self,URL):
-        super().__init__(URL)
+    def __init__(self,URL,queueCap=0,queueActiveSeconds=300,queueStaleSeconds=30,queueConfigTTL=5,**poolOptions):
+        super().__init__(URL,**poolOptions)
+        self.queueCap = queueCap                        #未個別設定的活動的上限，0 表示不排隊
+        self.queueActiveSeconds = queueActiveSeconds    #入場後可購票的秒數
+        self.queueStaleSeconds = queueStaleSeconds      #超過此秒數未輪詢，視為離開排隊
+        self.queueCaps = TTLCache(maxSize=1000,ttl=queueConfigTTL)  #event_id -> 上限
+        self.repairs = deque()                          #還原失敗、等待重試的購票還原參數
 
     #鎖票機制
-    def TicketLock(self,seatLockKey,userSeatIndexKey,loginID):
+    #使用者已選取其他座位時，腳本回傳該座位的鍵，改傳入該鍵重試(座位鍵可能在其間變更，最多重試數次)
+    #售出點陣圖尚未初始化時 ready 為 False，需先呼叫 InitSeatMap 再重試
+    async def TicketLock(self,seatLockKey,userSeatIndexKey,loginID,event_id=None,ordinal=None):
         try:
-            lock = self.r.get(seatLockKey)
-            if not lock:
-                if not self.r.set(userSeatIndexKey, seatLockKey, nx=True, ex=60):
-                    return {"status":False,
-                            "notify":"不可多選 !"}
-                self.r.set(seatLockKey, loginID , nx=True, ex=60)
-                return {"status":True,
-                        "time":self.r.pttl(seatLockKey)/1000}
-            
-            if lock==loginID:
+            soldKey,heldKey,holdKey,readyKey,versionKey,changeKey,channel = self.SeatMapKeys(event_id)
+            current = seatLockKey
+            for _ in range(3):
+                result = await self.lockScript(keys=[seatLockKey,userSeatIndexKey,heldKey,holdKey,versionKey,changeKey,channel,
+                                                     self.SeatHoldOwnerKey(event_id),self.HoldEventsKey(),soldKey,current,readyKey],
+                                               args=[loginID,HOLD_SECONDS,self.OrdinalArg(ordinal),self.Now(),"" if event_id is None else event_id])
+                status,pttl = result[0],result[1]
+                if status != -4:
+                    break
+                current = result[2]
+            else:
+                status = 0
+            self.Count("ticket_lock_total",(("outcome",LOCK_OUTCOME[status]),))
+            if status > 0:
                 return {"status":True,
-                        "time":self.r.pttl(seatLockKey)/1000}#
+                        "time":pttl/1000}
+            if status == -2:
+                return {"status":False,
+                        "notify":"此位置已售出 !"}
+            if status == -3:
+                return {"status":False,
+                        "ready":False,
+                        "notify":"座位資料載入中，請稍後再試 !"}
+            if status < 0:
+                return {"status":False,
+                        "notify":"不可多選 !"}
             return {"status":False,"notify":"此位置已經被選取，請稍後再試 !"}
         except Exception as e:
+            self.Count("ticket_lock_total",(("outcome","error"),))
             return {"status":False,
                     "notify":f"TicketLockError ! message : {type(e)} {e}"}
         
-    #購票成功
-    #解除鎖票
-    #使用者id放入序列
-    def TicketSuccess(self,event_id,loginID,seatLockKey,userSeatIndexKey):
-        try:
-            self.r.lpush(event_id,loginID)
-            deleteSeatLockKey = self.r.delete(seatLockKey)
-            deleteUserSeatIndexKey = self.r.delete(userSeatIndexKey)
-            if not (deleteSeatLockKey and deleteUserSeatIndexKey):
+    #購票
+    #確認本人仍持有鎖定，並在同一個腳本中解除鎖票、使用者id放入購票者集合、座位標記為售出
+    #有 record 時(write-behind)，購票紀錄在同一個腳本中放入待寫入佇列，之後由背景工作批次寫入資料庫
+    #回傳的 pttl 為鎖定剩餘毫秒，資料庫寫入失敗時交給 TicketPurchaseUndo 還原
+    #售出點陣圖尚未初始化時 ready 為 False，需先呼叫 InitSeatMap 再重試
+    async def TicketPurchase(self,event_id,loginID,seatLockKey,userSeatIndexKey,ordinal=None,record=None):
+        try:
+            soldKey,heldKey,holdKey,readyKey,versionKey,changeKey,channel = self.SeatMapKeys(event_id)
+            keys = [self.PurchaserKey(event_id),seatLockKey,userSeatIndexKey,soldKey,heldKey,holdKey,versionKey,changeKey,channel,
+                    self.SeatHoldOwnerKey(event_id),readyKey]
+            args = [loginID,self.OrdinalArg(ordinal)]
+            if record is not None:
+                keys += [self.TicketQueueKey(),self.TicketPendingKeys(record["registerID"])[0]]
+                args += [json.dumps(record),self.TicketField(record)]
+            status,pttl = await self.purchaseScript(keys=keys,args=args)
+            self.Count("ticket_purchase_total",(("outcome",PURCHASE_OUTCOME[status]),))
+            if status > 0:
+                return {"status":True,
+                        "pttl":pttl,
+                        "notify":f"loginID : {loginID} 已加入 Redis 購票者集合 !"}
+            if status == -1:
                 return {"status":False,
-                        "notify":"鎖票鍵移除時出現問題，請檢查鎖票序列 !"}
-            
+                        "notify":"此位置已售出 !"}
+            if status == -2:
+                return {"status":False,
+                        "notify":"每人限購一張，不可重複購票 !"}
+            if status == -3:
+                return {"status":False,
+                        "ready":False,
+                        "notify":"座位資料載入中，請稍後再試 !"}
+            return {"status":False,
+                    "notify":"選位已逾時或不是您選取的位置，請重新選位 !"}
+        except Exception as e:
+            self.Count("ticket_purchase_total",(("outcome","error"),))
+            return {"status":False,
+                    "notify":f"TicketPurchaseError ! message : {type(e)} {e}"}
+
+    #購票還原
+    #TicketPurchase 之後資料庫寫入失敗時呼叫
+    #sold 為 True 表示座位已在資料庫售出(唯一鍵衝突)，售出位元保留，只移出購票者集合
+    async def TicketPurchaseUndo(self,event_id,loginID,seatLockKey,userSeatIndexKey,pttl,ordinal=None,sold=False):
+        try:
+            soldKey,heldKey,holdKey,_,versionKey,changeKey,channel = self.SeatMapKeys(event_id)
+            restored = await self.purchaseUndoScript(
+                keys=[self.PurchaserKey(event_id),seatLockKey,userSeatIndexKey,soldKey,heldKey,holdKey,versionKey,changeKey,channel,
+                      self.SeatHoldOwnerKey(event_id),self.HoldEventsKey()],
+                args=[loginID,self.OrdinalArg(ordinal),pttl,self.Now(),"" if event_id is None else event_id,1 if sold else 0])
             return {"status":True,
-                    "notify":f"loginID : {loginID} 已 push 至 Redis 序列 !"}
+                    "restored":bool(restored)}
         except Exception as e:
             return {"status":False,
-                    "notify":f"TicketSuccessError ! message : {type(e)} {e}"}
+                    "notify":f"TicketPurchaseUndoError ! message : {type(e)} {e}"}
+
+    #購票還原失敗時(例如 Redis 暫時無法連線)放入重試佇列，由背景工作(HoldTools)定期重試
+    #未還原前座位仍標記為售出、使用者仍在購票者集合中，但資料庫沒有紀錄 : 座位無法售出，使用者也無法再購票
+    #佇列在行程內，worker 在還原前結束時需依記錄的訊息手動修復
+    def QueuePurchaseUndo(self,event_id,loginID,seatLockKey,userSeatIndexKey,pttl,ordinal=None,sold=False,notify=""):
+        print(f"TicketPurchaseUndo_Inconsistency ! 購票還原失敗，已交給背景工作重試 : "
+              f"[event_id : {event_id} | loginID : {loginID} | seat : {seatLockKey} | sold : {sold}] {notify}")
+        self.Count("ticket_purchase_repair_total",(("outcome","queued"),))
+        self.repairs.append({"event_id":event_id,"loginID":loginID,"seatLockKey":seatLockKey,"userSeatIndexKey":userSeatIndexKey,
+                             "ordinal":ordinal,"sold":sold,"expiresAt":self.Now()+pttl})
+
+    #重試佇列中的購票還原，仍失敗的放回佇列
+    #鎖定剩餘時間依原本的到期時間重新計算，已到期則直接釋放座位
+    async def RepairPurchases(self):
+        repaired = 0
+        for _ in range(len(self.repairs)):
+            repair = self.repairs.popleft()
+            TicketPurchaseUndo_result = await self.TicketPurchaseUndo(event_id=repair["event_id"],loginID=repair["loginID"],
+                                                                      seatLockKey=repair["seatLockKey"],userSeatIndexKey=repair["userSeatIndexKey"],
+                                                                      pttl=max(repair["expiresAt"]-self.Now(),0),
+                                                                      ordinal=repair["ordinal"],sold=repair["sold"])
+            if TicketPurchaseUndo_result["status"]:
+                repaired += 1
+                self.Count("ticket_purchase_repair_total",(("outcome","repaired"),))
+            else:
+                self.repairs.append(repair)
+        return {"status":True,
+                "repaired":repaired,
+                "pending":len(self.repairs)}
 
     #限購機制
     #每個活動限購一張
-    def TicketCheck(self,event_id,loginID,userName):
+    async def TicketCheck(self,event_id,loginID,userName):
         try:
-            if loginID in self.r.lrange(event_id,0,-1):
+            if await self.r.sismember(self.PurchaserKey(event_id),loginID):
                 return {"status":False,
                         "notify":f"{userName}您好，每人限購一張，不可重複購票 !"}
             return {"status":True}
         except Exception as e:
             return {"status":False,
-                    "notify":f"TicketSuccessError ! message : {type(e)} {e}"}
+                    "notify":f"TicketCheckError ! message : {type(e)} {e}"}
+
+    #舊版購票者序列轉為集合(一次性)
+    #找出所有以純數字 event_id 為鍵的 list，轉入 <eventPurchaser>:[event_id]
+    async def MigratePurchaserList(self):
+        try:
+            migrated = {}
+            async for key in self.r.scan_iter(count=1000,_type="list"):
+                if not key.isdigit():
+                    continue
+                migrated[key] = await self.migratePurchaserScript(keys=[key,self.PurchaserKey(key)])
+            return {"status":True,
+                    "migrated":migrated}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"MigratePurchaserListError ! message : {type(e)} {e}"}
+
+    #取得座位點陣圖(售出、鎖定)及版本號
+    #尚未初始化時 ready 為 False，需先以資料庫的購票紀錄呼叫 InitSeatMap
+    #版本與 knownVersion 相同時 modified 為 False，不回傳點陣圖
+    #有 sinceVersion 時 changed 為該版本之後變更過的座位序號
+    #有已到期的鎖定時先清除再讀取，座位狀態不會包含已過期的鎖定
+    async def GetSeatMap(self,event_id,knownVersion=None,sinceVersion=None):
+        try:
+            for _ in range(2):
+                now = self.Now()
+                result = await self.seatMapScript(keys=self.SeatMapKeys(event_id)[:6],
+                                                  args=[now,
+                                                        "" if knownVersion is None else knownVersion,
+                                                        "" if sinceVersion is None else sinceVersion])
+                if not result[2]:
+                    break
+                await self.ExpireHolds(event_id,now)
+            if len(result) == 3:
+                return {"status":True,
+                        "ready":bool(result[0]),
+                        "version":result[1],
+                        "modified":False}
+            ready,version,_,sold,held,changed = result
+            return {"status":True,
+                    "ready":bool(ready),
+                    "version":version,
+                    "modified":True,
+                    "sold":sold,
+                    "held":held,
+                    "changed":[int(_) for _ in changed]}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"GetSeatMapError ! message : {type(e)} {e}"}
+
+    #初始化售出點陣圖
+    async def InitSeatMap(self,event_id,ordinals):
+        try:
+            soldKey,_,_,readyKey,versionKey,_,_ = self.SeatMapKeys(event_id)
+            await self.seatInitScript(keys=[soldKey,readyKey,versionKey],args=list(ordinals))
+            return {"status":True}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"InitSeatMapError ! message : {type(e)} {e}"}
 
     #釋放票券
-    #手動解除鎖票
-    def TicketCancel(self,seatLockKey,userSeatIndexKey):
+    #手動解除鎖票，只有持有者可以釋放
+    async def TicketCancel(self,seatLockKey,userSeatIndexKey,loginID,event_id=None,ordinal=None):
         try:
-            deleteSeatLockKey = self.r.delete(seatLockKey)
-            deleteUserSeatIndexKey = self.r.delete(userSeatIndexKey)
-            if deleteSeatLockKey and deleteUserSeatIndexKey:
+            soldKey,heldKey,holdKey,_,versionKey,changeKey,channel = self.SeatMapKeys(event_id)
+            released = await self.cancelScript(
+                keys=[seatLockKey,userSeatIndexKey,heldKey,holdKey,versionKey,changeKey,channel,self.SeatHoldOwnerKey(event_id)],
+                args=[self.OrdinalArg(ordinal),loginID])
+            if released > 0:
                 return {"status":True,"notify":f"{seatLockKey} & {userSeatIndexKey} 已從 Redis 中刪除 !"}
-            else:
-                notify = []
-                if not deleteSeatLockKey:
-                    notify.append(seatLockKey)
-                if not deleteUserSeatIndexKey:
-                    notify.append(userSeatIndexKey)
-                notify = "、".join(notify)
-                return {"status":False,"notify":f"{notify} 不存在 !"}
+            if released < 0:
+                return {"status":False,"notify":"不同的使用者 !"}
+            return {"status":False,"notify":"沒有選位資料 !"}
         except Exception as e:
             return {"status":False,
                     "notify":f"TicketCancelError ! message : {type(e)} {e}"}
         
     #自動載入購票視窗
-    def TicketRestore(self,userSeatIndexKey,loginID):
+    async def TicketRestore(self,userSeatIndexKey,loginID):
         try:
-            seatLockKey = self.r.get(userSeatIndexKey)
+            seatLockKey = await self.r.get(userSeatIndexKey)
             if not seatLockKey:
                 return {"status":False,"notify":"沒有選位資料 !"}
             
-            lock = self.r.get(seatLockKey)
+            lock = await self.r.get(seatLockKey)
             if not lock:
                 return {"status":False,"notify":"沒有選位資料 !"}
             
@@ -104,8 +868,181 @@ class RedisTools(RedisBase):
                 seat = self.ParseSeatLockKey(seatLockKey)
                 return {"status":True,
                         "seat":seat,
-                        "time":self.r.pttl(seatLockKey)/1000}
+                        "time":(await self.r.pttl(seatLockKey))/1000}
             return {"status":False,"notify":"不同的使用者 !"}
         except Exception as e:
             return {"status":False,
                     "notify":f"TicketRestoreError ! message : {type(e)} {e}"}
+
+    #清除所有活動已到期的鎖定
+    #回傳 expired : {event_id : [到期的座位序號]}
+    async def SweepHolds(self):
+        try:
+            expired = {}
+            for event_id in await self.r.smembers(self.HoldEventsKey()):
+                ordinals = await self.ExpireHolds(event_id,self.Now())
+                if ordinals:
+                    expired[event_id] = ordinals
+            return {"status":True,
+                    "expired":expired}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"SweepHoldsError ! message : {type(e)} {e}"}
+
+    #清除一個活動已到期的鎖定，回傳到期的座位序號
+    #先讀出到期座位的鎖定紀錄，腳本要刪除的鍵都由 KEYS 傳入；一次最多處理 limit 個座位
+    async def ExpireHolds(self,event_id,now,limit=1000):
+        _,heldKey,holdKey,_,versionKey,changeKey,channel = self.SeatMapKeys(event_id)
+        ownerKey = self.SeatHoldOwnerKey(event_id)
+        keys = [heldKey,holdKey,ownerKey,versionKey,changeKey,channel,self.HoldEventsKey()]
+        args = [now,event_id]
+        due = await self.r.zrangebyscore(holdKey,"-inf",now,start=0,num=limit)
+        for ordinal,entry in zip(due,await self.r.hmget(ownerKey,due) if due else []):
+            hold = json.loads(entry) if entry else None
+            if hold is None:
+                args += [ordinal,""]
+            else:
+                keys += [hold["seatLockKey"],hold["userSeatIndexKey"]]
+                args += [ordinal,hold["loginID"]]
+        ordinals = [int(_) for _ in await self.holdSweepScript(keys=keys,args=args)]
+        if ordinals:
+            self.Count("seat_hold_expired_total",value=len(ordinals))
+        return ordinals
+
+    #排隊
+    #已入場回傳資格到期時間(毫秒)；等候中回傳順位及預估等候秒數
+    #預估以「每批 cap 人、每批最多 queueActiveSeconds 秒」計算，為上限值
+    async def QueueJoin(self,event_id,loginID):
+        try:
+            admitted,position,expiresAt,cap = await self.queueScript(
+                keys=self.QueueKeys(event_id)+[self.QueueConfigKey()],
+                args=[loginID,self.Now(),int(self.queueActiveSeconds*1000),int(self.queueStaleSeconds*1000),
+                      self.queueCap,event_id])
+            self.queueCaps.Set(str(event_id),cap)
+            self.Count("queue_join_total",(("outcome","admitted" if admitted else "waiting"),))
+            if admitted:
+                return {"status":True,
+                        "admitted":True,
+                        "expiresAt":expiresAt}
+            return {"status":True,
+                    "admitted":False,
+                    "position":position,
+                    "eta":math.ceil(position/cap)*self.queueActiveSeconds}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"QueueJoinError ! message : {type(e)} {e}"}
+
+    #離開排隊或購票完成，讓出名額
+    async def QueueLeave(self,event_id,loginID):
+        try:
+            await self.queueLeaveScript(keys=self.QueueKeys(event_id),args=[loginID])
+            return {"status":True}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"QueueLeaveError ! message : {type(e)} {e}"}
+
+    #活動的購票人數上限，0 表示不排隊
+    #設定值在行程內快取 queueConfigTTL 秒，鎖票時不必每次查詢
+    async def QueueCap(self,event_id):
+        cap = self.queueCaps.Get(str(event_id))
+        if cap is None:
+            cap = await self.r.hget(self.QueueConfigKey(),str(event_id))
+            cap = self.queueCap if cap is None else int(cap)
+            self.queueCaps.Set(str(event_id),cap)
+        return cap
+
+    #設定活動的購票人數上限，cap 為 None 時改回預設值
+    async def SetQueueCap(self,event_id,cap=None):
+        try:
+            if cap is None:
+                await self.r.hdel(self.QueueConfigKey(),str(event_id))
+            else:
+                await self.r.hset(self.QueueConfigKey(),str(event_id),int(cap))
+            self.queueCaps.Delete(str(event_id))
+            return {"status":True}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"SetQueueCapError ! message : {type(e)} {e}"}
+
+    #取出一批待寫入的票券(同時更新 writer 心跳)
+    #回傳的 records 依購買先後排列
+    async def TakeTicketBatch(self,writerID,batchSize,heartbeatSeconds):
+        try:
+            records = await self.ticketTakeScript(keys=[self.TicketQueueKey(),self.TicketProcessingKey(writerID),self.TicketWriterKey(writerID)],
+                                                  args=[batchSize,int(heartbeatSeconds*1000)])
+            return {"status":True,
+                    "records":[json.loads(record) for record in reversed(records)]}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"TakeTicketBatchError ! message : {type(e)} {e}"}
+
+    #一批票券已寫入資料庫，清空處理中佇列
+    #failed : 座位已由其他使用者寫入資料庫的紀錄，取消這些使用者的購票並保留 failedSeconds 秒的失敗紀錄
+    async def TicketBatchDone(self,writerID,records,recentSeconds,failed=(),failedSeconds=86400):
+        try:
+            keys = [self.TicketProcessingKey(writerID)]
+            args = [int(recentSeconds),len(records)]
+            for record in records:
+                keys += self.TicketPendingKeys(record["registerID"])
+                args.append(self.TicketField(record))
+            args.append(int(failedSeconds))
+            for record in failed:
+                keys += self.TicketPendingKeys(record["registerID"])+[self.TicketFailedKey(record["registerID"]),
+                                                                      self.PurchaserKey(record["event_id"])]
+                args += [self.TicketField(record),record.get("loginID",""),json.dumps(record)]
+            await self.ticketDoneScript(keys=keys,args=args)
+            return {"status":True}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"TicketBatchDoneError ! message : {type(e)} {e}"}
+
+    #收回心跳已過期的 writer 留下的處理中佇列
+    async def RecoverTicketBatches(self):
+        try:
+            recovered = {}
+            async for key in self.r.scan_iter(match="<ticketProcessing>:\\[*\\]",count=1000):
+                writerID = key.split("[",1)[1].rsplit("]",1)[0]
+                moved = await self.ticketRecoverScript(keys=[key,self.TicketWriterKey(writerID),self.TicketQueueKey()])
+                if moved:
+                    recovered[writerID] = moved
+            return {"status":True,
+                    "recovered":recovered}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"RecoverTicketBatchesError ! message : {type(e)} {e}"}
+
+    #使用者尚未寫入及近期寫入的購票紀錄(讀取自己剛寫入的資料用)
+    #failed 為寫入時座位已由其他使用者購買而失敗的紀錄
+    async def GetPendingTickets(self,registerID):
+        try:
+            pendingKey,recentKey = self.TicketPendingKeys(registerID)
+            async with self.r.pipeline(transaction=False) as pipe:
+                pipe.hvals(pendingKey)
+                pipe.hvals(recentKey)
+                pipe.hvals(self.TicketFailedKey(registerID))
+                pending,recent,failed = await pipe.execute()
+            return {"status":True,
+                    "tickets":[json.loads(record) for record in pending+recent],
+                    "failed":[json.loads(record) for record in failed]}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"GetPendingTicketsError ! message : {type(e)} {e}"}
+
+    #登記已使用的驗證碼，已登記過(重複使用)時 claimed 為 False
+    async def TotpClaim(self,loginID,timecode,ttl):
+        try:
+            claimed = await self.r.set(self.TotpUsedKey(loginID,timecode),1,nx=True,ex=int(ttl))
+            return {"status":True,
+                    "claimed":bool(claimed)}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"TotpClaimError ! message : {type(e)} {e}"}
+
+    #購票失敗時取消登記，讓使用者可以用同一組驗證碼重試
+    async def TotpRelease(self,loginID,timecode):
+        try:
+            await self.r.delete(self.TotpUsedKey(loginID,timecode))
+            return {"status":True}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"TotpReleaseError ! message : {type(e)} {e}"}
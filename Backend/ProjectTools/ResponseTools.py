@@ -0,0 +1,24 @@
+import datetime
+import decimal
+
+import orjson
+from fastapi.responses import JSONResponse
+
+#date / datetime / time / tuple / dataclass 由 orjson 直接處理；其他 pymysql 可能回傳的型別在此轉換
+#轉換結果與 fastapi.encoders.jsonable_encoder 相同
+def Default(obj):
+    if isinstance(obj,decimal.Decimal):
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if isinstance(obj,datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj,(set,frozenset)):
+        return list(obj)
+    if isinstance(obj,bytes):
+        return obj.decode()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+#以 orjson 輸出的 JSONResponse
+#回傳資料不需先經過 jsonable_encoder；非字串的 key(例如 event_id)轉為字串
+class FastJSONResponse(JSONResponse):
+    def render(self,content):
+        return orjson.dumps(content,default=Default,option=orjson.OPT_NON_STR_KEYS)
@@ -0,0 +1,161 @@
+from array import array
+from bisect import bisect_right
+import json
+
+#預設座位配置(與前端選位畫面一致)
+#(區域, 排數, 每排座位數)
+DEFAULT_LAYOUT = [("搖滾區左",5,10),
+                  ("搖滾區中",5,20),
+                  ("搖滾區右",5,10),
+                  ("A區",20,10),
+                  ("B區",20,20),
+                  ("C區",20,10),
+                  ("D區",10,20)]
+
+#座位配置
+#每個座位有固定的序號 : 區域依序排列，區域內由第 1 排第 1 位開始往後編號
+#序號即為 Redis 座位點陣圖中的位元位置
+#區域的起始序號、排數、每排座位數以 array 存放；blocked 為不開放的座位(例如保留席)
+#mask 為可售座位的點陣圖，座位狀態 = mask - 售出 - 鎖定
+class SeatLayout:
+    def __init__(self,sections=DEFAULT_LAYOUT,blocked=()):
+        self.sections = list(sections)
+        self.areas = [area for area,_,_ in self.sections]
+        self.index = {area:i for i,area in enumerate(self.areas)}
+        self.offsets = array("I")
+        self.rows = array("I")
+        self.cols = array("I")
+        offset = 0
+        for area,rows,cols in self.sections:
+            self.offsets.append(offset)
+            self.rows.append(rows)
+            self.cols.append(cols)
+            offset += rows*cols
+        self.total = offset
+
+        self.mask = bytearray(b"\xff"*self.Size())
+        if self.total % 8:
+            self.mask[-1] = (0xff << (8-self.total % 8)) & 0xff
+        for area,row,column in blocked:
+            ordinal = self.Locate(area,row,column)
+            if ordinal is not None:
+                self.mask[ordinal >> 3] &= ~(0x80 >> (ordinal & 7)) & 0xff
+        self.mask = bytes(self.mask)
+        self.capacity = int.from_bytes(self.mask,"big").bit_count()
+
+    #座位 -> 序號，座位不存在或不開放時回傳 None
+    def Ordinal(self,area,row,column):
+        ordinal = self.Locate(area,row,column)
+        if ordinal is None or not self.Test(self.mask,ordinal):
+            return None
+        return ordinal
+
+    #座位 -> 序號(不檢查是否開放)，座位不存在時回傳 None
+    def Locate(self,area,row,column):
+        i = self.index.get(area)
+        if i is None:
+            return None
+        try:
+            row,column = int(row),int(column)
+        except (TypeError,ValueError):
+            return None
+        cols = self.cols[i]
+        if not (1 <= row <= self.rows[i] and 1 <= column <= cols):
+            return None
+        return self.offsets[i]+(row-1)*cols+(column-1)
+
+    #序號 -> 座位
+    def Seat(self,ordinal):
+        i = bisect_right(self.offsets,ordinal)-1
+        row,column = divmod(ordinal-self.offsets[i],self.cols[i])
+        return (self.areas[i],row+1,column+1)
+
+    #可購買的座位點陣圖 : 可售座位 - 售出 - 鎖定
+    def Available(self,sold,held):
+        size = self.Size()
+        sold = int.from_bytes(sold[:size].ljust(size,b"\0"),"big")
+        held = int.from_bytes(held[:size].ljust(size,b"\0"),"big")
+        return (int.from_bytes(self.mask,"big") & ~(sold | held)).to_bytes(size,"big")
+
+    #區域配置(提供前端繪製及解碼點陣圖)
+    def Sections(self):
+        return [{"area":area,"rows":rows,"cols":cols,"start":offset}
+                for area,rows,cols,offset in zip(self.areas,self.rows,self.cols,self.offsets)]
+
+    #點陣圖 -> 座位列表(Redis 的位元 0 為第一個位元組的最高位)
+    def Decode(self,bitmap):
+        seats = []
+        for i,byte in enumerate(bitmap):
+            if not byte:
+                continue
+            for bit in range(8):
+                if byte & (0x80 >> bit):
+                    ordinal = i*8+bit
+                    if ordinal < self.total:
+                        seats.append(self.Seat(ordinal))
+        return seats
+
+    #點陣圖中座位是否為 1
+    def Test(self,bitmap,ordinal):
+        i = ordinal >> 3
+        return i < len(bitmap) and bool(bitmap[i] & (0x80 >> (ordinal & 7)))
+
+    #點陣圖所需位元組數
+    def Size(self):
+        return (self.total+7)//8
+
+#取得活動的座位配置
+#並快取各活動最新版本的座位狀態回應
+class SeatTools:
+    def __init__(self):
+        self.default = SeatLayout()
+        self.layouts = {}        #event_id -> SeatLayout，啟動時由資料庫載入
+        self.availability = {}   #(event_id, format) -> (版本, 回應)
+
+    #活動的座位配置，沒有設定時使用預設配置
+    def GetLayout(self,event_id):
+        return self.layouts.get(str(event_id),self.default)
+
+    #由資料庫的座位配置建立各活動的 SeatLayout
+    #rows : [(event_id, area, rows, cols, blocked),...]，依 event_id 及區域順序排列
+    #blocked 為 JSON 陣列 [[row,column],...] 或 None
+    def LoadLayouts(self,rows):
+        sections = {}
+        blocked = {}
+        for event_id,area,rowCount,colCount,blockedSeats in rows:
+            event_id = str(event_id)
+            sections.setdefault(event_id,[]).append((area,int(rowCount),int(colCount)))
+            for row,column in json.loads(blockedSeats or "[]"):
+                blocked.setdefault(event_id,[]).append((area,row,column))
+        self.layouts = {event_id:SeatLayout(sections[event_id],blocked.get(event_id,()))
+                        for event_id in sections}
+        self.availability.clear()
+        return len(self.layouts)
+
+    #取得快取的座位狀態回應，沒有時回傳 None
+    def GetAvailability(self,event_id,fmt):
+        return self.availability.get((str(event_id),fmt))
+
+    #存入座位狀態回應(只保留較新的版本)
+    def SetAvailability(self,event_id,fmt,version,response):
+        key = (str(event_id),fmt)
+        cached = self.availability.get(key)
+        if not cached or cached[0] <= version:
+            self.availability[key] = (version,response)
+
+    #座位狀態的 ETag
+    def ETag(self,event_id,fmt,version):
+        return f'"{event_id}-{version}-{fmt}"'
+
+    #從 If-None-Match 取出版本號，格式不符時回傳 None
+    def ParseETag(self,header,event_id,fmt):
+        if not header:
+            return None
+        try:
+            etag = header.split(",")[0].strip().removeprefix("W/").strip('"')
+            etagEventID,version,etagFmt = etag.rsplit("-",2)
+            if etagEventID != str(event_id) or etagFmt != fmt:
+                return None
+            return int(version)
+        except ValueError:
+            return None
@@ -1,84 +1,487 @@
 import pymysql
+import asyncio
+import functools
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
 
+from .CacheTools import TTLCache
+
+#連線池取得逾時
+class SqlPoolTimeout(Exception):
+    pass
+
+#連線池
+#有上限、執行緒安全，借出時檢查連線狀態，閒置過久的連線會被回收
+class SqlPool:
+    def __init__(self,connect,minSize=1,maxSize=10,recycle=300,timeout=10,pingInterval=5):
+        self.connect = connect
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.recycle = recycle              #閒置超過此秒數的連線直接關閉
+        self.timeout = timeout              #等待可用連線的最長秒數
+        self.pingInterval = pingInterval    #閒置超過此秒數，借出前先 ping 一次
+        self.idle = deque()                 #(連線, 最後歸還時間)，右側為最近歸還
+        self.size = 0                       #目前已開啟的連線數(閒置 + 借出)
+        self.cond = threading.Condition()
+        self.stats = {"opened":0,"closed":0,"checkouts":0,
+                      "waits":0,"waitTime":0.0,"maxWait":0.0,
+                      "timeouts":0,"healthFailures":0}
+
+    #預先建立最少連線數
+    def Warm(self):
+        while True:
+            with self.cond:
+                if self.size >= self.minSize:
+                    return
+                self.size += 1
+            try:
+                con = self.connect()
+            except Exception:
+                with self.cond:
+                    self.size -= 1
+                    self.cond.notify()
+                raise
+            with self.cond:
+                self.stats["opened"] += 1
+                self.idle.append((con,time.monotonic()))
+                self.cond.notify()
+
+    #借出連線
+    def Acquire(self):
+        start = time.monotonic()
+        deadline = start+self.timeout
+        waited = False
+        while True:
+            with self.cond:
+                while not self.idle and self.size >= self.maxSize:
+                    remaining = deadline-time.monotonic()
+                    if remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        raise SqlPoolTimeout(f"等待資料庫連線逾時 ({self.timeout}s) !")
+                    waited = True
+                    self.cond.wait(remaining)
+                if self.idle:
+                    con,lastUsed = self.idle.pop()
+                else:
+                    con,lastUsed = None,None
+                    self.size += 1
+
+            if con is None:
+                try:
+                    con = self.connect()
+                except Exception:
+                    with self.cond:
+                        self.size -= 1
+                        self.cond.notify()
+                    raise
+                with self.cond:
+                    self.stats["opened"] += 1
+            else:
+                idleTime = time.monotonic()-lastUsed
+                if idleTime > self.recycle:
+                    self.Discard(con)
+                    continue
+                if idleTime > self.pingInterval and not self.Ping(con):
+                    with self.cond:
+                        self.stats["healthFailures"] += 1
+                    self.Discard(con)
+                    continue
+
+            with self.cond:
+                self.stats["checkouts"] += 1
+                if waited:
+                    waitTime = time.monotonic()-start
+                    self.stats["waits"] += 1
+                    self.stats["waitTime"] += waitTime
+                    self.stats["maxWait"] = max(self.stats["maxWait"],waitTime)
+            return con
+
+    #歸還連線
+    def Release(self,con):
+        expired = []
+        with self.cond:
+            now = time.monotonic()
+            self.idle.append((con,now))
+            #回收超過最少連線數、且閒置過久的連線(左側為最久未使用)
+            while len(self.idle) > self.minSize and now-self.idle[0][1] > self.recycle:
+                expired.append(self.idle.popleft()[0])
+            self.cond.notify()
+        for con in expired:
+            self.Discard(con)
+
+    #關閉連線並讓出名額
+    def Discard(self,con):
+        try:
+            con.close()
+        except Exception:
+            pass
+        with self.cond:
+            self.size -= 1
+            self.stats["closed"] += 1
+            self.cond.notify()
+
+    #關閉所有閒置連線
+    def Close(self):
+        with self.cond:
+            idle = [con for con,_ in self.idle]
+            self.idle.clear()
+        for con in idle:
+            self.Discard(con)
+
+    #檢查連線是否可用
+    def Ping(self,con):
+        try:
+            con.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    #連線池狀態
+    def Stats(self):
+        with self.cond:
+            stats = dict(self.stats)
+            stats.update({"size":self.size,
+                          "idle":len(self.idle),
+                          "inUse":self.size-len(self.idle),
+                          "minSize":self.minSize,
+                          "maxSize":self.maxSize})
+        stats["avgWait"] = stats["waitTime"]/stats["waits"] if stats["waits"] else 0.0
+        return stats
+
+#讀取副本
+#連線失敗時暫停使用，暫停秒數依連續失敗次數加倍(最長 maxBackoff 秒)，期間讀取改由其他副本或主庫處理
+class SqlReplica:
+    def __init__(self,name,pool,retry=5,maxBackoff=60):
+        self.name = name
+        self.pool = pool
+        self.retry = retry
+        self.maxBackoff = maxBackoff
+        self.failures = 0
+        self.downUntil = 0.0
+        self.lock = threading.Lock()
+
+    def Healthy(self,now):
+        return self.downUntil <= now
+
+    #借出中的連線數，作為負載
+    def Load(self):
+        return self.pool.size-len(self.pool.idle)
+
+    def MarkDown(self):
+        with self.lock:
+            self.failures += 1
+            self.downUntil = time.monotonic()+min(self.retry*2**(self.failures-1),self.maxBackoff)
+
+    def MarkUp(self):
+        if self.failures:
+            with self.lock:
+                self.failures = 0
+                self.downUntil = 0.0
+
+#會員資料欄位
+PROFILE_COLUMN = ["login_id","name","gender","birthday",
+                  "email","phone_number","mobile_number","address"]
+
 #建立連線
+#寫入一律使用主庫(url)；有副本(replicaURLs)時，SELECT 交給健康且負載較低的副本
+#使用者寫入後 stickySeconds 秒內，該使用者的讀取改用主庫，避免讀到副本尚未同步的資料
+#connectTimeout / readTimeout / writeTimeout : 連線及讀寫的逾時秒數，資料庫變慢時查詢不會無限等待
+#breaker : 主庫的斷路器(BreakerTools.CircuitBreaker)，開啟時主庫的查詢直接失敗
 class SqlBase:
-    def __init__(self,url):
+    def __init__(self,url,minSize=1,maxSize=10,recycle=300,timeout=10,pingInterval=5,
+                 replicaURLs=(),stickySeconds=5,replicaRetry=5,
+                 connectTimeout=5,readTimeout=10,writeTimeout=10,breaker=None,metricsT=None):
         self.url = urlparse(url)
         self.user = self.url.username
         self.password = self.url.password
         self.host = self.url.hostname
         self.port = self.url.port
         self.database = self.url.path.lstrip("/")
-    def Execution(self, INSTRUCTION, SELECT=False, SET=None):
-        con = pymysql.connect(
+        self.timeouts = {"connect_timeout":connectTimeout,
+                         "read_timeout":readTimeout,
+                         "write_timeout":writeTimeout}
+        self.breaker = breaker
+        self.pool = SqlPool(connect=self.Connect,minSize=minSize,maxSize=maxSize,
+                            recycle=recycle,timeout=timeout,pingInterval=pingInterval)
+        self.replicas = []
+        for replicaURL in replicaURLs:
+            replicaURL = urlparse(replicaURL)
+            pool = SqlPool(connect=functools.partial(self.ConnectTo,replicaURL),minSize=minSize,maxSize=maxSize,
+                           recycle=recycle,timeout=timeout,pingInterval=pingInterval)
+            self.replicas.append(SqlReplica(name=f"{replicaURL.hostname}:{replicaURL.port or 3306}",pool=pool,retry=replicaRetry))
+        self.stickySeconds = stickySeconds
+        self.lastWrite = TTLCache(maxSize=100000,ttl=stickySeconds)    #STICKY -> 最後寫入時間
+        self.metricsT = metricsT
+        if metricsT is not None:
+            metricsT.Describe("sql_query_seconds","histogram","SQL 查詢延遲(秒)，依呼叫的方法與結果")
+            metricsT.Describe("sql_pool_acquire_seconds","histogram","向連線池借出連線的等待時間(秒)")
+            metricsT.Describe("sql_reads_total","counter","SELECT 次數，依處理的資料庫(primary / replica)")
+            metricsT.AddCollector("sql",self.Collect)
+
+    #開啟新連線
+    #連線會被重複使用，開啟 autocommit 避免讀取停留在舊的交易快照
+    def Connect(self):
+        return pymysql.connect(
             user=self.user,
             password=self.password,
             host=self.host,
             port=self.port,
-            database=self.database
+            database=self.database,
+            autocommit=True,
+            **self.timeouts
+        )
+
+    #開啟副本的連線
+    def ConnectTo(self,url):
+        return pymysql.connect(
+            user=url.username,
+            password=url.password,
+            host=url.hostname,
+            port=url.port,
+            database=url.path.lstrip("/"),
+            autocommit=True,
+            **self.timeouts
         )
-        cur = con.cursor()
+
+    #預先建立連線，副本無法連線時先暫停使用
+    def Warm(self):
+        self.pool.Warm()
+        for replica in self.replicas:
+            try:
+                replica.pool.Warm()
+            except Exception:
+                replica.MarkDown()
+
+    #MANY 為 True 時 SET 為多組參數(executemany)，INSERT 會合併為一道多筆的指令
+    #STICKY 為使用者的鍵(註冊編號或帳號) : 寫入時記下時間；讀取時若該使用者剛寫入過則使用主庫
+    #PRIMARY 為 True 時讀取一律使用主庫(需要最新資料時，例如初始化售出點陣圖)
+    def Execution(self, INSTRUCTION, SELECT=False, SET=None, MANY=False, STICKY=None, PRIMARY=False):
+        if self.metricsT is None:
+            return self.Dispatch(INSTRUCTION,SELECT,SET,MANY,STICKY,PRIMARY)
+        #以呼叫 Execution 的方法名稱(例如 GetSecret)區分查詢
+        query = sys._getframe(1).f_code.co_name
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return self.Dispatch(INSTRUCTION,SELECT,SET,MANY,STICKY,PRIMARY)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            self.metricsT.Observe("sql_query_seconds",time.perf_counter()-start,
+                                  (("query",query),("status",status)))
+
+    #選擇執行的資料庫，副本連線失敗時改由主庫重試
+    def Dispatch(self, INSTRUCTION, SELECT, SET, MANY, STICKY, PRIMARY=False):
         if SELECT:
-            cur.execute(INSTRUCTION, SET)
-            result = cur.fetchall()
-            con.close()
-            return result
+            replica = None if PRIMARY else self.ChooseReplica(STICKY)
+            if replica is not None:
+                try:
+                    result = self.Run(INSTRUCTION,SELECT,SET,MANY,pool=replica.pool)
+                    replica.MarkUp()
+                    self.CountRead("replica")
+                    return result
+                except (pymysql.err.OperationalError,pymysql.err.InterfaceError,SqlPoolTimeout):
+                    replica.MarkDown()
+            self.CountRead("primary")
+            return self.RunPrimary(INSTRUCTION,SELECT,SET,MANY)
+        result = self.RunPrimary(INSTRUCTION,SELECT,SET,MANY)
+        if STICKY is not None:
+            self.Touch(STICKY)
+        return result
+
+    #在主庫執行，經過斷路器
+    #連線失敗、逾時及等待連線逾時視為失敗；其他錯誤(例如唯一鍵衝突)代表主庫仍正常回應
+    def RunPrimary(self, INSTRUCTION, SELECT, SET, MANY):
+        if self.breaker is None:
+            return self.Run(INSTRUCTION,SELECT,SET,MANY)
+        self.breaker.Before()
+        start = time.monotonic()
+        failed = False
+        try:
+            return self.Run(INSTRUCTION,SELECT,SET,MANY)
+        except (pymysql.err.OperationalError,pymysql.err.InterfaceError,SqlPoolTimeout):
+            failed = True
+            raise
+        finally:
+            self.breaker.After(time.monotonic()-start,failed)
+
+    #從健康的副本中隨機取兩個，選負載較低的一個；該使用者剛寫入過或沒有可用副本時回傳 None(使用主庫)
+    def ChooseReplica(self,STICKY=None):
+        if not self.replicas or self.Sticky(STICKY):
+            return None
+        now = time.monotonic()
+        healthy = [replica for replica in self.replicas if replica.Healthy(now)]
+        if not healthy:
+            return None
+        return min(random.sample(healthy,min(2,len(healthy))),key=SqlReplica.Load)
+
+    #記下使用者的寫入時間(at 為其他 worker 寫入的時間，例如 session 中的 ProfileVersion)
+    def Touch(self,STICKY,at=None):
+        now = time.time()
+        at = now if at is None else at
+        remaining = self.stickySeconds-(now-at)
+        if remaining <= 0:
+            return
+        last = self.lastWrite.Get(STICKY)
+        if last is None or last < at:
+            self.lastWrite.Set(STICKY,at,ttl=remaining)
+
+    #使用者是否在 stickySeconds 內寫入過
+    def Sticky(self,STICKY):
+        return STICKY is not None and self.lastWrite.Get(STICKY) is not None
+
+    def CountRead(self,target):
+        if self.metricsT is not None:
+            self.metricsT.Inc("sql_reads_total",(("target",target),))
+
+    def Run(self, INSTRUCTION, SELECT=False, SET=None, MANY=False, pool=None):
+        pool = self.pool if pool is None else pool
+        if self.metricsT is None:
+            con = pool.Acquire()
         else:
-            if SET:
-                cur.execute(INSTRUCTION, SET)
-            else:
-                cur.execute(INSTRUCTION)
-            con.commit()
-            con.close()
+            start = time.perf_counter()
+            con = pool.Acquire()
+            self.metricsT.Observe("sql_pool_acquire_seconds",time.perf_counter()-start)
+        try:
+            with con.cursor() as cur:
+                if MANY:
+                    cur.executemany(INSTRUCTION, SET)
+                else:
+                    cur.execute(INSTRUCTION, SET)
+                result = cur.fetchall() if SELECT else None
+            if not SELECT:
+                con.commit()
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            #連線已損壞，不放回連線池
+            pool.Discard(con)
+            raise
+        except Exception:
+            try:
+                con.rollback()
+            except Exception:
+                pool.Discard(con)
+                raise
+            pool.Release(con)
+            raise
+        pool.Release(con)
+        return result
+
+    #連線池狀態指標
+    def Collect(self):
+        stats = self.pool.Stats()
+        now = time.monotonic()
+        return [("sql_pool_connections","gauge","連線池目前的連線數",(("state","idle"),),stats["idle"]),
+                ("sql_pool_connections","gauge","連線池目前的連線數",(("state","in_use"),),stats["inUse"]),
+                ("sql_pool_max_connections","gauge","連線池上限",(),stats["maxSize"]),
+                ("sql_pool_opened_total","counter","累計開啟的連線數",(),stats["opened"]),
+                ("sql_pool_closed_total","counter","累計關閉的連線數",(),stats["closed"]),
+                ("sql_pool_checkouts_total","counter","累計借出次數",(),stats["checkouts"]),
+                ("sql_pool_waits_total","counter","需要等待可用連線的借出次數",(),stats["waits"]),
+                ("sql_pool_timeouts_total","counter","等待連線逾時次數",(),stats["timeouts"]),
+                ("sql_pool_health_failures_total","counter","借出前健康檢查失敗次數",(),stats["healthFailures"])]+[
+                ("sql_replica_up","gauge","副本是否可用",(("replica",replica.name),),int(replica.Healthy(now)))
+                for replica in self.replicas]+[
+                ("sql_replica_connections","gauge","副本目前借出的連線數",(("replica",replica.name),),replica.Load())
+                for replica in self.replicas]
+
     def TupleToList(self,data):
         return list(map(lambda _:list(_),data))
     
-    def seatCellToLabel(self,ticket):
-        for i in range(len(ticket)):
-            seat = ticket[i]
-            column = seat.pop()
-            row = seat.pop()
-            area = seat.pop()
-            seat+=[f"{area} | 第{row}排 第{column}位"]
-            ticket[i] = seat
-        return ticket
+    def SeatLabel(self,area,row,column):
+        return f"{area} | 第{row}排 第{column}位"
 
 
 #功能
 #繼承父類別
 class SqlTools(SqlBase):
     
-    def __init__(self,URL):
-        super().__init__(URL)
+    def __init__(self,URL,userCacheSize=10000,userCacheTTL=300,eventCacheSize=1000,eventCacheTTL=600,
+                 profileCacheSize=10000,profileCacheTTL=60,**poolOptions):
+        super().__init__(URL,**poolOptions)
+        self.userCache = TTLCache(maxSize=userCacheSize,ttl=userCacheTTL)
+        self.eventCache = TTLCache(maxSize=eventCacheSize,ttl=eventCacheTTL)   #event_id -> 活動資料
+        self.eventTitleCache = TTLCache(maxSize=eventCacheSize,ttl=eventCacheTTL)  #title -> event_id
+        self.profileCache = TTLCache(maxSize=profileCacheSize,ttl=profileCacheTTL) #registerID -> (版本, 會員資料)
         
 #ProfileModule
 #------------------------------------------------------------------------------------
-    #取得使用者資料
-    def GetProfileData(self,profileColumn,loginID):
-        try:
-            INSTRUCTION=f"""SELECT {",".join(profileColumn)}
-                            FROM register 
-                            WHERE login_id=%s"""
-            SET=(loginID,)
-            profileData = self.TupleToList(self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET))[0]
-    
+    #取得使用者資料及購票紀錄
+    #以 LEFT JOIN 一次查出，並依註冊編號快取
+    #version 不同時(其他 worker 已有新的購票)視為快取失效
+    #version 為購票時間，購票後 stickySeconds 內改由主庫讀取(購票可能在其他 worker)
+    def GetProfileData(self,registerID,version=None):
+        try:
+            cached = self.profileCache.Get(registerID)
+            if cached is not None and cached[0] == version:
+                return {"status":True,
+                        "profileData":cached[1]}
+            if isinstance(version,(int,float)):
+                self.Touch(registerID,version)
+
+            INSTRUCTION=f"""SELECT {",".join("register."+column for column in PROFILE_COLUMN)},
+                                   ticket.event_id,ticket.area,ticket.`row`,ticket.`column`
+                            FROM register
+                            LEFT JOIN ticket
+                            ON ticket.register_id = register.id
+                            WHERE register.id = %s"""
+            SET=(registerID,)
+            rows = self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET,STICKY=registerID)
+            size = len(PROFILE_COLUMN)
+            tickets = [row[size:] for row in rows if row[size] is not None]
+            events = self.GetEvents({ticket[0] for ticket in tickets})
+
+            profileData = dict(zip(PROFILE_COLUMN,rows[0][:size]))
+            profileData["ticket"] = [[events[event_id]["title"],events[event_id]["date"],events[event_id]["location"],
+                                      self.SeatLabel(area,row,column)]
+                                     for event_id,area,row,column in tickets]
+            self.profileCache.Set(registerID,(version,profileData))
             return {"status":True,
                     "profileData":profileData}
         except Exception as e:
             return {"status":False,
                     "notify":f"GetProfileDataError ! message : [{type(e)} | {e}]"}
             
+    #合併尚未寫入資料庫的購票紀錄(write-behind)
+    #tickets : [{"event_id","area","row","column"},...]，已寫入資料庫的不重複列出
+    #failed : 寫入時座位已由其他使用者購買的紀錄，列在 failedTicket
+    def MergeTickets(self,profileData,tickets,failed=()):
+        try:
+            events = self.GetEvents({int(ticket["event_id"]) for ticket in list(tickets)+list(failed)})
+            def Item(ticket):
+                event = events[int(ticket["event_id"])]
+                return [event["title"],event["date"],event["location"],
+                        self.SeatLabel(ticket["area"],ticket["row"],ticket["column"])]
+            merged = list(profileData["ticket"])
+            for ticket in tickets:
+                item = Item(ticket)
+                if item not in merged:
+                    merged.append(item)
+            return {"status":True,
+                    "profileData":{**profileData,"ticket":merged,"failedTicket":[Item(ticket) for ticket in failed]}}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"MergeTicketsError ! message : [{type(e)} | {e}]"}
+
     #取得購票紀錄
-    def GetTicketData(self,registerID,ticketColumn):
+    #活動名稱、日期、地點由活動快取補上，不再 JOIN event
+    #回傳 [[title,date,location,"區域 | 第x排 第x位"],...]
+    def GetTicketData(self,registerID):
         try:
-            INSTRUCTION=f"""SELECT {",".join(ticketColumn)} 
-                            FROM ticket
-                            INNER JOIN `event` 
-                            ON  `event`.id = ticket.event_id 
-                            WHERE register_id = %s"""                  
+            INSTRUCTION="""SELECT event_id,area,`row`,`column` 
+                           FROM ticket
+                           WHERE register_id = %s"""                  
             SET=(registerID,)
-            ticketData = self.seatCellToLabel(self.TupleToList(self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET)))
+            tickets = self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET,STICKY=registerID)
+            events = self.GetEvents({ticket[0] for ticket in tickets})
+            ticketData = [[events[event_id]["title"],events[event_id]["date"],events[event_id]["location"],
+                           self.SeatLabel(area,row,column)]
+                          for event_id,area,row,column in tickets]
         
             return {"status":True,
                     "ticketData":ticketData}
@@ -90,46 +493,33 @@ class SqlTools(SqlBase):
 
 #LoginModule
 #------------------------------------------------------------------------------------
-    #取得帳號、密碼
-    def GetUserData(self,loginIDInput,passwordInput):
+    #取得登入資料
+    #以帳號、密碼一次查出註冊編號、姓名及密鑰，並存入使用者快取
+    def GetLoginData(self,loginIDInput,passwordInput):
         try:
-            INSTRUCTION="""SELECT login_id,password FROM register
+            INSTRUCTION="""SELECT id,login_id,name,secret FROM register
                            WHERE login_id=%s AND password=%s"""
             SET=(loginIDInput,passwordInput)
-            userData = self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET)
-            return {"status":True,
-                    "userData":userData}
-        
-        except Exception as e:
-            return {"status":False,
-                    "notify":f"GetUserDataError ! message : [{type(e)} | {e}]"}
-        
-    #取得姓名
-    def GetUserName(self,loginIDInput,passwordInput):
-        try:
-            INSTRUCTION="""SELECT name FROM register 
-                           WHERE login_id=%s AND password=%s"""
-            SET=(loginIDInput,passwordInput)
-            userName = self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET)[0][0]
-            return {"status":True,
-                    "userName":userName}
-        except Exception as e:
-            return {"status":False,
-                    "notify":f"GetUserNameError ! message : [{type(e)} | {e}]"}
+            userData = self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET,STICKY=loginIDInput)
+            if not userData:
+                return {"status":True,
+                        "loginData":None}
 
-    #取得註冊編號
-    def GetRegisterID(self,loginIDInput,passwordInput):
-        try:
-            INSTRUCTION="""SELECT id FROM register 
-                           WHERE login_id=%s AND password=%s"""
-            SET=(loginIDInput,passwordInput)
-            
-            registerID = self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET)[0][0]
+            registerID,loginID,userName,secret = userData[0]
+            self.CacheUser(loginID=loginID,registerID=registerID,userName=userName,secret=secret)
             return {"status":True,
-                    "registerID":registerID}
+                    "loginData":{"registerID":registerID,
+                                 "loginID":loginID,
+                                 "userName":userName}}
         except Exception as e:
             return {"status":False,
-                    "notify":f"GetUserIDError ! message : [{type(e)} | {e}]"}
+                    "notify":f"GetLoginDataError ! message : [{type(e)} | {e}]"}
+
+    #使用者快取(不含密碼) : loginID -> 註冊編號、姓名、密鑰
+    def CacheUser(self,loginID,registerID,userName,secret):
+        self.userCache.Set(loginID,{"registerID":registerID,
+                                    "userName":userName,
+                                    "secret":secret})
 #------------------------------------------------------------------------------------
 
 #RegisterModule
@@ -145,7 +535,7 @@ class SqlTools(SqlBase):
             SET=(loginID,password,name,gender,birthday,
                  email,phone_number,mobile_number,address,secret)
             
-            self.Execution(INSTRUCTION=INSTRUCTION,SET=SET)
+            self.Execution(INSTRUCTION=INSTRUCTION,SET=SET,STICKY=loginID)
             return {"status":True}
         except Exception as e:
             return {"status":False,
@@ -155,14 +545,21 @@ class SqlTools(SqlBase):
 #TicketModule
 #------------------------------------------------------------------------------------
     #取得密鑰
+    #優先使用使用者快取，沒有時才查詢資料庫
     def GetSecret(self,loginID):
         try:
-            INSTRUCTION = """SELECT secret
+            user = self.userCache.Get(loginID)
+            if user is not None:
+                return {"status":True,
+                        "secret":user["secret"]}
+
+            INSTRUCTION = """SELECT id,name,secret
                              FROM   register 
                              WHERE  login_id=%s"""
             SET = (loginID,)
             
-            secret = self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET)[0][0]
+            registerID,userName,secret = self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET,STICKY=loginID)[0]
+            self.CacheUser(loginID=loginID,registerID=registerID,userName=userName,secret=secret)
             return {"status":True,
                     "secret":secret}
         
@@ -177,29 +574,79 @@ class SqlTools(SqlBase):
                              VALUES(%s,%s,%s,%s,%s)"""
             SET = (registerID,event_id,area,row,column)
             
-            self.Execution(INSTRUCTION=INSTRUCTION,SET=SET)
+            self.Execution(INSTRUCTION=INSTRUCTION,SET=SET,STICKY=registerID)
+            self.profileCache.Delete(registerID)
             return {"status":True}
         
+        except pymysql.err.IntegrityError:
+            return {"status":False,
+                    "duplicate":True,
+                    "notify":"此位置已售出 !"}
         except Exception as e:
             return {"status":False,
                     "notify":f"InsertTicketDataError ! message : [{type(e)} | {e}]"}
 
+    #批次存入票券資料(write-behind)
+    #rows : [(registerID,event_id,area,row,column),...]
+    #批次中有座位已寫入時，改為逐筆寫入並查詢該座位在資料庫中的購買者
+    #  同一使用者(例如重新寫入收回的批次) : 已寫入，略過
+    #  其他使用者 : 座位已售出，此筆購票失敗
+    #回傳 count : 寫入筆數, duplicates : 略過的座位, conflicts : 已由其他使用者購買的座位
+    def InsertTicketBatch(self,rows):
+        try:
+            INSTRUCTION = """INSERT INTO ticket(register_id,event_id,area,`row`,`column`)
+                             VALUES(%s,%s,%s,%s,%s)"""
+            
+            duplicates = []
+            conflicts = []
+            try:
+                self.Execution(INSTRUCTION=INSTRUCTION,SET=rows,MANY=True)
+            except pymysql.err.IntegrityError:
+                for row in rows:
+                    try:
+                        self.Execution(INSTRUCTION=INSTRUCTION,SET=row)
+                    except pymysql.err.IntegrityError:
+                        owner = self.Execution(INSTRUCTION="""SELECT register_id FROM ticket
+                                                              WHERE event_id=%s AND area=%s AND `row`=%s AND `column`=%s""",
+                                               SELECT=True,SET=row[1:],PRIMARY=True)
+                        if owner and str(owner[0][0]) == str(row[0]):
+                            duplicates.append(row)
+                        else:
+                            conflicts.append(row)
+            for registerID in {row[0] for row in rows}:
+                self.profileCache.Delete(registerID)
+            return {"status":True,
+                    "count":len(rows)-len(duplicates)-len(conflicts),
+                    "duplicates":duplicates,
+                    "conflicts":conflicts}
+        
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"InsertTicketBatchError ! message : [{type(e)} | {e}]"}
+
     #取得活動編號
+    #優先使用活動快取，沒有時才查詢資料庫
     def GetEventID(self,title):
         try:
-            INSTRUCTION = """SELECT id FROM event 
+            event_id = self.eventTitleCache.Get(title)
+            if event_id is not None:
+                return {"status":True,
+                        "event_id":event_id}
+
+            INSTRUCTION = """SELECT id,title,date,location FROM event 
                              WHERE title=%s"""
             SET = (title,)
             
-            event_id = self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET)[0][0]
+            event = self.CacheEvent(self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET)[0])
             return {"status":True,
-                    "event_id":event_id}
+                    "event_id":event["id"]}
         
         except Exception as e:
             return {"status":False,
                     "notify":f"GetEventIDError ! message : [{type(e)} | {e}]"}
 
     #取得活動的所有購票紀錄
+    #用來初始化售出點陣圖，由主庫讀取，不會漏掉副本尚未同步的購票
     def GetPurchasedData(self,event_id):
         try:
             INSTRUCTION = """SELECT area,`row`,`column` FROM `event` 
@@ -208,7 +655,7 @@ class SqlTools(SqlBase):
                              WHERE event_id = %s"""
             SET=(event_id,)
             
-            purchasedData = list(self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET))
+            purchasedData = list(self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=SET,PRIMARY=True))
             return {"status":True,
                     "purchasedData":purchasedData}
         
@@ -217,3 +664,112 @@ class SqlTools(SqlBase):
                     "notify":f"GetPurchasedDataError ! message : [{type(e)} | {e}]"}
 
 #------------------------------------------------------------------------------------
+
+#活動快取
+#------------------------------------------------------------------------------------
+    #啟動時載入所有活動
+    def LoadEvents(self):
+        try:
+            INSTRUCTION = """SELECT id,title,date,location FROM event"""
+            events = self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True)
+            for event in events:
+                self.CacheEvent(event)
+            return {"status":True,
+                    "count":len(events)}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"LoadEventsError ! message : [{type(e)} | {e}]"}
+
+    #啟動時載入所有活動的座位配置
+    #回傳 [(event_id, area, rows, cols, blocked),...]，依活動及區域順序排列
+    def GetSeatLayouts(self):
+        try:
+            INSTRUCTION = """SELECT event_id,area,`rows`,`cols`,blocked FROM seat_layout
+                             ORDER BY event_id,position"""
+            return {"status":True,
+                    "layouts":self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True)}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"GetSeatLayoutsError ! message : [{type(e)} | {e}]"}
+
+    #存入活動快取
+    def CacheEvent(self,event):
+        event_id,title,date,location = event
+        event = {"id":event_id,"title":title,"date":date,"location":location}
+        self.eventCache.Set(event_id,event)
+        self.eventTitleCache.Set(title,event_id)
+        return event
+
+    #取得多個活動資料，快取中沒有的一次查詢
+    #回傳 {event_id : 活動資料}
+    def GetEvents(self,eventIDs):
+        events = {}
+        missing = []
+        for event_id in eventIDs:
+            event = self.eventCache.Get(event_id)
+            if event is None:
+                missing.append(event_id)
+            else:
+                events[event_id] = event
+        if missing:
+            INSTRUCTION = f"""SELECT id,title,date,location FROM event
+                              WHERE id IN ({",".join(["%s"]*len(missing))})"""
+            for event in self.Execution(INSTRUCTION=INSTRUCTION,SELECT=True,SET=tuple(missing)):
+                event = self.CacheEvent(event)
+                events[event["id"]] = event
+        return events
+
+    #取得活動資料
+    def GetEventData(self,event_id):
+        try:
+            events = self.GetEvents([event_id])
+            if event_id not in events:
+                return {"status":False,
+                        "notify":f"活動不存在 ! event_id : {event_id}"}
+            return {"status":True,
+                    "eventData":events[event_id]}
+        except Exception as e:
+            return {"status":False,
+                    "notify":f"GetEventDataError ! message : [{type(e)} | {e}]"}
+
+    #清除活動快取，未指定 event_id 時全部清除
+    def InvalidateEvent(self,event_id=None):
+        if event_id is None:
+            self.eventCache.Clear()
+            self.eventTitleCache.Clear()
+            return
+        event = self.eventCache.Get(event_id)
+        self.eventCache.Delete(event_id)
+        if event is not None:
+            self.eventTitleCache.Delete(event["title"])
+
+#------------------------------------------------------------------------------------
+
+#非同步版本
+#與 SqlTools 相同的方法，交給有上限的執行緒池執行，查詢時不會卡住事件迴圈
+#執行緒數預設等於連線池上限(有副本時為主庫與副本的總和)，執行緒不會空等連線
+class AsyncSqlTools:
+    SqlClass = SqlTools
+
+    def __init__(self,URL,workers=None,**poolOptions):
+        self.sqlT = self.SqlClass(URL,**poolOptions)
+        self.executor = ThreadPoolExecutor(max_workers=workers or self.sqlT.pool.maxSize*(1+len(self.sqlT.replicas)),
+                                           thread_name_prefix="SqlTools")
+
+    def __getattr__(self,name):
+        attr = getattr(self.sqlT,name)
+        if not callable(attr):
+            return attr
+
+        async def Call(*args,**kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor,functools.partial(attr,*args,**kwargs))
+        setattr(self,name,Call)
+        return Call
+
+    #關閉執行緒池及連線池
+    def Close(self):
+        self.executor.shutdown(wait=True)
+        self.sqlT.pool.Close()
+        for replica in self.sqlT.replicas:
+            replica.pool.Close()
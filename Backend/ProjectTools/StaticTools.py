@@ -0,0 +1,76 @@
+import mimetypes
+import os
+import re
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+
+#打包後檔名帶有雜湊的資源(例如 index-4l2-rwMD.js)，內容不會改變
+HASHED_ASSET = re.compile(r"-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+
+#預先壓縮的檔案 : (Content-Encoding, 副檔名)，依優先順序排列
+ENCODINGS = [("br",".br"),("gzip",".gz")]
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+#靜態檔案
+#有預先壓縮的 .br / .gz 檔且瀏覽器支援時，直接回傳壓縮檔(壓縮由 Scripts/BuildStatic.py 在部署時完成)
+#帶雜湊的資源長期快取；index.html 等其他檔案每次都向伺服器確認(ETag / Last-Modified)
+class PrecompressedStaticFiles(StaticFiles):
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.variants = {}      #原始檔路徑 -> {encoding : (壓縮檔路徑, stat)}
+
+    #原始檔的壓縮版本(部署後不會改變，查過一次就快取)
+    def Variants(self,full_path):
+        variants = self.variants.get(full_path)
+        if variants is None:
+            variants = {}
+            for encoding,suffix in ENCODINGS:
+                try:
+                    variants[encoding] = (full_path+suffix,os.stat(full_path+suffix))
+                except OSError:
+                    continue
+            self.variants[full_path] = variants
+        return variants
+
+    #Accept-Encoding 中可接受的編碼(q=0 表示不接受)
+    def AcceptEncodings(self,header):
+        accepted = set()
+        for item in header.split(","):
+            encoding,_,params = item.strip().partition(";")
+            params = params.replace(" ","")
+            if params.startswith("q=") and params[2:] in ("0","0.0","0.00","0.000"):
+                continue
+            accepted.add(encoding.strip().lower())
+        return accepted
+
+    def CacheControl(self,full_path):
+        return IMMUTABLE if HASHED_ASSET.search(os.path.basename(full_path)) else REVALIDATE
+
+    def file_response(self,full_path,stat_result,scope,status_code=200):
+        full_path = os.fspath(full_path)
+        request_headers = Headers(scope=scope)
+        headers = {"Cache-Control":self.CacheControl(full_path)}
+        variants = self.Variants(full_path)
+
+        response = None
+        if variants:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = self.AcceptEncodings(request_headers.get("accept-encoding",""))
+            for encoding,_ in ENCODINGS:
+                if encoding in variants and encoding in accepted:
+                    path,variant_stat = variants[encoding]
+                    headers["Content-Encoding"] = encoding
+                    response = FileResponse(path,status_code=status_code,stat_result=variant_stat,headers=headers,
+                                            media_type=mimetypes.guess_type(full_path)[0] or "text/plain")
+                    break
+        if response is None:
+            response = FileResponse(full_path,status_code=status_code,stat_result=stat_result,headers=headers)
+
+        if self.is_not_modified(response.headers,request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
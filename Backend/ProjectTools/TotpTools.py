@@ -1,15 +1,29 @@
 import pyotp
-import qrcode
 import io
 import base64
+import asyncio
+import hmac
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from .CacheTools import TTLCache
 
 #取得Totp相關物件
+#QRcode 在有上限的執行緒池中產生，不會卡住事件迴圈；結果依 Uri 及格式快取
 class TotpTools:
+    def __init__(self,validWindow=1,qrWorkers=2,qrCacheSize=1000,qrCacheTTL=600):
+        self.validWindow = validWindow      #驗證時容許前後幾個時間區間(每區間 30 秒)
+        self.qrExecutor = ThreadPoolExecutor(max_workers=qrWorkers,thread_name_prefix="TotpTools")
+        self.qrCache = TTLCache(maxSize=qrCacheSize,ttl=qrCacheTTL)   #(uri, 格式) -> src
 
     #系統產生密鑰
+    #同一個 session 尚未完成註冊前沿用同一把密鑰，重複請求時 Uri 相同，可使用快取的 QRcode
     def GetSecret(self,request):
-        secret = pyotp.random_base32()
-        request.session["secret"] = secret
+        secret = request.session.get("secret")
+        if not secret:
+            secret = pyotp.random_base32()
+            request.session["secret"] = secret
         return secret
 
     #取得Totp物件
@@ -17,13 +31,32 @@ class TotpTools:
         totpobject = pyotp.TOTP(secret)
         return totpobject
 
+    #驗證碼檢查，容許前後 validWindow 個時間區間，避免剛好跨過 30 秒時驗證失敗
+    #成功時回傳驗證碼所屬的時間區間編號(用來防止重複使用)，失敗回傳 None
+    def Verify(self,totpobject,code):
+        code = str(code).strip()
+        timecode = int(time.time())//totpobject.interval
+        for offset in range(-self.validWindow,self.validWindow+1):
+            if hmac.compare_digest(totpobject.generate_otp(timecode+offset),code):
+                return timecode+offset
+        return None
+
+    #已使用的驗證碼需保留的秒數 : 驗證碼在容許範圍內的最長有效時間
+    def ReplayTTL(self,totpobject):
+        return totpobject.interval*(2*self.validWindow+2)
+
     #取得Uri
     def GetUri(self,totpobject,email):
         uri = totpobject.provisioning_uri(name=email, issuer_name="GJun訂票平台")
         return uri
 
     #取得Qrcode
-    def GetQRcodeSrc(self,uri):
+    #fmt : png(PIL 繪製) / svg(直接由 QRcode 矩陣組成路徑，不需 PIL，產生較快)
+    def GetQRcodeSrc(self,uri,fmt="png"):
+        if fmt == "svg":
+            svg = quote(self.GetQRcodeSvg(uri),safe=" /=.-:'")
+            return f"data:image/svg+xml,{svg}"
+        import qrcode       #qrcode 會載入 PIL，第一次產生時才匯入，加快啟動
         imgio = io.BytesIO()
         img = qrcode.make(uri)
         img.save(imgio, format='PNG')
@@ -31,3 +64,43 @@ class TotpTools:
         base64img = base64.b64encode(imgio.read()).decode('utf-8')
         qrcodesrc = f"data:image/png;base64,{base64img}"
         return qrcodesrc
+
+    #QRcode 的 SVG
+    #每排連續的黑色模組合併為一段水平線(線寬 1)，以相對座標串接成單一路徑
+    def GetQRcodeSvg(self,uri):
+        import qrcode
+        qr = qrcode.QRCode(border=4)
+        qr.add_data(uri)
+        qr.make(fit=True)
+        matrix = qr.get_matrix()
+        size = len(matrix)
+        path = []
+        px,py = 0,0
+        for y,row in enumerate(matrix):
+            x = 0
+            while x < size:
+                if not row[x]:
+                    x += 1
+                    continue
+                start = x
+                while x < size and row[x]:
+                    x += 1
+                path.append(f"m{start-px} {y-py}h{x-start}")
+                px,py = x,y
+        return (f"<svg xmlns='http://www.w3.org/2000/svg' viewBox='0 0 {size} {size}' shape-rendering='crispEdges'>"
+                f"<rect width='{size}' height='{size}' fill='white'/>"
+                f"<path stroke='black' d='M0 .5{''.join(path)}'/></svg>")
+
+    #非同步取得Qrcode
+    #相同的 Uri 及格式直接回傳快取，否則交給執行緒池產生
+    async def RenderQRcode(self,uri,fmt="png"):
+        key = (uri,fmt)
+        src = self.qrCache.Get(key)
+        if src is None:
+            src = await asyncio.get_running_loop().run_in_executor(self.qrExecutor,self.GetQRcodeSrc,uri,fmt)
+            self.qrCache.Set(key,src)
+        return src
+
+    #關閉執行緒池
+    def Close(self):
+        self.qrExecutor.shutdown(wait=False)
@@ -0,0 +1,121 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+#購票紀錄延後寫入(write-behind)
+#購票成功時紀錄已與座位狀態一起寫入 Redis 的待寫入佇列(見 RedisTools.TicketPurchase)
+#背景工作定期取出一批，以一道多筆 INSERT 寫入資料庫，減少每筆購票各自 commit 的成本
+#  每批最多 batchSize 筆；佇列不滿一批時最多等 interval 秒就寫入
+#  寫入失敗時整批留在此 writer 的處理中佇列，延遲後重試(最長 maxBackoff 秒)
+#  writer 停止後心跳過期，處理中的資料由其他 worker 收回重新寫入
+#  重新寫入時已寫入的座位由唯一鍵擋下並略過，不會重複
+#  座位已由其他使用者寫入資料庫時此筆購票失敗 : 取消該使用者的購票，紀錄保留 failedSeconds 秒，列在會員資料的 failedTicket
+class WriteBehindTools:
+    def __init__(self,redisT,sqlT,batchSize=500,interval=0.2,heartbeatSeconds=60,recentSeconds=120,maxBackoff=10,
+                 failedSeconds=86400,metricsT=None):
+        self.redisT = redisT
+        self.sqlT = sqlT
+        self.batchSize = batchSize
+        self.interval = interval
+        self.heartbeatSeconds = heartbeatSeconds
+        self.recentSeconds = recentSeconds      #已寫入的紀錄在 Redis 保留的秒數，需大於會員資料快取的秒數
+        self.maxBackoff = maxBackoff
+        self.failedSeconds = failedSeconds
+        self.metricsT = metricsT
+        self.writerID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.running = False
+        self.task = None
+        if metricsT is not None:
+            metricsT.Describe("ticket_flush_seconds","histogram","批次寫入購票紀錄的時間(秒)，依結果")
+            metricsT.Describe("ticket_flush_rows_total","counter","累計批次寫入的購票紀錄數")
+            metricsT.Describe("ticket_flush_duplicates_total","counter","批次寫入時因座位已存在而略過的紀錄數")
+            metricsT.Describe("ticket_flush_conflicts_total","counter","批次寫入時座位已由其他使用者購買而失敗的紀錄數")
+
+    #開始背景寫入
+    async def Start(self):
+        if self.task is None:
+            self.running = True
+            self.task = asyncio.create_task(self.Run())
+
+    #停止背景寫入，等目前的批次完成後再寫入最後一次
+    async def Stop(self):
+        if self.task is not None:
+            self.running = False
+            try:
+                await asyncio.wait_for(self.task,timeout=self.interval+self.maxBackoff+5)
+            except (asyncio.TimeoutError,asyncio.CancelledError):
+                pass
+            self.task = None
+
+    async def Run(self):
+        backoff = self.interval
+        lastRecover = None
+        while True:
+            try:
+                if lastRecover is None or time.monotonic()-lastRecover > self.heartbeatSeconds:
+                    Recover_result = await self.redisT.RecoverTicketBatches()
+                    if not Recover_result["status"]:
+                        raise RuntimeError(Recover_result["notify"])
+                    lastRecover = time.monotonic()
+                count = await self.Flush()
+                backoff = self.interval
+                if not self.running and count == 0:
+                    return
+                if count < self.batchSize:
+                    await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"WriteBehindTools_RunError ! message : [{type(e)} | {e}]")
+                if not self.running:
+                    return
+                await asyncio.sleep(backoff)
+                backoff = min(backoff*2,self.maxBackoff)
+
+    #寫入一批，回傳筆數
+    async def Flush(self):
+        TakeTicketBatch_result = await self.redisT.TakeTicketBatch(writerID=self.writerID,batchSize=self.batchSize,
+                                                                   heartbeatSeconds=self.heartbeatSeconds)
+        if not TakeTicketBatch_result["status"]:
+            raise RuntimeError(TakeTicketBatch_result["notify"])
+        records = TakeTicketBatch_result["records"]
+        if not records:
+            return 0
+
+        start = time.perf_counter()
+        rows = [(record["registerID"],record["event_id"],record["area"],record["row"],record["column"]) for record in records]
+        InsertTicketBatch_result = await self.sqlT.InsertTicketBatch(rows=rows)
+        if not InsertTicketBatch_result["status"]:
+            self.Observe(start,False,0,0,0)
+            raise RuntimeError(InsertTicketBatch_result["notify"])
+        duplicates = InsertTicketBatch_result["duplicates"]
+        conflicts = set(InsertTicketBatch_result["conflicts"])
+        self.Observe(start,True,InsertTicketBatch_result["count"],len(duplicates),len(conflicts))
+        if duplicates:
+            print(f"WriteBehindTools_FlushNotice ! 略過已存在的座位 : {duplicates}")
+        failed = [record for record,row in zip(records,rows) if row in conflicts]
+        if failed:
+            print(f"WriteBehindTools_FlushError ! 座位已由其他使用者購買，取消購票 : {failed}")
+
+        TicketBatchDone_result = await self.redisT.TicketBatchDone(writerID=self.writerID,
+                                                                   records=[record for record,row in zip(records,rows) if row not in conflicts],
+                                                                   recentSeconds=self.recentSeconds,
+                                                                   failed=failed,failedSeconds=self.failedSeconds)
+        if not TicketBatchDone_result["status"]:
+            raise RuntimeError(TicketBatchDone_result["notify"])
+        return len(records)
+
+    #使用者尚未寫入及近期寫入的購票紀錄
+    async def GetPendingTickets(self,registerID):
+        return await self.redisT.GetPendingTickets(registerID=registerID)
+
+    def Observe(self,start,status,count,duplicates,conflicts):
+        if self.metricsT is None:
+            return
+        self.metricsT.Observe("ticket_flush_seconds",time.perf_counter()-start,(("status","ok" if status else "error"),))
+        if status:
+            self.metricsT.Inc("ticket_flush_rows_total",value=count)
+            self.metricsT.Inc("ticket_flush_duplicates_total",value=duplicates)
+            self.metricsT.Inc("ticket_flush_conflicts_total",value=conflicts)
@@ -0,0 +1,102 @@
+#部署前整理前端打包檔(Backend/dist)
+#  1.從 index.html 開始，找出被引用的資源(含 js / css 中再引用的檔案)，刪除舊版本留下的其他檔案
+#  2.文字檔預先壓縮為 .gz(及 .br，需安裝 brotli)，由 PrecompressedStaticFiles 依 Accept-Encoding 回傳
+#可重複執行
+#
+#使用方式:
+#   python -m Backend.Scripts.BuildStatic [--dist Backend/dist] [--dry-run] [--keep]
+import argparse
+import gzip
+import os
+from urllib.parse import quote
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"dist")
+
+#需要壓縮的文字檔；圖片等已壓縮的格式不處理
+TEXT_TYPES = (".html",".js",".mjs",".css",".svg",".json",".txt",".map")
+#會再引用其他資源的檔案
+CODE_TYPES = (".js",".mjs",".css")
+VARIANT_TYPES = (".gz",".br")
+#壓縮後小於原檔 90% 才保留
+MIN_SAVING = 0.9
+
+def Read(path):
+    with open(path,encoding="utf-8",errors="ignore") as f:
+        return f.read()
+
+#從 index.html 找出所有被引用的資源
+def Referenced(dist):
+    assets = os.path.join(dist,"assets")
+    names = {name for name in os.listdir(assets) if not name.endswith(VARIANT_TYPES)}
+    found = set()
+    pending = [Read(os.path.join(dist,"index.html"))]
+    while pending:
+        text = pending.pop()
+        for name in names-found:
+            if name in text or quote(name) in text:
+                found.add(name)
+                if name.endswith(CODE_TYPES):
+                    pending.append(Read(os.path.join(assets,name)))
+    return names,found
+
+#刪除檔案及其壓縮版本
+def Remove(path,dryRun):
+    removed = 0
+    for target in [path]+[path+suffix for suffix in VARIANT_TYPES]:
+        if os.path.exists(target):
+            removed += os.path.getsize(target)
+            if not dryRun:
+                os.remove(target)
+    return removed
+
+#預先壓縮，壓縮效果不明顯時不保留壓縮檔
+def Compress(path,dryRun):
+    with open(path,"rb") as f:
+        data = f.read()
+    written = []
+    encoders = [(".gz",lambda data:gzip.compress(data,compresslevel=9,mtime=0))]
+    if brotli is not None:
+        encoders.append((".br",lambda data:brotli.compress(data,quality=11)))
+    for suffix,encode in encoders:
+        compressed = encode(data)
+        target = path+suffix
+        if len(compressed) >= len(data)*MIN_SAVING:
+            if os.path.exists(target) and not dryRun:
+                os.remove(target)
+            continue
+        written.append((suffix,len(compressed)))
+        if not dryRun:
+            with open(target,"wb") as f:
+                f.write(compressed)
+    return len(data),written
+
+def Main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dist",default=DIST)
+    parser.add_argument("--dry-run",action="store_true",help="只列出結果，不修改檔案")
+    parser.add_argument("--keep",action="store_true",help="不刪除未被引用的資源")
+    args = parser.parse_args()
+
+    assets = os.path.join(args.dist,"assets")
+    names,found = Referenced(args.dist)
+    if not args.keep:
+        removed = sum(Remove(os.path.join(assets,name),args.dry_run) for name in sorted(names-found))
+        print(f"刪除未引用的資源 {len(names-found)} 個，共 {removed/1024:.1f} KB")
+
+    targets = [os.path.join(args.dist,"index.html")]+[os.path.join(assets,name) for name in sorted(found if not args.keep else names)]
+    for path in targets:
+        if not path.endswith(TEXT_TYPES):
+            continue
+        size,written = Compress(path,args.dry_run)
+        variants = "、".join(f"{suffix} {compressed/1024:.1f} KB" for suffix,compressed in written) or "不壓縮"
+        print(f"{os.path.relpath(path,args.dist)} : {size/1024:.1f} KB -> {variants}")
+    if brotli is None:
+        print("未安裝 brotli，只產生 .gz")
+
+if __name__ == "__main__":
+    Main()
@@ -0,0 +1,27 @@
+#一次性轉移:購票者序列 -> 購票者集合
+#舊版以 event_id 為鍵，用 list 記錄購票者；新版改為 <eventPurchaser>:[event_id] 集合
+#可重複執行，已轉移的活動不會再處理
+#
+#使用方式:
+#   python -m Backend.Scripts.MigratePurchaserSet
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+from ..ProjectTools.RedisTools import RedisTools
+
+async def Main():
+    load_dotenv()
+    redisT = RedisTools(os.getenv("REDISPUBLICURL"))
+    result = await redisT.MigratePurchaserList()
+    await redisT.Close()
+    if not result["status"]:
+        print(result["notify"])
+        return
+    for event_id,count in result["migrated"].items():
+        print(f"event_id : {event_id} 轉移 {count} 位購票者")
+    print(f"共轉移 {len(result['migrated'])} 個活動 !")
+
+if __name__ == "__main__":
+    asyncio.run(Main())
@@ -0,0 +1,24 @@
+-- 活動座位配置
+-- 每個區域一列，position 為區域順序；座位序號(Redis 點陣圖的位元位置)依此順序編號
+-- blocked 為不開放的座位，JSON 陣列 [[排,位],...]，沒有時為 NULL
+-- 沒有設定的活動使用 SeatTools.DEFAULT_LAYOUT
+-- 應用程式啟動時載入，修改後需重新啟動；已開賣的活動修改區域會改變座位序號，需先清除該活動的 <seat*> 鍵
+CREATE TABLE IF NOT EXISTS seat_layout(
+    event_id INT NOT NULL,
+    position INT NOT NULL,
+    area VARCHAR(50) NOT NULL,
+    `rows` INT NOT NULL,
+    `cols` INT NOT NULL,
+    blocked TEXT NULL,
+    PRIMARY KEY(event_id,position)
+);
+
+-- 範例 : 活動 1 使用與預設相同的配置，A區第 1 排第 1、2 位不開放
+-- INSERT INTO seat_layout(event_id,position,area,`rows`,`cols`,blocked) VALUES
+--     (1,1,'搖滾區左',5,10,NULL),
+--     (1,2,'搖滾區中',5,20,NULL),
+--     (1,3,'搖滾區右',5,10,NULL),
+--     (1,4,'A區',20,10,'[[1,1],[1,2]]'),
+--     (1,5,'B區',20,20,NULL),
+--     (1,6,'C區',20,10,NULL),
+--     (1,7,'D區',10,20,NULL);
@@ -0,0 +1,30 @@
+#設定活動同時購票的人數上限(等候室)
+#上限 0 表示不排隊；不指定上限則改回預設值(環境變數 QUEUECAP)
+#
+#使用方式:
+#   python -m Backend.Scripts.SetQueueCap <event_id> [上限]
+import asyncio
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from ..ProjectTools.RedisTools import RedisTools
+
+async def Main():
+    load_dotenv()
+    if len(sys.argv) < 2:
+        print("使用方式 : python -m Backend.Scripts.SetQueueCap <event_id> [上限]")
+        return
+    event_id = sys.argv[1]
+    cap = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    redisT = RedisTools(os.getenv("REDISPUBLICURL"))
+    result = await redisT.SetQueueCap(event_id=event_id,cap=cap)
+    await redisT.Close()
+    if not result["status"]:
+        print(result["notify"])
+        return
+    print(f"event_id : {event_id} 上限設為 {'預設值' if cap is None else cap} !")
+
+if __name__ == "__main__":
+    asyncio.run(Main())
@@ -0,0 +1,13 @@
+-- 購票紀錄的座位唯一鍵
+-- 同一活動的同一座位只能有一筆購票紀錄，資料庫層防止超賣
+-- write-behind 重新寫入已寫入的批次時，重複的座位由唯一鍵擋下並略過
+-- 加入前先確認沒有重複的紀錄，有的話需先人工處理(保留最早的一筆)
+
+-- 1.檢查重複的座位
+SELECT event_id,area,`row`,`column`,COUNT(*) AS count,GROUP_CONCAT(id ORDER BY id) AS ids
+FROM ticket
+GROUP BY event_id,area,`row`,`column`
+HAVING COUNT(*) > 1;
+
+-- 2.加入唯一鍵
+ALTER TABLE ticket ADD UNIQUE KEY uniq_ticket_seat(event_id,area,`row`,`column`);
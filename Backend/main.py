@@ -1,48 +1,179 @@
-from fastapi import FastAPI,Request
+from fastapi import APIRouter,FastAPI,Request
 from starlette.middleware.sessions import SessionMiddleware
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse,Response,StreamingResponse
 
-from .ProjectTools.SqlTools import SqlTools
+from .ProjectTools.SqlTools import AsyncSqlTools
 from .ProjectTools.RequestTools import RequestTools
 from .ProjectTools.TotpTools import TotpTools
 from .ProjectTools.RedisTools import RedisTools
+from .ProjectTools.SeatTools import SeatTools
+from .ProjectTools.PushTools import PushTools
+from .ProjectTools.HoldTools import HoldTools
+from .ProjectTools.WriteBehindTools import WriteBehindTools
+from .ProjectTools.MetricsTools import MetricsTools,MetricsMiddleware
+from .ProjectTools.BreakerTools import CircuitBreaker,BreakerMiddleware
+from .ProjectTools.StaticTools import PrecompressedStaticFiles
+from .ProjectTools.ResponseTools import FastJSONResponse
 
-from .Modules import RegisterModule,LoginModule,IndexModule,LogoutModule,ProfileModule,TicketModule
+from .Modules import RegisterModule,LoginModule,IndexModule,LogoutModule,ProfileModule,TicketModule,QueueModule
 
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-load_dotenv()
 
-app = FastAPI()
-url = {"mysql":os.getenv("MYSQLPUBLICURL"),
-       "redis":os.getenv("REDISPUBLICURL")}
-reqT = RequestTools()
-totpT = TotpTools()
-sqlT = SqlTools(URL=url["mysql"])
-redisT = RedisTools(URL=url["redis"])
-
-KEY = "ticket_key"
-app.add_middleware(SessionMiddleware,secret_key=KEY)
-
-#@app.post("/auth/verify/init")
+BASE = os.path.dirname(os.path.abspath(__file__))
+router = APIRouter()
+
+#由環境變數建立各工具物件
+#在 lifespan 中呼叫，每個 worker 各自建立連線池，不會在 fork 前建立連線
+def CreateTools(metricsT):
+    url = {"mysql":os.getenv("MYSQLPUBLICURL"),
+           "redis":os.getenv("REDISPUBLICURL")}
+    #斷路器 : 最近 BREAKERWINDOW 秒內呼叫數達 BREAKERMINCALLS，且失敗比例或過慢比例超過門檻時開啟 BREAKEROPENSECONDS 秒
+    breakerOptions = {"window":int(os.getenv("BREAKERWINDOW","10")),
+                      "minCalls":int(os.getenv("BREAKERMINCALLS","20")),
+                      "errorRate":float(os.getenv("BREAKERERRORRATE","0.5")),
+                      "slowRate":float(os.getenv("BREAKERSLOWRATE","0.5")),
+                      "openSeconds":float(os.getenv("BREAKEROPENSECONDS","5")),
+                      "metricsT":metricsT}
+    sqlBreaker = CircuitBreaker(name="mysql",slowSeconds=float(os.getenv("MYSQLSLOWSECONDS","1")),**breakerOptions)
+    redisBreaker = CircuitBreaker(name="redis",slowSeconds=float(os.getenv("REDISSLOWSECONDS","0.25")),**breakerOptions)
+    reqT = RequestTools()
+    totpT = TotpTools(validWindow=int(os.getenv("TOTPVALIDWINDOW","1")),
+                      qrWorkers=int(os.getenv("QRWORKERS","2")),
+                      qrCacheSize=int(os.getenv("QRCACHESIZE","1000")),
+                      qrCacheTTL=float(os.getenv("QRCACHETTL","600")))
+    sqlT = AsyncSqlTools(URL=url["mysql"],
+                        minSize=int(os.getenv("MYSQLPOOLMIN","1")),
+                        maxSize=int(os.getenv("MYSQLPOOLMAX","10")),
+                        recycle=int(os.getenv("MYSQLPOOLRECYCLE","300")),
+                        timeout=float(os.getenv("MYSQLPOOLTIMEOUT","10")),
+                        userCacheSize=int(os.getenv("USERCACHESIZE","10000")),
+                        userCacheTTL=float(os.getenv("USERCACHETTL","300")),
+                        eventCacheSize=int(os.getenv("EVENTCACHESIZE","1000")),
+                        eventCacheTTL=float(os.getenv("EVENTCACHETTL","600")),
+                        profileCacheSize=int(os.getenv("PROFILECACHESIZE","10000")),
+                        profileCacheTTL=float(os.getenv("PROFILECACHETTL","60")),
+                        replicaURLs=[_.strip() for _ in os.getenv("MYSQLREPLICAURLS","").split(",") if _.strip()],
+                        stickySeconds=float(os.getenv("MYSQLSTICKYSECONDS","5")),
+                        replicaRetry=float(os.getenv("MYSQLREPLICARETRY","5")),
+                        connectTimeout=float(os.getenv("MYSQLCONNECTTIMEOUT","5")),
+                        readTimeout=float(os.getenv("MYSQLREADTIMEOUT","10")),
+                        writeTimeout=float(os.getenv("MYSQLWRITETIMEOUT","10")),
+                        breaker=sqlBreaker,
+                        metricsT=metricsT)
+    redisT = RedisTools(URL=url["redis"],
+                        maxConnections=int(os.getenv("REDISPOOLMAX","50")),
+                        socketTimeout=float(os.getenv("REDISSOCKETTIMEOUT","5")),
+                        connectTimeout=float(os.getenv("REDISCONNECTTIMEOUT","5")),
+                        poolTimeout=float(os.getenv("REDISPOOLTIMEOUT","5")),
+                        queueCap=int(os.getenv("QUEUECAP","0")),
+                        queueActiveSeconds=float(os.getenv("QUEUEACTIVESECONDS","300")),
+                        queueStaleSeconds=float(os.getenv("QUEUESTALESECONDS","30")),
+                        queueConfigTTL=float(os.getenv("QUEUECONFIGTTL","5")),
+                        breaker=redisBreaker,
+                        metricsT=metricsT)
+    seatT = SeatTools()
+    pushT = PushTools(redisT=redisT,seatT=seatT)
+    #定期清除到期的鎖定座位
+    holdT = HoldTools(redisT=redisT,interval=float(os.getenv("HOLDSWEEPINTERVAL","1")))
+    #購票紀錄延後批次寫入資料庫(TICKETWRITEBEHIND=1 時啟用)
+    writeT = WriteBehindTools(redisT=redisT,sqlT=sqlT,
+                              batchSize=int(os.getenv("TICKETBATCHSIZE","500")),
+                              interval=float(os.getenv("TICKETFLUSHINTERVAL","0.2")),
+                              recentSeconds=float(os.getenv("TICKETRECENTSECONDS","120")),
+                              metricsT=metricsT) if os.getenv("TICKETWRITEBEHIND","0") == "1" else None
+    return {"reqT":reqT,"totpT":totpT,"sqlT":sqlT,"redisT":redisT,"seatT":seatT,"pushT":pushT,"holdT":holdT,"writeT":writeT,
+            "breakers":[sqlBreaker,redisBreaker]}
+
+#啟動時預先建立資料庫連線，並載入活動快取及座位配置
+async def Startup(state):
+    try:
+        await state.sqlT.Warm()
+    except Exception as e:
+        print(f"WarmPoolError ! message : [{type(e)} | {e}]")
+    LoadEvents_result = await state.sqlT.LoadEvents()
+    if not LoadEvents_result["status"]:
+        print(LoadEvents_result["notify"])
+    #座位配置載入失敗時，所有活動使用預設配置
+    GetSeatLayouts_result = await state.sqlT.GetSeatLayouts()
+    if GetSeatLayouts_result["status"]:
+        state.seatT.LoadLayouts(GetSeatLayouts_result["layouts"])
+    else:
+        print(GetSeatLayouts_result["notify"])
+    await state.pushT.Start()
+    await state.holdT.Start()
+    if state.writeT is not None:
+        await state.writeT.Start()
+
+#關閉時釋放執行緒池及連線池
+async def Shutdown(state):
+    await state.pushT.Stop()
+    await state.holdT.Stop()
+    if state.writeT is not None:
+        await state.writeT.Stop()
+    state.sqlT.Close()
+    state.totpT.Close()
+    await state.redisT.Close()
+
+#建立應用程式
+#  uvicorn Backend.main:create_app --factory --workers N
+#工具物件在 lifespan 中建立並放在 app.state，關閉時釋放
+#createTools : 回傳工具物件 dict 的函式，預設由環境變數建立(壓力測試可換成本機替身)
+def create_app(createTools=CreateTools):
+    load_dotenv()
+    metricsT = MetricsTools()
+
+    @asynccontextmanager
+    async def Lifespan(app):
+        for name,tool in createTools(metricsT).items():
+            setattr(app.state,name,tool)
+        await Startup(app.state)
+        try:
+            yield
+        finally:
+            await Shutdown(app.state)
+
+    app = FastAPI(default_response_class=FastJSONResponse,lifespan=Lifespan)
+    app.state.metricsT = metricsT
+    app.state.qrFormat = os.getenv("QRFORMAT","png")
+
+    #所有 worker 須使用相同的 SESSIONKEY，否則 session 無法互通
+    key = os.getenv("SESSIONKEY")
+    if not key:
+        print("SESSIONKEY 未設定，使用預設值，正式環境請務必設定 !")
+        key = "ticket_key"
+    app.add_middleware(SessionMiddleware,secret_key=key)
+    #斷路器開啟時，購票相關路由(/ticket)直接回傳 503
+    app.add_middleware(BreakerMiddleware,metricsT=metricsT,prefix="/ticket")
+    app.add_middleware(MetricsMiddleware,metricsT=metricsT)
+
+    app.include_router(router)
+    #前端打包檔，部署前先執行 python -m Backend.Scripts.BuildStatic 清除舊檔並預先壓縮
+    app.mount("/", PrecompressedStaticFiles(directory=os.path.join(BASE,"dist"), html=True))
+    return app
+
+#@router.post("/auth/verify/init")
 '''
 1.使用時機:註冊資料填寫完畢並按下確認後
 
 2.功能:回傳Totp的QRcode資料
 
-3.說明:若成功
+3.說明:QRcode 在執行緒池中產生，相同 session 重複請求時使用快取
+      format 可指定 png(預設，可由 QRFORMAT 修改) 或 svg(不需 PIL，產生較快)
+      若成功
          則回傳src -> return {"status":True,"totpsrc":src}
          
        例外處理
          回傳錯誤訊息->return {"status":False,
                               "notify":f"ShowQRcodeError !"}'''
-@app.post("/auth/verify/init")
+@router.post("/auth/verify/init")
 async def ShowQRcode(request: Request):
-    response = await RegisterModule.ShowQRcode(request=request,reqT=reqT,totpT=totpT)
-    return JSONResponse(response)
+    state = request.app.state
+    response = await RegisterModule.ShowQRcode(request=request,reqT=state.reqT,totpT=state.totpT,fmt=state.qrFormat)
+    return FastJSONResponse(response)
        
-#@app.post("/auth/verify/confirm")
+#@router.post("/auth/verify/confirm")
 '''
 1.使用時機:輸入totp驗證碼後
 
@@ -62,10 +193,11 @@ async def ShowQRcode(request: Request):
        例外處理
          回傳錯誤訊息->return {"status":False,
                               "notify":f"CheckANDRegisterError !"}'''
-@app.post("/auth/verify/confirm")
+@router.post("/auth/verify/confirm")
 async def Register(request: Request):
-    response = await RegisterModule.CheckANDRegister(request=request,reqT=reqT,sqlT=sqlT,totpT=totpT)
-    return JSONResponse(response)
+    state = request.app.state
+    response = await RegisterModule.CheckANDRegister(request=request,reqT=state.reqT,sqlT=state.sqlT,totpT=state.totpT)
+    return FastJSONResponse(response)
 
 '''
 1.使用時機:輸入totp驗證碼時
@@ -86,25 +218,26 @@ async def Register(request: Request):
        例外處理
          回傳錯誤訊息->return {"status":False,
                               "notify":f"CheckANDRegisterError !"}'''
-@app.post("/auth/login")
+@router.post("/auth/login")
 async def Login(request:Request):
-    response = await LoginModule.Check(request=request,reqT=reqT,sqlT=sqlT)
-    return JSONResponse(response)
+    state = request.app.state
+    response = await LoginModule.Check(request=request,reqT=state.reqT,sqlT=state.sqlT)
+    return FastJSONResponse(response)
 
 '''
 '''
-@app.get("/check_login")
-#@app.get("/auth/login/check")
+@router.get("/check_login")
+#@router.get("/auth/login/check")
 async def check_login(request: Request):
     if "UserID" in request.session:
-        return JSONResponse({
+        return FastJSONResponse({
             "logged_in": True,
             "UserID": request.session["UserID"],
             "UserName": request.session["UserName"],
             "RegisterID": request.session["RegisterID"]
         })
     else:
-        return JSONResponse({
+        return FastJSONResponse({
             "logged_in": False
         })
 
@@ -127,24 +260,28 @@ async def check_login(request: Request):
        例外處理
          回傳錯誤訊息->return {"status":False,
                               "notify":f"CheckANDRegisterError !"}'''
-@app.get("/auth/logout")
+@router.get("/auth/logout")
 async def Logout(request:Request):
     response = await LogoutModule.Logout(request=request)
-    return JSONResponse(response)
+    return FastJSONResponse(response)
 
-@app.get("/profile")
+@router.get("/profile")
 async def get_user_profile(request: Request):
+    state = request.app.state
     # 沒有登入 → 回 401
     if "UserID" not in request.session:
-        return JSONResponse(
+        return FastJSONResponse(
             {"status": False, "notify": "未登入"},
             status_code=401
         )
-    response = ProfileModule.GetProfileData(request=request,sqlT=sqlT)
+    response = await ProfileModule.GetProfileData(request=request,sqlT=state.sqlT,writeT=state.writeT)
+    if not response["status"]:
+        return FastJSONResponse(response)
 
-    return JSONResponse({"status":True,
+    return FastJSONResponse({"status":True,
                         "user":response["profileData"],
-                        "ticket":response["profileData"]["ticket"]})
+                        "ticket":response["profileData"]["ticket"],
+                        "failedTicket":response["profileData"].get("failedTicket",[])})
 
            # "status": True,
            # "user": {"login_id": request.session["UserID"],"name": request.session["UserName"],response = ProfileModule.GetProfileData(request=request,sqlT=sqlT)},
@@ -154,16 +291,66 @@ async def get_user_profile(request: Request):
 @app.post("/profile")
 async def Profile(request:Request):
     response = ProfileModule.GetProfileData(request=request,sqlT=sqlT)
-    return JSONResponse(response)
+    return FastJSONResponse(response)
  #   response = ProfileModule.GetProfileData(request=request,sqlT=sqlT)
-  #  return JSONResponse(response)
+  #  return FastJSONResponse(response)
        '''
-@app.get("/auth/user")
+@router.get("/auth/user")
 async def User(request : Request):
     response = IndexModule.CheckUserLogin(request=request)
-    return JSONResponse(response)
+    return FastJSONResponse(response)
+
+#@router.post("/queue/join")
+'''
+1.使用時機:進入選位畫面時，之後每隔數秒輪詢一次，直到入場
+
+2.功能:熱門活動開賣時限制同時購票的人數，其餘使用者依先後順序排隊
+
+3.說明:若活動沒有設定上限(QUEUECAP 或 <queueConfig> 中的設定為 0)
+          則直接入場 -> return {"status":True,
+                               "admitted":True,
+                               "expiresAt":0}
+
+      若已輪到使用者
+          則入場，資格寫入 session -> return {"status":True,
+                                            "admitted":True,
+                                            "expiresAt":"資格到期時間(毫秒)"}
+
+      若仍在排隊
+          則回傳順位 -> return {"status":True,
+                               "admitted":False,
+                               "position":"排隊順位(從 1 開始)",
+                               "eta":"預估最長等候秒數"}
 
-#@app.post("/ticket/lock")
+4.參數傳遞:event_id
+
+5.補充說明:*超過 QUEUESTALESECONDS 秒未輪詢，視為離開排隊
+          *入場後 QUEUEACTIVESECONDS 秒內未完成購票，名額讓給下一位
+          *購票成功後自動讓出名額
+'''
+@router.post("/queue/join")
+async def JoinQueue(request : Request):
+    state = request.app.state
+    response = await QueueModule.Join(request=request,reqT=state.reqT,redisT=state.redisT)
+    return FastJSONResponse(response)
+
+#@router.post("/queue/leave")
+'''
+1.使用時機:離開選位畫面時
+
+2.功能:離開排隊，或讓出購票名額給下一位
+
+3.說明:return {"status":True}
+
+4.參數傳遞:event_id
+'''
+@router.post("/queue/leave")
+async def LeaveQueue(request : Request):
+    state = request.app.state
+    response = await QueueModule.Leave(request=request,reqT=state.reqT,redisT=state.redisT)
+    return FastJSONResponse(response)
+
+#@router.post("/ticket/lock")
 '''
 1.使用時機:進行購票時，進行鎖票
 
@@ -184,25 +371,49 @@ async def User(request : Request):
       若使用者，選擇沒有被人選到的位置時
           則開啟購票視窗 -> return {"status":True,
                                    "time":"購票程序有效的剩餘時間(秒)"}
+          
+      若活動需要排隊，且使用者尚未入場(或資格已過期)時
+          則阻止使用者 "選取" -> return {"status":False,
+                                        "queue":True,
+                                        "notify":"目前購票人數眾多，請先排隊，輪到您後才可選位 !"}
 
 4.參數傳遞:event_id, area, row, column
 
 5.補充說明:*前端接收到回傳的剩餘時間後，要進行倒數的功能
 '''
-@app.post("/ticket/lock")
+@router.post("/ticket/lock")
 async def LockTicket(request:Request):
-    response = await TicketModule.Lock(request=request,reqT=reqT,redisT=redisT)
-    return JSONResponse(response)
+    state = request.app.state
+    response = await TicketModule.Lock(request=request,reqT=state.reqT,sqlT=state.sqlT,redisT=state.redisT,seatT=state.seatT)
+    return FastJSONResponse(response)
 '''
 1.使用時機:購票時
 2.功能:將票券資料寫入資料庫
+3.說明:TICKETWRITEBEHIND=1 時，購票紀錄先與座位狀態一起寫入 Redis，再由背景工作批次寫入資料庫
+      (每批最多 TICKETBATCHSIZE 筆，最多延遲 TICKETFLUSHINTERVAL 秒)，/profile 會合併尚未寫入的紀錄
+      寫入時座位已由其他使用者購買則此筆購票取消，列在 /profile 的 failedTicket
+      驗證碼容許前後 TOTPVALIDWINDOW 個時間區間(每區間 30 秒)；同一組驗證碼不可重複使用
+          -> return {"status":False,
+                     "notify":"此驗證碼已使用過，請等待下一組驗證碼 !"}
+      Redis 購票腳本一次完成確認鎖定、標記售出及加入購票者集合，失敗時驗證碼可再使用
+      若鎖定已過期或不是本人選取的位置
+          -> return {"status":False,
+                     "notify":"選位已逾時或不是您選取的位置，請重新選位 !"}
+      若座位已售出(Redis 或資料庫唯一鍵)
+          -> return {"status":False,
+                     "notify":"此位置已售出 !"}
+      若此活動已購票
+          -> return {"status":False,
+                     "notify":"每人限購一張，不可重複購票 !"}
+      資料庫寫入失敗時還原座位狀態，鎖定尚未到期則保留給使用者
 '''
-@app.post("/ticket")
+@router.post("/ticket")
 async def GetTicket(request : Request):
-    response = await TicketModule.GetTicketData(request=request,reqT=reqT,sqlT=sqlT,totpT=totpT,redisT=redisT)
-    return JSONResponse(response)
+    state = request.app.state
+    response = await TicketModule.GetTicketData(request=request,reqT=state.reqT,sqlT=state.sqlT,totpT=state.totpT,redisT=state.redisT,seatT=state.seatT,writeT=state.writeT)
+    return FastJSONResponse(response)
 
-#@app.post("/ticket/check")
+#@router.post("/ticket/check")
 '''
 1.使用時機:使用者點選位置按鈕時(目前本機的作法)
     
@@ -218,12 +429,13 @@ async def GetTicket(request : Request):
     
 5.補充說明:
 '''
-@app.post("/ticket/check")
+@router.post("/ticket/check")
 async def CheckTicket(request : Request):
-    response = await TicketModule.CheckTicket(request=request,reqT=reqT,redisT=redisT)
-    return JSONResponse(response)
+    state = request.app.state
+    response = await TicketModule.CheckTicket(request=request,reqT=state.reqT,redisT=state.redisT)
+    return FastJSONResponse(response)
 
-#@app.post("/ticket/cancel")
+#@router.post("/ticket/cancel")
 '''
 1.使用時機:放棄選擇的位置時
 
@@ -233,18 +445,25 @@ async def CheckTicket(request : Request):
           則關閉購票程序 -> return {"status":True,
                                    "notify":f"鎖票的鍵 & 反查詢的鍵 已從 Redis 中刪除 !"}
           
-      另外情況是防呆功能，只會牽扯後端操作，在此就不另外說明
+      若位置由其他使用者持有
+          則不釋放 -> return {"status":False,
+                             "notify":"不同的使用者 !"}
+      若鎖定已過期(已由背景工作清除)
+          則回傳 -> return {"status":False,
+                           "notify":"沒有選位資料 !"}
+      鎖定到期後，背景工作(每 HOLDSWEEPINTERVAL 秒)釋放座位並發布 expire 事件
       
 4.參數傳遞:event_id, area, row, column
 
 5.補充說明:*本機端的做法是 設置右上角的 "x" 按鈕，以及設立 "購買" "放棄" 按鈕，只有點選 "x" "放棄" 時，才會釋放
 '''
-@app.post("/ticket/cancel")
+@router.post("/ticket/cancel")
 async def CancelTicket(request : Request):
-    response = await TicketModule.CancelTicket(request=request,reqT=reqT,redisT=redisT)
+    state = request.app.state
+    response = await TicketModule.CancelTicket(request=request,reqT=state.reqT,redisT=state.redisT,seatT=state.seatT)
     return response
 
-#@app.post("/ticket/restore"):
+#@router.post("/ticket/restore"):
 '''
 1.使用時機:進入選位畫面時
 
@@ -270,21 +489,94 @@ async def CancelTicket(request : Request):
 5.補充說明:*前端接收到回傳的剩餘時間後，要進行倒數的功能
           *前端接收到回傳的座位資料後，要進行自動點選的功能
 '''
-@app.post("/ticket/restore")
+@router.post("/ticket/restore")
 async def RestoreTicket(request : Request):
-    response = await TicketModule.RestoreTicket(request=request,redisT=redisT)
+    state = request.app.state
+    response = await TicketModule.RestoreTicket(request=request,redisT=state.redisT)
     return response
 
-@app.post("/ticket/availability")
+@router.post("/ticket/availability")
 async def GetTicketAvailability(request : Request):
-    response = await TicketModule.CheckTicketPurchased(request=request,reqT=reqT,sqlT=sqlT)
-    return JSONResponse(response)
+    state = request.app.state
+    response = await TicketModule.CheckTicketPurchased(request=request,reqT=state.reqT,sqlT=state.sqlT,redisT=state.redisT,seatT=state.seatT)
+    headers = {"ETag":response["etag"]} if "etag" in response else None
+    if response.get("notModified"):
+        return Response(status_code=304,headers=headers)
+    return FastJSONResponse(response,headers=headers)
+
+#@router.get("/ticket/stream")
+'''
+1.使用時機:進入選位畫面時
+
+2.功能:以 Server-Sent Events 推送座位的鎖定、釋放、逾時及售出，取代輪詢 /ticket/availability
+
+3.說明:event: lock / release / expire / sold
+         data: {"type":..., "version":..., "seats":[[area,row,column],...]}
+      event: resync
+         推送中斷或前端跟不上時送出，前端應以 since_version 重新取得座位狀態
+
+4.參數傳遞:event_id(query string)
+'''
+@router.get("/ticket/stream")
+async def StreamTicket(request : Request, event_id : str):
+    state = request.app.state
+    return StreamingResponse(TicketModule.SeatStream(request=request,event_id=event_id,pushT=state.pushT),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control":"no-cache","X-Accel-Buffering":"no"})
+
+#@router.get("/metrics")
+'''
+1.使用時機:監控系統(Prometheus)定期抓取
+
+2.功能:回傳各路由延遲、資料庫查詢延遲及連線池狀態、Redis 指令延遲及連線數、鎖票結果次數
+
+3.說明:http_request_seconds         路由延遲，依 route / method / status
+      sql_query_seconds            查詢延遲，依呼叫的方法(query)
+      sql_pool_acquire_seconds     借出連線的等待時間
+      sql_pool_*                   連線池狀態
+      redis_command_seconds        指令延遲，腳本以 EVALSHA:名稱 表示
+      redis_connections_opened_total
+      ticket_lock_total            鎖票結果 acquired / already_held / conflict / multi / error
+      queue_join_total             排隊輪詢結果 admitted / waiting
+      circuit_breaker_state        斷路器狀態(0 關閉 / 1 半開 / 2 開啟)，依 breaker(mysql / redis)
+      http_shed_total              斷路器開啟時直接回傳 503 的請求數
+
+4.參數傳遞:無
+'''
+@router.get("/metrics")
+async def Metrics(request : Request):
+    state = request.app.state
+    return PlainTextResponse(state.metricsT.Render(),media_type="text/plain; version=0.0.4")
+
+#@router.get("/health/breakers")
+'''
+1.使用時機:監控或負載平衡器檢查後端狀態時
 
-app.mount("/", StaticFiles(directory="Backend/dist", html=True))
+2.功能:回傳 MySQL 及 Redis 斷路器的狀態
+
+3.說明:所有斷路器都沒有開啟時 -> return {"status":True,
+                                       "breakers":[{"name":"mysql",
+                                                    "state":"closed / half_open / open",
+                                                    "calls":"最近 BREAKERWINDOW 秒的呼叫數",
+                                                    "errorRate":"失敗比例",
+                                                    "slowRate":"過慢比例",
+                                                    "retryAfter":"距離半開的秒數"},...]}
+      任一斷路器開啟時 status 為 False，並回傳 503
+
+4.參數傳遞:無
+
+5.補充說明:*斷路器開啟時 /ticket 下的路由直接回傳 503 及 Retry-After，不進入處理程序
+          *MySQL 逾時由 MYSQLCONNECTTIMEOUT / MYSQLREADTIMEOUT / MYSQLWRITETIMEOUT 設定
+          *Redis 逾時由 REDISCONNECTTIMEOUT / REDISSOCKETTIMEOUT / REDISPOOLTIMEOUT 設定
+'''
+@router.get("/health/breakers")
+async def Breakers(request : Request):
+    breakers = [breaker.State() for breaker in getattr(request.app.state,"breakers",())]
+    status = all(breaker["state"] != "open" for breaker in breakers)
+    return FastJSONResponse({"status":status,"breakers":breakers},status_code=200 if status else 503)
 
 '''
 改善建議:
     1.進入選位畫面後，等待資料回傳成功，才可進行選擇位置的動作(目前是反白)，也包括自動顯示購票視窗
     2.不論使用者有沒有購票程序進行中，希望是可以點選按鈕也可按下確定，但是不可以選擇購買
-    3.購買完成後，驗證碼可以一直送，那就會一直重複購買，這部分會有超賣問題，個人想法是 點選後 -> 關掉點選功能 或 alert
 '''
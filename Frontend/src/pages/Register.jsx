@@ -51,7 +51,7 @@ export default function Register() {
       const res = await fetch('https://reactticketsystem-production.up.railway.app/auth/verify/init', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ email: normalizeEmail(email) }),
+        body: JSON.stringify({ email: normalizeEmail(email), format: 'svg' }),
         credentials: 'include'
       })
 
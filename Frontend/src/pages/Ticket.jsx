@@ -23,6 +23,41 @@ const seatConfig = [
   { id: 'D區', rows: 10, cols: 20, className: 'bg-purple-300' }
 ];
 
+const API_BASE = 'https://reactticketsystem-production.up.railway.app';
+
+// 座位點陣圖（base64）→ [[區域, 排, 位], ...]
+// 序號規則與後端 SeatLayout 相同：區域依序排列，區域內由第 1 排第 1 位往後編號
+// layout 為 /ticket/availability 回傳的區域配置，沒有時使用 seatConfig
+function decodeSeatBitmap(b64, layout) {
+  if (!b64) return [];
+  const bytes = atob(b64);
+  let offset = 0;
+  const sections = layout
+    ? layout.map(s => ({ id: s.area, rows: s.rows, cols: s.cols, start: s.start }))
+    : seatConfig.map(s => ({ ...s, start: 0 }));
+  sections.forEach(s => {
+    if (!layout) s.start = offset;
+    offset = s.start + s.rows * s.cols;
+  });
+  const seats = [];
+  for (let i = 0; i < bytes.length; i++) {
+    const byte = bytes.charCodeAt(i);
+    if (!byte) continue;
+    for (let bit = 0; bit < 8; bit++) {
+      if (!(byte & (0x80 >> bit))) continue;
+      const ordinal = i * 8 + bit;
+      if (ordinal >= offset) continue;
+      const s = sections.findLast(x => x.start <= ordinal);
+      const k = ordinal - s.start;
+      seats.push([s.id, Math.floor(k / s.cols) + 1, (k % s.cols) + 1]);
+    }
+  }
+  return seats;
+}
+
+const sameSeat = (a, b) =>
+  a[0] === b[0] && Number(a[1]) === Number(b[1]) && Number(a[2]) === Number(b[2]);
+
 // 小工具：把 fetch 的請求與回應完整印出
 async function logFetch(url, options) {
   console.groupCollapsed(`[fetch] ${options?.method || 'GET'} ${url}`);
@@ -61,6 +96,9 @@ export default function Ticket() {
   const [eventLocation, setEventLocation] = useState('');
   const [eventID, setEventID] = useState(null);
   const [purchased, setPurchased] = useState([]);
+  const [held, setHeld] = useState([]); // 其他人鎖定中的座位（由 /ticket/stream 即時更新）
+  const [resyncKey, setResyncKey] = useState(0);
+  const [queue, setQueue] = useState(null); // 排隊狀態 {admitted, position, eta}
   const [showConfirm, setShowConfirm] = useState(false);
   const [showVerify, setShowVerify] = useState(false);
   const [verifyCode, setVerifyCode] = useState('');
@@ -106,11 +144,84 @@ export default function Ticket() {
         const purchasedList = Array.isArray(json?.purchased) ? json.purchased : [];
         console.log('[availability] purchased seats =', purchasedList);
         setPurchased(purchasedList);
+        setHeld(decodeSeatBitmap(json?.held, json?.layout));
       } catch (err) {
         console.error('Fetch availability failed', err);
       }
     })();
-  }, [concert, id, eventIdFromUrl]);
+  }, [concert, id, eventIdFromUrl, resyncKey]);
+
+  // 座位即時更新：鎖定 / 釋放 / 逾時 / 售出，取代輪詢
+  useEffect(() => {
+    if (eventID == null) return;
+    const source = new EventSource(
+      `${API_BASE}/ticket/stream?event_id=${encodeURIComponent(eventID)}`,
+      { withCredentials: true }
+    );
+    const seatsOf = (e) => JSON.parse(e.data).seats || [];
+    const removeFrom = (list, seats) => list.filter(x => !seats.some(s => sameSeat(x, s)));
+
+    source.addEventListener('lock', (e) => {
+      const seats = seatsOf(e);
+      setHeld(list => [...removeFrom(list, seats), ...seats]);
+    });
+    const release = (e) => {
+      const seats = seatsOf(e);
+      setHeld(list => removeFrom(list, seats));
+    };
+    source.addEventListener('release', release);
+    source.addEventListener('expire', release);
+    source.addEventListener('sold', (e) => {
+      const seats = seatsOf(e);
+      setHeld(list => removeFrom(list, seats));
+      setPurchased(list => [...removeFrom(list, seats), ...seats]);
+    });
+    source.addEventListener('resync', () => setResyncKey(k => k + 1));
+
+    return () => source.close();
+  }, [eventID]);
+
+  // 排隊：熱門活動需輪到才可選位，等候中每 5 秒輪詢一次（超過 30 秒未輪詢會被移出隊伍）
+  useEffect(() => {
+    if (!eventIdFromUrl) return;
+    let timer = null;
+    let stopped = false;
+    const body = JSON.stringify({ event_id: eventIdFromUrl });
+    const poll = async () => {
+      try {
+        const res = await fetch(`${API_BASE}/queue/join`, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          credentials: 'include',
+          body
+        });
+        const json = await res.json();
+        if (stopped || !json?.status) return;
+        setQueue(json);
+        if (!json.admitted) {
+          timer = setTimeout(poll, 5000);
+        } else if (json.expiresAt) {
+          // 資格到期後重新排隊
+          timer = setTimeout(poll, Math.max(json.expiresAt - Date.now(), 1000));
+        }
+      } catch (err) {
+        console.error('Queue join failed', err);
+        if (!stopped) timer = setTimeout(poll, 5000);
+      }
+    };
+    poll();
+    return () => {
+      stopped = true;
+      clearTimeout(timer);
+      fetch(`${API_BASE}/queue/leave`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        credentials: 'include',
+        keepalive: true,
+        body
+      }).catch(() => {});
+    };
+  }, [eventIdFromUrl]);
 
   // 倒數計時：每秒 -1，為 0 時自動解除鎖
   useEffect(() => {
@@ -325,7 +436,7 @@ export default function Ticket() {
   // 檢查是否已被購/鎖
   const isDisabled = (areaKey, row, col) => {
     const displayArea = areaMap[areaKey] || areaKey;
-    const used = purchased.some(([dbArea, dbRow, dbCol]) =>
+    const used = [...purchased, ...held].some(([dbArea, dbRow, dbCol]) =>
       dbArea === displayArea && Number(dbRow) === Number(row) && Number(dbCol) === Number(col)
     );
     const lockedMine = lockedByMe &&
@@ -391,6 +502,12 @@ export default function Ticket() {
       <h3 className="text-base mb-4 opacity-70">{eventLocation && `${eventLocation} 場`}</h3>
       <div className="bg-black text-white w-[760px] mx-auto py-2 font-bold mb-6">-----------------</div>
 
+      {queue && !queue.admitted && (
+        <div className="w-[760px] mx-auto mb-4 p-3 rounded bg-yellow-100 text-yellow-800 font-semibold">
+          目前購票人數眾多，您排在第 {queue.position} 位，預估最多等候 {Math.ceil(queue.eta / 60)} 分鐘，輪到您後即可選位
+        </div>
+      )}
+
       {/* 上層：搖滾區 */}
       <div className="flex justify-center gap-8 mb-2">
         {seatConfig.slice(0, 3).map(renderSection)}
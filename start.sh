@@ -1 +1 @@
-uvicorn Backend.main:app --host=0.0.0.0 --port=8000
+python -m Backend.Scripts.BuildStatic && uvicorn Backend.main:create_app --factory --host=0.0.0.0 --port=8000